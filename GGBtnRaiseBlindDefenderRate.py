@@ -7,56 +7,63 @@ See `GGPokerHandHistoryParser.py`
 
 # Run
 python3 GGBtnRaiseBlindDefenderRate.py
+Which asks `GGPokerHandHistoryServer.py` for the counts if it's running, rather than loading the hands
 """
 
-import math
-
-from GGPokerHandHistoryParser.GGPokerCraftFileHelpers import load_all_hands
+from GGPokerHandHistoryParser.HandStoreClient import query_hand_store_server
+from GGPokerHandHistoryParser.HandModel import RAISES, SEAT_INDEXES
 
 BLIND = 0.05
 OPEN_RAISE = 2.0
+BTN = SEAT_INDEXES['BTN']
 
 def main():
-    all_hands = load_all_hands()
+    count_hands = load_hand_counter()
 
-    hands_005bb = [hand for hand in all_hands if math.isclose(hand['big_blind'], BLIND)]
-    print(f'Total {BLIND} BBhands: {len(hands_005bb)}')
+    # Filters over the columns of `HandColumns`, where the "first action" is the first one that isn't a fold
+    hands_005bb = [('big_blind', 'isclose', BLIND)]
+    print(f'Total {BLIND} BBhands: {count_hands(hands_005bb)}')
 
-    hands_player_open = [hand for hand in hands_005bb if does_hand_first_action_match(hand, lambda a: a["player_id"] == "Hero")]
-    print(f'Total player open hands: {len(hands_player_open)}')
+    hands_player_open = hands_005bb + [('first_non_fold_is_hero', '==', True)]
+    print(f'Total player open hands: {count_hands(hands_player_open)}')
 
-    hands_player_btn_open = [hand for hand in hands_player_open if does_hand_first_action_match(hand, lambda a: a["seat"] == "BTN")]
-    print(f'Total player BTN open hands: {len(hands_player_btn_open)}')
+    hands_player_btn_open = hands_player_open + [('first_non_fold_seat', '==', BTN)]
+    print(f'Total player BTN open hands: {count_hands(hands_player_btn_open)}')
 
-    hands_player_btn_open_xbb = [hand for hand in hands_player_btn_open if does_hand_first_action_match(hand, lambda a: math.isclose(a["to_amount"], OPEN_RAISE * BLIND))]
-    print(f'Total player BTN open hands {OPEN_RAISE}bb: {len(hands_player_btn_open_xbb)}')
+    hands_player_btn_open_xbb = hands_player_btn_open + open_raise_filters('first_non_fold')
+    n_open_xbb = count_hands(hands_player_btn_open_xbb)
+    print(f'Total player BTN open hands {OPEN_RAISE}bb: {n_open_xbb}')
 
-    button_hands_no_defenders = [hand for hand in hands_player_btn_open if last_action_is_button_open_raise(hand)]
-    print(f'Total player BTN open hands {OPEN_RAISE}bb, no defenders: {len(button_hands_no_defenders)}')
+    # Nobody acted after the open raise, other than folding
+    button_hands_no_defenders = hands_player_btn_open + [
+        ('last_non_fold_is_hero', '==', True),
+        ('last_non_fold_seat', '==', BTN),
+    ] + open_raise_filters('last_non_fold')
+    n_no_defenders = count_hands(button_hands_no_defenders)
+    print(f'Total player BTN open hands {OPEN_RAISE}bb, no defenders: {n_no_defenders}')
 
-    fold_rate = len(button_hands_no_defenders) / len(hands_player_btn_open_xbb)
-    print(f'Out of {len(hands_player_btn_open_xbb)} button hands, {len(button_hands_no_defenders)} immediately folded')
+    fold_rate = n_no_defenders / n_open_xbb
+    print(f'Out of {n_open_xbb} button hands, {n_no_defenders} immediately folded')
     print(f'Thats a {fold_rate * 100}% fold rate')
 
-def is_button_open_raise(action):
-    if action['action'] != 'raises': return False
-    if not math.isclose(action['to_amount'], OPEN_RAISE * BLIND): return False
-    if action['player_id'] != 'Hero': return False
-    if action['seat'] != 'BTN': return False
-    return True
-
-def does_hand_first_action_match(hand, cond):
-    if 'preflop' not in hand: return False
+def open_raise_filters(action_prefix):
+    return [
+        (f'{action_prefix}_action', '==', RAISES),
+        (f'{action_prefix}_amount', 'isclose', OPEN_RAISE * BLIND),
+    ]
 
-    non_fold_actions = [act for act in hand['preflop']['actions'] if act['action'] != 'folds']
-    if len(non_fold_actions) == 0: return False
-    if not cond(non_fold_actions[0]): return False
+def load_hand_counter():
+    """Counts hands with the filters on the hand store server if it's running, otherwise loads the hands"""
+    if query_hand_store_server('ping') is not None:
+        return lambda filters: query_hand_store_server('count', filters=filters)
 
-    return True
+    # Only imported when needed, as they are slow to import
+    import numpy as np
+    from GGPokerHandHistoryParser.HandStore import load_hand_store
+    from GGPokerHandHistoryParser.HandColumns import filter_hand_columns
 
-def last_action_is_button_open_raise(hand):
-    non_fold_actions = [act for act in hand['preflop']['actions'] if act['action'] != 'folds']
-    return is_button_open_raise(non_fold_actions[-1])
+    columns = load_hand_store()['columns']
+    return lambda filters: int(np.count_nonzero(filter_hand_columns(columns, filters)))
 
 if __name__ == '__main__':
     main()
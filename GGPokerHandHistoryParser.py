@@ -4,113 +4,280 @@ You will have to run PreflopChartsExtractor.py to produce the charts JSON. See t
 
 # Run
 python3 GGPokerHandHistoryParser.py
+# Or, to load new downloads in the background while waiting for a command
+python3 GGPokerHandHistoryParser.py --watch
+# Or, to save a cProfile of each command (see `PROFILE_PATH`)
+python3 GGPokerHandHistoryParser.py --profile
+# Or, to keep every hand in a SQLite database (see `HandDatabase`), rather than loading them all each run
+python3 GGPokerHandHistoryParser.py --sqlite
 
 # To export, for another person to use
 python -m PyInstaller GGPokerHandHistoryParser.py -y --add-data 'PreflopChartExtractions/PreflopCharts.json;data'
 # Then compress/send the folder inside /dist/
 """
 
+import cProfile
 import multiprocessing
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 from pathlib import Path
+import sys
+try:
+    import readline
+except ImportError:
+    # Not available on Windows, so there is no tab completion there
+    readline = None
 import traceback
 import re
-from itertools import chain
 
 from GGPokerHandHistoryParser.DesktopPostflopHelpers import gen_desktop_postflop_json
-from GGPokerHandHistoryParser.GGPokerCraftFileHelpers import load_all_hands
+from GGPokerHandHistoryParser.HandStore import load_hand_store, build_hand_store, hand_store_lookups, find_ids_by_prefix
+from GGPokerHandHistoryParser.HandDatabase import open_hand_database, ingest_downloads, hand_database_lookups, query_ids_by_prefix
+from GGPokerHandHistoryParser.DownloadsWatcher import new_shared_hand_store, refresh_shared_hand_store, start_downloads_watcher, take_background_hand_count
 from GGPokerHandHistoryParser.PrintHelpers import print_main_loop_instructions, print_main_loop_instructions, print_hand_error, print_hand, print_hand_short, print_call_and_raise_range, format_result_count
 from GGPokerHandHistoryParser.Utils import InvalidSearchException, DOWNLOADS_DIR
 from GGPokerHandHistoryParser.History import save_to_history_file, last_search_term, print_history
 from GGPokerHandHistoryParser.CsvExportHelpers import export_hands_to_csv
+from GGPokerHandHistoryParser.HandFilters import parse_filter_expression, format_filter_fields
+from GGPokerHandHistoryParser.RangeEquity import calculate_flop_range_equities
+from GGPokerHandHistoryParser.StageTimings import timed_stage, take_stage_timings, copy_stage_timings, format_stage_timings
 
 N_RECENT_HANDS = 10
+DATE_FORMAT = '%Y-%m-%d'
+WATCH_FLAG = '--watch'
+PROFILE_FLAG = '--profile'
+SQLITE_FLAG = '--sqlite'
+# Profiles of the parsing in the pool's workers aren't included
+PROFILE_PATH = Path(Path.home(), Path('.GGPokerHandHistoryParser.prof'))
 
 def main():
     print(f'Download your GG PokerCraft hand history zips into your `{DOWNLOADS_DIR}` directory')
-    hand_cache = load_all_hands({})
 
-    while True:
-        try:
-            print()
-            search_term, result_hand, new_hand_cache = main_loop(hand_cache)
-            hand_cache = new_hand_cache
-            save_to_history_file(search_term, result_hand)
-        except InvalidSearchException as e:
-            print(e)
-        except Exception as e:
-            print('-----------------------------------')
-            print('*** An unexpected error has occurred. Please send Dylan the following contents: ***')
-            traceback.print_exc()
-            print('-----------------------------------')
-
-def main_loop(hand_cache):
+    is_watching = WATCH_FLAG in sys.argv[1:]
+    is_profiling = PROFILE_FLAG in sys.argv[1:]
+    database = open_hand_database() if SQLITE_FLAG in sys.argv[1:] else None
+    if database is not None and is_watching:
+        # SQLite connections can't be shared with the watcher's thread
+        print(f'{WATCH_FLAG} is not supported with {SQLITE_FLAG}, new downloads are added when a command is entered')
+        is_watching = False
+
+    # Kept for the whole session, so parsing new hands doesn't have to start up new processes
+    with multiprocessing.Pool() as pool:
+        # Without the watcher, the first command loads what it needs, so `r` can answer before every file is loaded
+        shared_hand_store = new_shared_hand_store(load_hand_store(pool=pool) if is_watching else build_hand_store({}))
+        if database is not None:
+            install_hand_id_completer(lambda prefix: query_ids_by_prefix(database, prefix))
+        else:
+            install_hand_id_completer(lambda prefix: find_ids_by_prefix(shared_hand_store['hand_store']['id_index'], prefix))
+        if is_watching: start_downloads_watcher(shared_hand_store, pool)
+
+        while True:
+            try:
+                print()
+                search_term, result_hand = main_loop(shared_hand_store, database, pool, is_watching, is_profiling)
+                save_to_history_file(search_term, result_hand, database)
+            except InvalidSearchException as e:
+                print(e)
+            except Exception as e:
+                print('-----------------------------------')
+                print('*** An unexpected error has occurred. Please send Dylan the following contents: ***')
+                traceback.print_exc()
+                print('-----------------------------------')
+
+def main_loop(shared_hand_store, database, pool, is_watching, is_profiling):
     print_main_loop_instructions()
     search_term = input('>>> ').strip()
     print()
-    search_term = reformat_search_term(search_term)
+    search_term = reformat_search_term(search_term, database)
 
+    if search_term == 'p':
+        print_stage_timings()
+        return search_term, []
+
+    # Starts the timings again, so `p` shows just this command's
+    take_stage_timings()
+    with timed_stage(f'command {command_name(search_term)}'), profile_command(is_profiling):
+        result_hands = run_command(search_term, shared_hand_store, database, pool, is_watching)
+    return search_term, result_hands
+
+def run_command(search_term, shared_hand_store, database, pool, is_watching):
     if search_term == 'h':
-        print_history()
-        return search_term, [], hand_cache
+        print_history(database)
+        return []
     if search_term.startswith('c '):
         print_call_and_raise_range(search_term)
-        return search_term, [], hand_cache
-
-    hands_per_file = load_all_hands(hand_cache)
-    hands = list(
-        sorted(
-            chain(*hands_per_file.values()),
-            key=lambda hand: hand['date']
-        )
-    )
+        return []
+    if search_term == 'f':
+        print_filter_fields()
+        return []
+
+    if database is not None:
+        ingest_downloads(database, pool)
+        lookups = hand_database_lookups(database)
+    else:
+        if is_watching:
+            print_background_hands(shared_hand_store)
+        elif search_term == 'r':
+            refresh_shared_hand_store(shared_hand_store, pool, n_recent_hands=N_RECENT_HANDS)
+        else:
+            refresh_shared_hand_store(shared_hand_store, pool)
+        # The watcher may swap in a new hand store at any time, this command sticks to the current one
+        lookups = hand_store_lookups(shared_hand_store['hand_store'])
     result_hands = []
     
     if search_term.startswith('#'):
-        for hand in hands:
-            if hand['id'] != search_term: continue
-            result_hands.append(hand)
+        result_hands = lookups['hands_by_id'](search_term)
+        if len(result_hands) == 0:
+            print_id_prefix_matches(lookups, search_term)
+
+        for hand in result_hands:
             if 'error' in hand:
                 print_hand_error(hand)
                 continue
             print_hand(hand, wait_and_copy_json=gen_desktop_postflop_json(hand))
 
     if search_term == 'a':
-        for hand in hands:
-            if 'error' in hand:
-                print_hand_error(hand)
-                continue
-            print_hand(hand)
-            result_hands.append(hand)
+        hands = lookups['all_hands']()
+        with timed_stage('print_hands', len(hands)):
+            for hand in hands:
+                if 'error' in hand:
+                    print_hand_error(hand)
+                    continue
+                print_hand(hand)
+                result_hands.append(hand)
         for line in format_result_count(search_term, result_hands):
             print(line)
     
     if search_term == 'r':
-        hands_by_id = {}
-        for hand in reversed(hands):
-            if len(hands_by_id) == N_RECENT_HANDS: break
-            if hand['id'] in hands_by_id: continue
-            if 'error' in hand: continue
-            hands_by_id[hand['id']] = hand
-        result_hands = list(hands_by_id.values())
-        result_hands.sort(key=lambda hand: hand['date'])
-        for hand in result_hands: print_hand_short(hand)
+        result_hands = lookups['recent_analysable_hands'](N_RECENT_HANDS)
+        with timed_stage('print_hands', len(result_hands)):
+            for hand in result_hands: print_hand_short(hand)
 
         print()
         print(f'r - {len(result_hands)} analysable')
 
+    if search_term.startswith('d '):
+        start, end = parse_date_range(search_term)
+        result_hands = lookups['hands_by_date'](start, end)
+    if search_term == 't':
+        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        result_hands = lookups['hands_by_date'](today, today + timedelta(days=1))
+    if search_term == 's':
+        result_hands = lookups['last_session_hands']()
+    if search_term.startswith('f '):
+        with timed_stage('filter_hands'):
+            result_hands = lookups['filtered_hands'](search_term[len('f '):])
+    if search_term.startswith('d ') or search_term.startswith('f ') or search_term in ['t', 's']:
+        with timed_stage('print_hands', len(result_hands)):
+            for hand in result_hands: print_hand_short(hand)
+
+        print()
+        for line in format_result_count(search_term, result_hands):
+            print(line)
+
+    if search_term == 'q' or search_term.startswith('q '):
+        hands = lookups['all_hands']() if search_term == 'q' else lookups['hands_by_id'](search_term[len('q '):])
+        # Worked out a flop at a time across the pool, rather than a hand at a time as they print
+        with timed_stage('calculate_flop_range_equities', len(hands)):
+            equities = calculate_flop_range_equities(hands, pool)
+
+        if search_term == 'q':
+            n_hands = sum(equity is not None for equity in equities.values())
+            print(f'Worked out the flop range equities of {n_hands} hands, which are shown with them from now on')
+        else:
+            if len(hands) == 0: print_id_prefix_matches(lookups, search_term[len('q '):])
+            for hand in hands:
+                if 'error' in hand:
+                    print_hand_error(hand)
+                    continue
+                print_hand(hand)
+                result_hands.append(hand)
+
     if search_term == 'e':
-        if len(hands) == 0:
+        hand_columns = lookups['hand_columns']()
+        n_hands = len(hand_columns['id'])
+        if n_hands == 0:
             print('No hands to analyse')
         else:
             export_path = Path(Path(DOWNLOADS_DIR), Path('hands.csv'))
-            export_hands_to_csv(export_path, hands)
+            with timed_stage('export_hands_to_csv', n_hands):
+                n_exported = export_hands_to_csv(export_path, hand_columns)
+
+            print(f'Data exported to {export_path} ({n_exported} new hands)')
+
+    return result_hands
+
+def command_name(search_term):
+    if search_term.startswith('#'): return 'id'
+    return search_term.split()[0]
+
+@contextmanager
+def profile_command(is_profiling):
+    """Saves a cProfile of the command to `PROFILE_PATH`, when profiling"""
+    if not is_profiling:
+        yield
+        return
+
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        profile.dump_stats(PROFILE_PATH)
+        print(f'Profile saved to {PROFILE_PATH}, view it with `python -m pstats {PROFILE_PATH}`')
+
+def print_stage_timings():
+    # Copied, as the watcher may be recording stages meanwhile
+    timings = copy_stage_timings()
+    if len(timings) == 0:
+        print('No command has been timed yet')
+        return
+    print('Timings of the last command:')
+    for line in format_stage_timings(timings): print(line)
 
-            print(f'Data exported to {export_path}')
+def print_filter_fields():
+    print('Filter the hands with e.g. `f seat = BTN and opponent_seat = BB and n_bet = 2 and bb = 0.05 and win_loss_bb < -20`')
+    print('Compare with = != < <= > >= (yes/no fields can be on their own, e.g. `not oop`), combine with and, or, not and brackets. The fields are:')
+    for line in format_filter_fields(): print(f'- {line}')
 
-    return search_term, result_hands, hands_per_file
+def print_background_hands(shared_hand_store):
+    n_hands = take_background_hand_count(shared_hand_store)
+    if n_hands > 0: print(f'Loaded {n_hands} new hands in the background')
 
-def reformat_search_term(search_term):
-    if search_term in ['h', 'a', 'r']: return search_term
+def print_id_prefix_matches(lookups, prefix):
+    hand_ids = lookups['ids_by_prefix'](prefix)
+    if len(hand_ids) == 0: return
+
+    print(f'No hand with ID `{prefix}`, but {len(hand_ids)} hand IDs start with it:')
+    for hand_id in hand_ids[:N_RECENT_HANDS]:
+        print_hand_short(lookups['hands_by_id'](hand_id)[-1])
+    if len(hand_ids) > N_RECENT_HANDS:
+        print(f'...and {len(hand_ids) - N_RECENT_HANDS} more')
+
+def install_hand_id_completer(find_hand_ids):
+    """Completes partial hand IDs at the prompt when TAB is pressed, `find_hand_ids` finds the IDs starting with a prefix"""
+    if readline is None: return
+
+    def complete(text, state):
+        prefix = text if text.startswith('#') else '#' + text
+        if len(prefix) < len('#RC'): return None
+        hand_ids = find_hand_ids(prefix)
+        if state >= len(hand_ids): return None
+        # Keep the `#` off the completion if it wasn't typed
+        return hand_ids[state] if text.startswith('#') else hand_ids[state][1:]
+
+    readline.set_completer(complete)
+    readline.set_completer_delims(' ')
+    readline.parse_and_bind('tab: complete')
+
+def parse_date_range(search_term):
+    """The start and (exclusive) end of `d 2026-10-01 2026-10-07`, from the start of the first day to the end of the last"""
+    days = [datetime.strptime(day, DATE_FORMAT) for day in search_term.split()[1:]]
+    return days[0], days[-1] + timedelta(days=1)
+
+def reformat_search_term(search_term, database=None):
+    if search_term in ['h', 'a', 'r', 't', 's', 'p', 'f', 'q']: return search_term
 
     if search_term.startswith('RC'):
         search_term = '#' + search_term
@@ -123,12 +290,30 @@ def reformat_search_term(search_term):
         return search_term
 
     if search_term == 'l':
-        last_term = last_search_term() or ''
+        last_term = last_search_term(database) or ''
         print(f'Last search term: `{last_term}`')
-        return reformat_search_term(last_term.strip())
+        return reformat_search_term(last_term.strip(), database)
 
     if search_term.startswith('c '):
         return search_term
+    if search_term.startswith('d '):
+        search_term = ' '.join(search_term.split())
+        try:
+            if len(search_term.split()) > 3: raise ValueError()
+            parse_date_range(search_term)
+        except ValueError:
+            raise InvalidSearchException(f'Invalid dates `{search_term}`, expected e.g. `d 2026-10-01 2026-10-07`')
+        return search_term
+    if search_term.startswith('q '):
+        hand_id = reformat_search_term(search_term[len('q '):].strip(), database)
+        if not hand_id.startswith('#'):
+            raise InvalidSearchException(f'Invalid hand ID `{hand_id}`, expected e.g. `q #RC1800277957`')
+        return f'q {hand_id}'
+    if search_term.startswith('f '):
+        search_term = f'f {search_term[len("f "):].strip()}'
+        # Checked before loading any hands
+        parse_filter_expression(search_term[len('f '):])
+        return search_term
     if search_term == 'e':
         return search_term
 
@@ -0,0 +1,125 @@
+"""
+All-in adjusted results: when the money goes in before the river, and the cards of everyone left
+in the hand are known, the hero's result is what they would win on average over every runout of
+the rest of the board, rather than what the board that came gave them.
+
+Every runout is scored at once with `HandEvaluator.evaluate_on_boards`. The hero's shares of the
+pots are cached per matchup, with the suits relabelled so that matchups that only differ by suits
+(e.g. `AhKh` vs `QsQd` and `AsKs` vs `QhQd`) share an entry, keeping the most recently used.
+"""
+
+from functools import lru_cache
+
+import numpy as np
+
+from GGPokerHandHistoryParser.Utils import STREETS
+from GGPokerHandHistoryParser.HandModel import CARD_IDS, FOLDS
+from GGPokerHandHistoryParser.HandEvaluator import evaluate_on_boards, load_boards_without, canonical_suits
+from GGPokerHandHistoryParser.HandDiskCache import CACHE_SIZE_CAP_BYTES
+from GGPokerHandHistoryParser.StageTimings import timed_stage
+
+# The board cards dealt by the end of each street, all-ins before the river have cards to come
+N_BOARD_CARDS = [0, 3, 4, 5]
+# Stacks below this are all in, as the stacks are worked out from rounded amounts
+ALL_IN_STACK = 0.005
+# An entry and its key take about 1KB, so the cache stays within the disk cache's cap
+MAX_CACHED_MATCHUPS = CACHE_SIZE_CAP_BYTES // 1024
+
+def calculate_all_in_ev(hand):
+    """
+    `(all_in_street, hero_equity, hero_ev_win_loss_post_rake_fees)` of the hand. The street is an
+    index into `STREETS`, or -1 when the hero wasn't all in (or called one) with cards to come.
+    The equity is NaN when anyone's cards weren't shown, and then the EV is the actual result
+    """
+    hero = hand.players['Hero']
+    all_in = find_all_in(hand)
+    if all_in is None: return (-1, np.nan, hero.win_loss_post_rake_fees)
+    street_i, player_ids = all_in
+
+    hole_cards = [hand.players[player_id].hole_cards for player_id in player_ids]
+    board = hand.board[:N_BOARD_CARDS[street_i]]
+    if any(cards is None or len(cards) != 2 for cards in hole_cards) or len(board) != N_BOARD_CARDS[street_i]:
+        return (street_i, np.nan, hero.win_loss_post_rake_fees)
+    if not all(card in CARD_IDS for card in [*board, *(card for cards in hole_cards for card in cards)]):
+        return (street_i, np.nan, hero.win_loss_post_rake_fees)
+
+    pots = find_pots(hand, player_ids)
+    shares = hero_pot_shares(
+        tuple(tuple(CARD_IDS[card] for card in cards) for cards in hole_cards),
+        tuple(CARD_IDS[card] for card in board),
+        tuple(eligible for _, eligible in pots),
+    )
+    # The pots are taken as raked in proportion, as the rake is only given for the whole pot
+    pot_after_rake = hand.pot - hand.rake - hand.jackpot_fees
+    rake_fraction = pot_after_rake / hand.pot if hand.pot else 1.0
+    ev_win = sum(amount * share for (amount, _), share in zip(pots, shares)) * rake_fraction
+    return (street_i, shares[0], ev_win - hero.loss)
+
+def find_all_in(hand):
+    """
+    `(street_i, player_ids)` of the street that ends with at most one of the players left in with
+    chips, with the hero among them and board cards to come. The hero is the first player
+    """
+    folded = set()
+    for street_i, street in enumerate(STREETS[:-1]):
+        street_state = getattr(hand, street)
+        if street_state is None: return None
+        folded.update(action.player_id for action in street_state.actions if action.action == FOLDS)
+        player_ids = [player_id for player_id in hand.players if player_id not in folded]
+        if 'Hero' not in player_ids or len(player_ids) < 2: return None
+
+        n_with_chips = sum(street_state.new_stacks[player_id] > ALL_IN_STACK for player_id in player_ids)
+        if n_with_chips <= 1:
+            player_ids.remove('Hero')
+            return street_i, ['Hero', *player_ids]
+    return None
+
+def find_pots(hand, player_ids):
+    """
+    `(amount, eligible)` of the main pot and each side pot, where `eligible` are the indexes of the
+    `player_ids` that can win it. Folded players' money is in the pots they put it in
+    """
+    # Nothing is bet after the all in, so the losses are what went in
+    contributions = {player_id: player.loss for player_id, player in hand.players.items()}
+    levels = sorted({contributions[player_id] for player_id in player_ids})
+    pots = []
+    previous_level = 0.0
+    for level in levels:
+        amount = sum(min(contribution, level) - min(contribution, previous_level) for contribution in contributions.values())
+        eligible = tuple(i for i, player_id in enumerate(player_ids) if contributions[player_id] >= level)
+        pots.append((amount, eligible))
+        previous_level = level
+    # Anything folded players put in above the last level goes to the last pot
+    dead_amount = sum(max(contribution - previous_level, 0.0) for contribution in contributions.values())
+    amount, eligible = pots[-1]
+    pots[-1] = (amount + dead_amount, eligible)
+    return pots
+
+def hero_pot_shares(hole_cards, board, eligible_per_pot):
+    """The hero's (the first hole cards) average share of each pot, over every runout of the board"""
+    return runout_pot_shares(*canonical_suits(hole_cards, board), eligible_per_pot)
+
+@lru_cache(maxsize=MAX_CACHED_MATCHUPS)
+def runout_pot_shares(hole_cards, board, eligible_per_pot):
+    with timed_stage('evaluate_runouts'):
+        boards = load_boards_without(5 - len(board), [card_id for cards in hole_cards for card_id in cards] + list(board))
+        scores = np.stack([evaluate_on_boards([*cards, *board], boards) for cards in hole_cards])
+
+    shares = []
+    for eligible in eligible_per_pot:
+        if 0 not in eligible:
+            shares.append(0.0)
+            continue
+        opponents = [i for i in eligible if i != 0]
+        if len(opponents) == 0:
+            shares.append(1.0)
+            continue
+        best_opponent_scores = scores[opponents[0]]
+        for i in opponents[1:]: best_opponent_scores = np.maximum(best_opponent_scores, scores[i])
+
+        n_wins = np.count_nonzero(scores[0] > best_opponent_scores)
+        # Split pots are shared between everyone with the best hand, which is rare enough to count slowly
+        ties = np.flatnonzero(scores[0] == best_opponent_scores)
+        n_tied_opponents = sum((scores[i, ties] == scores[0, ties]).astype(np.int8) for i in opponents)
+        shares.append(float((n_wins + (1.0 / (1 + n_tied_opponents)).sum()) / scores.shape[1]))
+    return tuple(shares)
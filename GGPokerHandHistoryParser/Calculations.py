@@ -1,5 +1,6 @@
 from GGPokerHandHistoryParser.Utils import NonAnalyzableHandException, POSTFLOP_SEAT_ORDER, find_index_where, get_postflop_seat, format_action_description, STREETS
 from GGPokerHandHistoryParser.Ranges import find_chart, get_range_from_chart
+from GGPokerHandHistoryParser.HandModel import RAISES, CALLS, FOLDS
 
 def calculate_effective_stack_size_on_flop(hand):
     oop_id = hand['oop']['player_id']
@@ -8,12 +9,17 @@ def calculate_effective_stack_size_on_flop(hand):
     return min(stacks[oop_id], stacks[ip_id])
 
 def calculate_positions_for_hand(hand):
-    if 'error' in hand:
-        return { 'id': hand['id'], 'error': hand['error'] }
+    if hand.error is not None:
+        return { 'id': hand.id, 'error': hand.error }
     
     chart_inputs = gen_preflop_chart_inputs(hand)
     return calculate_positions(chart_inputs)
 
+def set_positions(hand, positions):
+    if 'oop' not in positions: return
+    hand.oop = positions['oop']
+    hand.ip = positions['ip']
+
 def calculate_positions(chart_inputs):
     raise_chart = find_chart(chart_inputs['raise']['seat'], chart_inputs['raise']['vs_raisers'])
     raise_range = get_range_from_chart(raise_chart, 'raise')
@@ -52,31 +58,31 @@ def calculate_positions(chart_inputs):
     return { 'oop': positions[0], 'ip': positions[1] }
 
 def gen_preflop_chart_inputs(hand):
-    last_raise = hand['preflop']['raises'][-1]
-    call = hand['preflop']['call']
+    last_raise = hand.preflop.raises[-1]
+    call = hand.preflop.call
 
     return {
         'raise': {
-            'seat': last_raise['seat'],
+            'seat': POSTFLOP_SEAT_ORDER[last_raise.seat],
             'vs_raisers': list(reversed([
-                action['seat'] for action in hand['preflop']['raises'][:-1]
+                POSTFLOP_SEAT_ORDER[action.seat] for action in hand.preflop.raises[:-1]
             ])),
-            'player_id': last_raise['player_id'],
+            'player_id': last_raise.player_id,
         },
         'call': {
-            'seat': call['seat'],
+            'seat': POSTFLOP_SEAT_ORDER[call.seat],
             'vs_raisers': list(reversed([
-                action['seat'] for action in hand['preflop']['raises']
+                POSTFLOP_SEAT_ORDER[action.seat] for action in hand.preflop.raises
             ])),
-            'player_id': call['player_id'],
+            'player_id': call.player_id,
         }
     }
 
-def calculate_preflop_actions_for_chart(hand):
+def calculate_preflop_call_for_chart(hand):
     """
     If the hero's last action was a fold:
     - nothing to do as there is no hand to analyse
-    Otherwise:
+    Otherwise, return the call of the last raise:
     - find the number of raises
     - find the seat of the last raise
     - find the seat of the call (after last raise)
@@ -87,26 +93,26 @@ def calculate_preflop_actions_for_chart(hand):
     """
     validate_hero_played_preflop(hand)
 
-    actions = hand['preflop']['actions']
-    last_raise_action_i = find_index_where(lambda act: act['action'] == 'raises', actions, from_end=True)
+    actions = hand.preflop.actions
+    last_raise_action_i = find_index_where(lambda act: act.action == RAISES, actions, from_end=True)
     if last_raise_action_i is None:
         raise NonAnalyzableHandException("We don't have charts for the player limping")
 
-    final_raise_calls = [ action for action in actions[last_raise_action_i + 1:] if action['action'] == 'calls']
+    final_raise_calls = [ action for action in actions[last_raise_action_i + 1:] if action.action == CALLS]
 
     if len(final_raise_calls) == 0:
         raise NonAnalyzableHandException("There was no preflop caller")
     if len(final_raise_calls) > 1:
         raise NonAnalyzableHandException("Solvers will not support multiway pots")
 
-    return { 'call': final_raise_calls[0] }
+    return final_raise_calls[0]
 
 def validate_hero_played_preflop(hand):
-    actions = hand['preflop']['actions']
-    last_hero_action_i = find_index_where(lambda act: act['player_id'] == 'Hero', actions, from_end=True)
+    actions = hand.preflop.actions
+    last_hero_action_i = find_index_where(lambda act: act.player_id == 'Hero', actions, from_end=True)
     if last_hero_action_i is None:
         raise NonAnalyzableHandException("Hero performed no actions")
-    if actions[last_hero_action_i]['action'] == 'folds':
+    if actions[last_hero_action_i].action == FOLDS:
         raise NonAnalyzableHandException("Last hero action is a fold")
 
 def get_round_aggressor(round_key, hand):
@@ -120,19 +126,20 @@ def get_round_aggressor(round_key, hand):
 
 def calculate_losses(hand):
     for street in reversed(STREETS):
-        if street not in hand: continue
+        street_state = getattr(hand, street)
+        if street_state is None: continue
 
-        end_stacks = hand[street]['new_stacks'] # before collecting win
-        players = hand['players']
+        end_stacks = street_state.new_stacks # before collecting win
+        players = hand.players
         
         for player_id, player in players.items():
-            loss = player['initial_stack'] - end_stacks[player_id] 
-            player['loss'] = loss
+            loss = player.initial_stack - end_stacks[player_id] 
+            player.loss = loss
 
         return
 
 def calculate_winlosses(hand):
-    for player in hand['players'].values():
-        win = player.get('win_post_rake_fees', 0)
-        loss = player.get('loss', 0)
-        player['win_loss_post_rake_fees'] = win - loss
+    for player in hand.players.values():
+        win = 0 if player.win_post_rake_fees is None else player.win_post_rake_fees
+        loss = 0 if player.loss is None else player.loss
+        player.win_loss_post_rake_fees = win - loss
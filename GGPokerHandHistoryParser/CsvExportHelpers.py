@@ -1,81 +1,140 @@
-from GGPokerHandHistoryParser.Utils import POSTFLOP_SEAT_ORDER
-from GGPokerHandHistoryParser.PrintHelpers import format_cards
+import csv
+import json
+import os
+from pathlib import Path
 
-def export_hands_to_csv(filename, hands):
-    bankroll = 0.0
+import numpy as np
 
-    with open(filename, 'w') as export:
-        for hand_i, hand in enumerate(hands):
-            win_loss = hand['players']['Hero']['win_loss_post_rake_fees']
-            bankroll = bankroll + win_loss
+from GGPokerHandHistoryParser.Utils import POSTFLOP_SEAT_ORDER, STREETS
+from GGPokerHandHistoryParser.HandModel import CARDS
+from GGPokerHandHistoryParser.HandColumns import take_hand_columns
 
-            tuples = hand_to_tuples(hand, hand_i, bankroll)
+# Hands formatted and written at a time, so the text of a big history isn't all in memory at once
+EXPORT_CHUNK_SIZE = 10000
 
-            if hand_i == 0:
-                write_csv_row(export, list(key for key, _ in tuples))
+def export_hands_to_csv(filename, hand_columns, append=True):
+    """
+    Writes the hands (see `HandColumns`) to the CSV, returning how many were written.
+    With `append`, if the CSV still starts with the hands of the last export, only the hands after
+    those are added, carrying on the bankrolls from the checkpoint of the last export
+    """
+    n_hands = len(hand_columns['id'])
+    header = [key for key, _ in hand_columns_to_csv_columns(take_hand_columns(hand_columns, slice(0, 0)))]
 
-            write_csv_row(export, list(value for _, value in tuples))
-            
-def write_csv_row(file, values):
-    for col_i, value in enumerate(values):
-        file.write(value)
-        if col_i < len(values) - 1:
-            file.write(',')
-    file.write('\n')
+    checkpoint = find_resume_checkpoint(filename, header, hand_columns) if append else None
+    start_i = checkpoint['n_hands'] if checkpoint else 0
+    bankroll = checkpoint['bankroll'] if checkpoint else 0.0
+    ev_bankroll = checkpoint['ev_bankroll'] if checkpoint else 0.0
 
+    with open(filename, 'a' if checkpoint else 'w', newline='') as export:
+        writer = csv.writer(export, lineterminator='\n')
+        if not checkpoint and n_hands > 0: writer.writerow(header)
 
-def hand_to_tuples(hand, hand_i, bankroll):
-    win_loss = hand['players']['Hero']['win_loss_post_rake_fees']
-    rake = hand['rake'] if win_loss > 0 else 0
-    fees = hand['jackpot_fees'] if win_loss > 0 else 0
+        for chunk_start_i in range(start_i, n_hands, EXPORT_CHUNK_SIZE):
+            chunk = take_hand_columns(hand_columns, slice(chunk_start_i, chunk_start_i + EXPORT_CHUNK_SIZE))
+            csv_columns = hand_columns_to_csv_columns(chunk, chunk_start_i, bankroll, ev_bankroll)
+            writer.writerows(zip(*(values for _, values in csv_columns)))
+            bankroll = float(dict(csv_columns)['relative_bankroll'][-1])
+            ev_bankroll = float(dict(csv_columns)['ev_relative_bankroll'][-1])
 
-    preflop_raises = hand.get('preflop', {}).get('raises', [])
+    if n_hands > 0:
+        write_export_checkpoint(filename, {
+            'columns': header,
+            'n_hands': n_hands,
+            'last_hand_id': str(hand_columns['id'][-1]),
+            'last_date': str(hand_columns['date'][-1]),
+            'bankroll': bankroll,
+            'ev_bankroll': ev_bankroll,
+            'size': os.stat(filename).st_size,
+        })
 
-    hero_did_vpip_preflop = any(
-        action['player_id'] == 'Hero'
-        and action['action'] not in ['folds', 'checks']
-        for action in hand.get('preflop', {}).get('actions', [])
-    )
+    return n_hands - start_i
 
-    flop_actions = hand.get('flop', {}).get('actions', [])
-    hero_is_postflop = any(
-        action.get('player_id') == 'Hero'
-        and action.get('action') != 'shows'
-        for action in flop_actions
-    )
+def export_checkpoint_path(filename):
+    return Path(f'{filename}.checkpoint.json')
 
-    flop_player_ids = { action['player_id'] for action in flop_actions }
+def read_export_checkpoint(filename):
+    try:
+        with open(export_checkpoint_path(filename), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
 
-    oop = hand.get('oop', { 'action': None, 'player_id': None })
-    ip = hand.get('ip', { 'action': None, 'player_id': None })
-    is_raiser = (
-        (oop['action'] == 'raise' and oop['player_id'] == 'Hero')
-        or (ip['action'] == 'raise' and ip['player_id'] == 'Hero')
-    )
+def write_export_checkpoint(filename, checkpoint):
+    with open(export_checkpoint_path(filename), 'w') as f:
+        json.dump(checkpoint, f)
 
-    hole_cards = format_cards(hand['players']['Hero']['hole_cards'], with_border=False).split(' ')
+def find_resume_checkpoint(filename, header, hand_columns):
+    """The checkpoint of the last export, if the CSV can be appended to"""
+    checkpoint = read_export_checkpoint(filename)
+    if checkpoint is None: return None
+    if checkpoint.get('columns') != header: return None
+
+    # The hands of the last export must still be the first hands, unchanged by an older history
+    # being downloaded since
+    n_exported = checkpoint['n_hands']
+    if n_exported == 0 or n_exported > len(hand_columns['id']): return None
+    if str(hand_columns['id'][n_exported - 1]) != checkpoint['last_hand_id']: return None
+    if str(hand_columns['date'][n_exported - 1]) != checkpoint['last_date']: return None
+
+    # Or the CSV changed since
+    try:
+        if os.stat(filename).st_size != checkpoint['size']: return None
+    except OSError:
+        return None
+
+    return checkpoint
+
+def format_column(values):
+    return np.array([str(value) for value in values.tolist()], dtype=np.str_)
+
+def hand_columns_to_csv_columns(columns, first_hand_i=0, start_bankroll=0.0, start_ev_bankroll=0.0):
+    """
+    The CSV columns of the hands (see `HandColumns`), as arrays of strings, for the hands from
+    `first_hand_i` of the export on, when the bankrolls before them were `start_bankroll` and
+    `start_ev_bankroll`
+    """
+    win_loss = columns['hero_win_loss_post_rake_fees']
+    did_win = win_loss > 0
+    # Summed in the same order as when exporting every hand, so the figures match to the last bit
+    bankroll = np.cumsum(np.concatenate([[start_bankroll], win_loss]))[1:]
+    ev_win_loss = columns['hero_ev_win_loss_post_rake_fees']
+    ev_bankroll = np.cumsum(np.concatenate([[start_ev_bankroll], ev_win_loss]))[1:]
+
+    # Non winners have a win of `0`, not `0.0`
+    win = np.where(columns['hero_win_post_rake_fees'] == 0, '0', format_column(columns['hero_win_post_rake_fees']))
+
+    hole_cards = np.array(CARDS)[columns['hero_hole_cards']]
+    # Blank when the hero wasn't all in, the last of the names is for the -1s
+    all_in_street = np.array([*STREETS, ''])[columns['all_in_street']]
+    all_in_equity = np.where(np.isnan(columns['hero_all_in_equity']), '', format_column(columns['hero_all_in_equity']))
 
     return [
-        ('hand_id',                  hand['id']),
-        ('hand_no',                  str(hand_i + 1)),
-        ('date_utc',                 str(hand['date'])),
-        ('big_blind',                str(hand['big_blind'])),
-        ('seat',                     hand['players']['Hero']['seat']),
-        ('seat_index',               str(POSTFLOP_SEAT_ORDER.index(hand['players']['Hero']['seat']))),
-        ('win_loss_post_rake_fees',  str(win_loss)),
-        ('win_post_rake_fees',       str(hand['players']['Hero']['win_post_rake_fees'])),
-        ('loss',                     str(hand['players']['Hero']['loss'])),
-        ('rake_paid',                str(rake)),
-        ('jackpot_fees',             str(fees)),
-        ('relative_bankroll',        str(bankroll)),
-        ('hero_is_postflop',         str(hero_is_postflop)),
-        ('preflop_n_bet',            str(len(preflop_raises) + 1)),
-        ('preflop_is_raiser',        str(is_raiser)),
-        ('postflop_is_oop_heads_up', str(oop['player_id'] == 'Hero')),
-        ('postflop_is_ip_heads_up',  str(ip['player_id'] == 'Hero')),
-        ('postflop_n_way',           str(len(flop_player_ids))),
-        ('hero_did_vpip',            str(hero_did_vpip_preflop)), # TODO handle vpip postflop if BB check preflop
-        ('win_loss_bb',              str(win_loss / hand['big_blind'])),
-        ('hole_card_1',              str(hole_cards[0])),
-        ('hole_card_2',              str(hole_cards[1])),
+        ('hand_id',                  columns['id']),
+        ('hand_no',                  format_column(np.arange(first_hand_i + 1, first_hand_i + len(win_loss) + 1))),
+        ('date_utc',                 format_column(columns['date'].astype(object))),
+        ('big_blind',                format_column(columns['big_blind'])),
+        ('seat',                     np.array(POSTFLOP_SEAT_ORDER)[columns['hero_seat']]),
+        ('seat_index',               format_column(columns['hero_seat'])),
+        ('win_loss_post_rake_fees',  format_column(win_loss)),
+        ('win_post_rake_fees',       win),
+        ('loss',                     format_column(columns['hero_loss'])),
+        ('rake_paid',                np.where(did_win, format_column(columns['rake']), '0')),
+        ('jackpot_fees',             np.where(did_win, format_column(columns['jackpot_fees']), '0')),
+        ('relative_bankroll',        format_column(bankroll)),
+        ('hero_is_postflop',         format_column(columns['hero_is_postflop'])),
+        ('preflop_n_bet',            format_column(columns['preflop_n_bet'])),
+        ('preflop_is_raiser',        format_column(columns['preflop_is_raiser'])),
+        ('postflop_is_oop_heads_up', format_column(columns['hero_is_oop'])),
+        ('postflop_is_ip_heads_up',  format_column(columns['hero_is_ip'])),
+        ('postflop_n_way',           format_column(columns['postflop_n_way'])),
+        ('hero_did_vpip',            format_column(columns['hero_did_vpip'])), # TODO handle vpip postflop if BB check preflop
+        ('win_loss_bb',              format_column(win_loss / columns['big_blind'])),
+        ('hole_card_1',              hole_cards[:, 0]),
+        ('hole_card_2',              hole_cards[:, 1]),
+        ('all_in_street',            all_in_street),
+        ('all_in_equity',            all_in_equity),
+        ('ev_win_loss_post_rake_fees', format_column(ev_win_loss)),
+        ('ev_win_loss_bb',           format_column(ev_win_loss / columns['big_blind'])),
+        ('ev_relative_bankroll',     format_column(ev_bankroll)),
     ]
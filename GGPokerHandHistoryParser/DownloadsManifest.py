@@ -0,0 +1,97 @@
+"""
+Manifest of the downloaded PokerCraft zips and the hand history files extracted from them.
+
+This lets the file helpers only open zips that are new or changed, and skip re-hashing files that
+have not changed since the last run. It also has when the last hand of each loaded file was played,
+for `HandStore.load_recent_hand_store` to know which files only have older hands.
+"""
+
+from datetime import datetime
+import json
+import os
+from pathlib import Path
+
+from GGPokerHandHistoryParser.HandDiskCache import file_content_hash, hand_cache_key
+
+MANIFEST_PATH = Path(Path.home(), Path('.GGPokerHandHistoryParser.manifest.json'))
+MANIFEST_VERSION = 4
+
+def empty_manifest():
+    return {
+        'version': MANIFEST_VERSION,
+        # zip path -> { 'size', 'mtime', 'members': [{ 'name', 'hash' }] }
+        'zips': {},
+        # file path -> { 'size', 'mtime', 'hash' }
+        'file_hashes': {},
+        # hand cache key -> when the file's last hand was played, None for a file without hands
+        'last_hand_dates': {},
+    }
+
+def read_manifest():
+    try:
+        with open(MANIFEST_PATH, 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return empty_manifest()
+
+    if manifest.get('version') != MANIFEST_VERSION: return empty_manifest()
+    return manifest
+
+def write_manifest(manifest):
+    temp_path = Path(f'{MANIFEST_PATH}.{os.getpid()}.tmp')
+    with open(temp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(temp_path, MANIFEST_PATH)
+
+def is_unchanged(entry, stat):
+    if entry is None: return False
+    return entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime
+
+def manifest_hand_cache_key(manifest, file):
+    """The `hand_cache_key` for the file, only re-hashing the file if it changed since the last hash"""
+    stat = os.stat(file)
+    entry = manifest['file_hashes'].get(str(file))
+    if is_unchanged(entry, stat): return hand_cache_key(entry['hash'])
+
+    content_hash = file_content_hash(file)
+    manifest['file_hashes'][str(file)] = {
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+        'hash': content_hash,
+    }
+    return hand_cache_key(content_hash)
+
+def prune_file_hashes(manifest, files):
+    files = {str(file) for file in files}
+    manifest['file_hashes'] = {
+        file: entry
+        for file, entry in manifest['file_hashes'].items()
+        if file in files
+    }
+
+def prune_last_hand_dates(manifest, keys):
+    manifest['last_hand_dates'] = {
+        key: date
+        for key, date in manifest['last_hand_dates'].items()
+        if key in keys
+    }
+
+def read_last_hand_dates():
+    """When the last hand of each file loaded before was played, by hand cache key"""
+    return {
+        key: None if date is None else datetime.fromisoformat(date)
+        for key, date in read_manifest()['last_hand_dates'].items()
+    }
+
+def record_last_hand_dates(last_hand_dates):
+    """Adds the `{ key: date }` last hand dates of the files not loaded before"""
+    manifest = read_manifest()
+    new_dates = {
+        key: None if date is None else date.isoformat()
+        for key, date in last_hand_dates.items()
+        if key not in manifest['last_hand_dates']
+    }
+    if len(new_dates) == 0: return
+
+    manifest['last_hand_dates'].update(new_dates)
+    write_manifest(manifest)
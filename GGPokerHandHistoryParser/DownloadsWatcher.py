@@ -0,0 +1,121 @@
+"""
+Watches the downloads in the background, loading new hand histories into the hand store while the
+prompt waits for a command, so the commands answer straight away.
+
+The hand store is shared as `{ 'hand_store', 'lock', 'background_loads' }`. Loading builds a new
+hand store, which is swapped in whole, so a command can keep using the one it started with.
+"""
+
+import os
+import queue
+import threading
+import time
+import traceback
+
+from GGPokerHandHistoryParser.Utils import DOWNLOADS_DIR
+from GGPokerHandHistoryParser.GGPokerCraftFileHelpers import is_download_file
+from GGPokerHandHistoryParser.HandStore import load_hand_store, load_recent_hand_store
+
+WATCH_POLL_SECONDS = 5
+
+def new_shared_hand_store(hand_store):
+    return {
+        'hand_store': hand_store,
+        # Held while loading, so only one load writes the caches at a time
+        'lock': threading.Lock(),
+        # The number of hands added by each background load, not yet reported
+        'background_loads': queue.SimpleQueue(),
+    }
+
+def refresh_shared_hand_store(shared_hand_store, pool, quiet=False, n_recent_hands=None):
+    """
+    Loads any new hands, swapping in the new hand store. Returns the number of hands added.
+    With `n_recent_hands`, only loads enough to find that many recent hands (see `load_recent_hand_store`)
+    """
+    with shared_hand_store['lock']:
+        hand_store = shared_hand_store['hand_store']
+        if n_recent_hands is None:
+            new_hand_store = load_hand_store(hand_store, pool, quiet)
+        else:
+            new_hand_store = load_recent_hand_store(hand_store, n_recent_hands, pool, quiet)
+        shared_hand_store['hand_store'] = new_hand_store
+    return len(new_hand_store['hands']) - len(hand_store['hands'])
+
+def start_downloads_watcher(shared_hand_store, pool):
+    thread = threading.Thread(target=watch_downloads, args=(shared_hand_store, pool), daemon=True)
+    thread.start()
+    return thread
+
+def watch_downloads(shared_hand_store, pool):
+    loaded_signature, directory_listings = downloads_signature({})
+    previous_signature = loaded_signature
+
+    while True:
+        time.sleep(WATCH_POLL_SECONDS)
+
+        try:
+            signature, directory_listings = downloads_signature(directory_listings)
+            # Waits for the files to stop changing, so zips still downloading aren't read
+            is_settled = signature == previous_signature
+            previous_signature = signature
+            if not is_settled or signature == loaded_signature: continue
+
+            # Not retried until the files change again, if this fails
+            loaded_signature = signature
+            n_hands = refresh_shared_hand_store(shared_hand_store, pool, quiet=True)
+            shared_hand_store['background_loads'].put(n_hands)
+        except Exception:
+            print()
+            print('*** Loading new hands in the background failed: ***')
+            traceback.print_exc()
+
+def take_background_hand_count(shared_hand_store):
+    """The number of hands loaded in the background since the last call"""
+    n_hands = 0
+    while True:
+        try:
+            n_hands += shared_hand_store['background_loads'].get_nowait()
+        except queue.Empty:
+            return n_hands
+
+def downloads_signature(directory_listings):
+    """
+    The size and modified time of every hand history file, which changes whenever one does, and
+    the listings of the download directories for the next call. Only directories whose modified
+    time changed (a file in them was added, removed or renamed) are listed again, but the files
+    are stat'd every time, as a download still being written only changes its own modified time
+    """
+    new_directory_listings = {}
+    signature = []
+    directories = [DOWNLOADS_DIR]
+    while directories:
+        directory = directories.pop()
+        try:
+            mtime_ns = os.stat(directory).st_mtime_ns
+        except OSError:
+            continue
+        listing = directory_listings.get(directory)
+        if listing is None or listing['mtime_ns'] != mtime_ns: listing = list_download_directory(directory, mtime_ns)
+        new_directory_listings[directory] = listing
+        directories.extend(listing['subdirectories'])
+
+        for file in listing['files']:
+            try:
+                stat = os.stat(file)
+            except OSError:
+                continue
+            signature.append((file, stat.st_size, stat.st_mtime_ns))
+    return sorted(signature), new_directory_listings
+
+def list_download_directory(directory, mtime_ns):
+    """The hand history files and subdirectories of a directory, skipping hidden ones like the globs"""
+    listing = {'mtime_ns': mtime_ns, 'files': [], 'subdirectories': []}
+    try:
+        entries = list(os.scandir(directory))
+    except OSError:
+        return listing
+    for entry in entries:
+        if entry.name.startswith('.'): continue
+        if entry.is_dir(): listing['subdirectories'].append(entry.path)
+        elif is_download_file(entry.path): listing['files'].append(entry.path)
+    return listing
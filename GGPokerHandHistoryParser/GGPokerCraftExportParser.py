@@ -1,25 +1,94 @@
-from parse import *
 from datetime import datetime
 import re
 
-from GGPokerHandHistoryParser.Utils import find_index_where, matches_regex, STREETS
+from GGPokerHandHistoryParser.Utils import STREETS
+from GGPokerHandHistoryParser.HandModel import Hand, Player, Action, StreetState, SEAT_INDEXES, BETS, CALLS, RAISES, FOLDS, CHECKS, EXCESS_UNCALLED_BET_RETURNED, action_type_code
 
 SEAT_NUM_TO_SEAT = {
-    1: 'BTN',
-    2: 'SB',
-    3: 'BB',
-    4: 'LJ',
-    5: 'HJ',
-    6: 'CO',
+    1: SEAT_INDEXES['BTN'],
+    2: SEAT_INDEXES['SB'],
+    3: SEAT_INDEXES['BB'],
+    4: SEAT_INDEXES['LJ'],
+    5: SEAT_INDEXES['HJ'],
+    6: SEAT_INDEXES['CO'],
 }
 
-def split_lines_into_segments(hand_lines):
-    header_i = find_index_where(matches_regex(r'Poker Hand .*'), hand_lines)
-    preflop_i = find_index_where(matches_regex(r'\*\*\* HOLE CARDS .*'), hand_lines)
-    flop_i = find_index_where(matches_regex(r'\*\*\* (FLOP|FIRST FLOP) .*'), hand_lines)
+# Precompiled, as these run for every line of every hand
+HEADER_REGEX = re.compile(r"Poker Hand (.+?): Hold'em No Limit \(\$(.+?)/\$(.+?)\) - (.+)")
+SEAT_REGEX = re.compile(r'Seat (\d+): (.+?) \(\$(.+?) in chips\)')
+BLIND_REGEX = re.compile(r'(.+?): posts .+? blind \$(.+)')
+BOARD_CARDS_REGEX = re.compile(r'\[([^\]]+)\]')
+SUMMARY_REGEX = re.compile(r'Total pot \$([\d.]+) \| Rake \$([\d.]+) \| Jackpot \$([\d.]+)')
+WINNER_REGEX = re.compile(r'(\w+) collected \$([\d.]+)')
+UNCALLED_BET_REGEX = re.compile(r'Uncalled bet \(\$([\d.]+)\) returned to (\w+)')
+
+# For each action type with an amount, the text before the amount in the tail of the line, e.g. the tail `$0.10 to $0.15` of `Hero: raises $0.10 to $0.15`
+ACTION_AMOUNT_PREFIXES = {
+    'bets': '$',
+    'calls': '$',
+    'raises': ' to $',
+}
+
+# Section marker line prefixes, only the first line with each is used
+SECTION_MARKERS = [
+    ('preflop', ('*** HOLE CARDS ',)),
+    ('flop', ('*** FLOP ', '*** FIRST FLOP ')),
     # GGPoker calls the end of the hand showdown, not the actual reveal of cards
-    showdown_i = find_index_where(matches_regex(r'\*\*\* (SHOWDOWN|FIRST SHOWDOWN) .*'), hand_lines)
-    summary_i = find_index_where(matches_regex(r'\*\*\* SUMMARY .*'), hand_lines)
+    ('showdown', ('*** SHOWDOWN ', '*** FIRST SHOWDOWN ')),
+    ('summary', ('*** SUMMARY ',)),
+]
+POSTFLOP_STREET_MARKERS = [
+    ('flop', '*** FLOP ***'),
+    ('turn', '*** TURN ***'),
+    ('river', '*** RIVER ***'),
+]
+
+def classify_line(line):
+    if line.startswith('Seat'): return 'seat'
+    if line.startswith('Dealt to Hero'): return 'hero_dealt'
+    if line.startswith('Dealt to '): return 'dealt'
+    if ': posts ' in line: return 'blind'
+    if ' collected $' in line: return 'collected'
+    if 'shows' in line: return 'shows'
+    return 'action'
+
+def split_lines_into_segments(hand_lines):
+    """
+    Splits the hand into its segments in a single pass, classifying each line once by its prefix.
+    The lines that the parsers look for (seats, blinds, shown cards, ...) are collected by type
+    in the same pass, so the parsers don't have to scan the hand again
+    """
+    header_i = None
+    section_i = {}
+    street_i = {}
+    # Only the kinds of lines the parsers look up
+    lines_by_kind = {'seat': [], 'hero_dealt': [], 'blind': [], 'collected': [], 'shows': []}
+
+    for i, line in enumerate(hand_lines):
+        if line.startswith('***'):
+            for section, prefixes in SECTION_MARKERS:
+                if section in section_i or not line.startswith(prefixes): continue
+                section_i[section] = i
+                break
+
+            if 'flop' in section_i and 'showdown' not in section_i:
+                for street, prefix in POSTFLOP_STREET_MARKERS:
+                    if street in street_i or not line.startswith(prefix): continue
+                    street_i[street] = i
+                    break
+            continue
+
+        if header_i is None and line.startswith('Poker Hand '):
+            header_i = i
+            continue
+
+        kind = classify_line(line)
+        if kind in lines_by_kind: lines_by_kind[kind].append((i, line))
+
+    preflop_i = section_i.get('preflop')
+    flop_i = section_i.get('flop')
+    showdown_i = section_i.get('showdown')
+    summary_i = section_i.get('summary')
 
     preflop_full = hand_lines[preflop_i:(flop_i or showdown_i)]
     preflop_actions =  [line for line in preflop_full if not line.startswith('Dealt to')]
@@ -32,164 +101,170 @@ def split_lines_into_segments(hand_lines):
         'preflop_full': preflop_full,
         'preflop': preflop_actions,
         'showdown': hand_lines[showdown_i:summary_i],
-        'summary': hand_lines[summary_i:]
+        'summary': hand_lines[summary_i:],
+        'seats': lines_between(lines_by_kind['seat'], header_i, preflop_i),
+        'blinds': lines_between(lines_by_kind['blind'], header_i, preflop_i),
+        'hero_dealt': lines_between(lines_by_kind['hero_dealt'], preflop_i, flop_i or showdown_i),
+        'collected': [line for _, line in lines_by_kind['collected']],
+        'shows': [],
     }
 
     if not postflop:
         return segments
 
     segments['postflop'] = postflop
-    res = { **segments, **split_postflop_lines(postflop)}
-
-    return res
+    segments['shows'] = lines_between(lines_by_kind['shows'], flop_i, showdown_i)
 
-def split_postflop_lines(lines):
-    flop_i = find_index_where(matches_regex(r'\*\*\* FLOP \*\*\*.*'), lines)
-    turn_i = find_index_where(matches_regex(r'\*\*\* TURN \*\*\*.*'), lines)
-    river_i = find_index_where(matches_regex(r'\*\*\* RIVER \*\*\*.*'), lines)
-    
-    sections = {}
-    
-    if flop_i is not None:
-        sections['flop'] = lines[flop_i:turn_i] if turn_i else lines[flop_i:]
+    flop_street_i, turn_i, river_i = (street_i.get(street) for street, _ in POSTFLOP_STREET_MARKERS)
+    if flop_street_i is not None:
+        segments['flop'] = hand_lines[flop_street_i:(turn_i or showdown_i)]
     if turn_i:
-        sections['turn'] = lines[turn_i:river_i] if river_i else lines[turn_i:]
+        segments['turn'] = hand_lines[turn_i:(river_i or showdown_i)]
     if river_i:
-        sections['river'] = lines[river_i:]
+        segments['river'] = hand_lines[river_i:showdown_i]
+
+    return segments
 
-    return sections
+def lines_between(indexed_lines, start_i, end_i):
+    return [
+        line for i, line in indexed_lines
+        if (start_i is None or i >= start_i) and (end_i is None or i < end_i)
+    ]
 
 def parse_hand_basic(lines):
     segments = split_lines_into_segments(lines)
-    basic_hand = parse_basic_header_meta(segments)
-    basic_hand['players'] = parse_header_players(segments)
-    parse_summary(basic_hand, segments)
-    parse_winners(basic_hand, segments)
-    return basic_hand, segments
+    hand = parse_basic_header_meta(segments)
+    hand.players = parse_header_players(segments)
+    parse_summary(hand, segments)
+    parse_winners(hand, segments)
+    return hand, segments
 
 def parse_hand(segments, hand):
-    hand = {**hand}
-    hand['players'] = parse_shown_cards(segments, hand)
+    """Parses the rest of the hand that `parse_hand_basic` started, in place"""
+    parse_shown_cards(segments, hand)
+    hand.blinds = parse_blinds(segments['blinds'])
 
-    hand['preflop'] = parse_bets_and_new_stacks(
+    hand.preflop = parse_bets_and_new_stacks(
         hand,
         parse_actions(segments['preflop'], hand),
-        players_to_stacks(hand['players']),
+        players_to_stacks(hand.players),
         0,
-        post_blinds=True,
-        segments=segments
+        blinds=hand.blinds
     )
 
-    hand['board'] = parse_board(segments)
+    hand.board = parse_board(segments)
 
-    for i, street in enumerate(STREETS):
-        if i == 0: continue
-        prev_street = STREETS[i - 1]
+    prev_street_state = hand.preflop
+    for street in STREETS[1:]:
         if not street in segments: break
 
-        hand[street] = parse_bets_and_new_stacks(
+        street_state = parse_bets_and_new_stacks(
             hand,
             parse_actions(segments[street], hand),
-            hand[prev_street]['new_stacks'],
-            hand[prev_street]['new_pot']
+            prev_street_state.new_stacks,
+            prev_street_state.new_pot
         )
+        setattr(hand, street, street_state)
+        prev_street_state = street_state
 
     return hand
 
 def players_to_stacks(players):
-    return { name: player['initial_stack'] for name, player in players.items() }
+    return { name: player.initial_stack for name, player in players.items() }
 
 def parse_basic_header_meta(segments):
-    hand_id, small_blind, big_blind, date_str = parse("Poker Hand {}: Hold'em No Limit (${}/${}) - {}", segments['header'][0])
+    header = HEADER_REGEX.fullmatch(segments['header'][0])
+    if not header:
+        raise Exception(f"Unexpected header line: {segments['header'][0]}")
+    hand_id, small_blind, big_blind, date_str = header.groups()
 
     dt = datetime.strptime(date_str, '%Y/%m/%d %H:%M:%S')
 
-    return {
-        "id": hand_id,
-        "small_blind": parse_money_amount(small_blind),
-        "big_blind": parse_money_amount(big_blind),
-        "date": dt,
-    }
+    return Hand(
+        id=hand_id,
+        small_blind=parse_money_amount(small_blind),
+        big_blind=parse_money_amount(big_blind),
+        date=dt,
+    )
 
 def parse_header_players(segments):
     players = {}
-    seat_lines = [line for line in segments['header'] if line.find('Seat') == 0]
-    for line in seat_lines:
-        seat_n, player_id, stack_size_str = parse("Seat {:d}: {} (${} in chips)", line)
-        seat = SEAT_NUM_TO_SEAT[seat_n]
-
-        players[player_id] = {
-            "id": player_id,
-            "seat": seat,
-            "initial_stack": parse_money_amount(stack_size_str)
-        }
+    for line in segments['seats']:
+        seat_match = SEAT_REGEX.fullmatch(line)
+        if not seat_match:
+            raise Exception(f'Unexpected seat line: {line}')
+        seat_n, player_id, stack_size_str = seat_match.groups()
+        seat = SEAT_NUM_TO_SEAT[int(seat_n)]
+
+        players[player_id] = Player(
+            id=player_id,
+            seat=seat,
+            initial_stack=parse_money_amount(stack_size_str)
+        )
     
-    players['Hero']['hole_cards'] = parse_hero_cards(segments)
+    players['Hero'].hole_cards = parse_hero_cards(segments)
 
     return players
 
-def parse_summary(basic_hand, segments):
+def parse_summary(hand, segments):
     for line in segments['summary']:
-        summary = re.match(r'Total pot \$([\d.]+) \| Rake \$([\d.]+) \| Jackpot \$([\d.]+)', line)
+        summary = SUMMARY_REGEX.match(line)
         if not summary: continue
         pot_str, rake_str, jackpot_str = summary.group(1, 2, 3)
 
-        basic_hand['pot'] = float(pot_str)
-        basic_hand['rake'] = float(rake_str)
+        hand.pot = float(pot_str)
+        hand.rake = float(rake_str)
         # Fees for bad beat jackpot
-        basic_hand['jackpot_fees'] = float(jackpot_str)
+        hand.jackpot_fees = float(jackpot_str)
         return
 
     raise Exception(f"Did not find summary in expected format in {segments['summary']}")
 
-def parse_winners(basic_hand, segments):
-    for line in segments['all_lines']:
-        match = re.match(r'(\w+) collected \$([\d.]+)', line)
+def parse_winners(hand, segments):
+    for line in segments['collected']:
+        match = WINNER_REGEX.match(line)
         if not match: continue
         winner, amount_str = match.group(1, 2)
 
-        for player_id, player in basic_hand['players'].items():
-            prev_win = player.get('win_post_rake_fees', 0)
+        for player_id, player in hand.players.items():
+            prev_win = 0 if player.win_post_rake_fees is None else player.win_post_rake_fees
             if winner == player_id:
-                player['win_post_rake_fees'] = float(amount_str) + prev_win
+                player.win_post_rake_fees = float(amount_str) + prev_win
             else:
-                player['win_post_rake_fees'] = prev_win
+                player.win_post_rake_fees = prev_win
 
-def parse_bets_and_new_stacks(hand, street_actions, previous_player_stacks, previous_pot, post_blinds=False, segments={}):
+def parse_bets_and_new_stacks(hand, street_actions, previous_player_stacks, previous_pot, blinds=()):
     # bets the player makes (raising to the latest amount in the list)
-    bets_by_player = {player_id: [] for player_id, _ in hand['players'].items()}
+    bets_by_player = {player_id: [] for player_id in hand.players}
 
-    if post_blinds:
-        for player_id, blind in parse_blinds(segments['header']):
-            bets_by_player[player_id].append(blind)
+    for player_id, blind in blinds:
+        bets_by_player[player_id].append(blind)
 
     for action_obj in street_actions:
-        action = action_obj['action'] # todo rename to type
-        player_id = action_obj['player_id']
-        if action == 'folds': continue
-        if action == 'checks': continue
-        if action == 'bets':
-            bets_by_player[player_id].append(action_obj['amount'])
-        if action == 'raises':
-            bets_by_player[player_id].append(action_obj['to_amount'])
-        if action == 'calls':
+        action = action_obj.action # todo rename to type
+        player_id = action_obj.player_id
+        if action == FOLDS: continue
+        if action == CHECKS: continue
+        if action == BETS or action == RAISES:
+            bets_by_player[player_id].append(action_obj.amount)
+        if action == CALLS:
             bets = bets_by_player[player_id]
             last_bet = 0 if len(bets) == 0 else bets[-1]
-            bets.append(action_obj['amount'] + last_bet)
-        if action == 'excess_uncalled_bet_returned':
+            bets.append(action_obj.amount + last_bet)
+        if action == EXCESS_UNCALLED_BET_RETURNED:
             bets = bets_by_player[player_id]
             last_bet = bets[-1]
-            bets.append(last_bet - action_obj['amount'])
+            bets.append(last_bet - action_obj.amount)
 
     pot_diff = sum(bets[-1] for _, bets in bets_by_player.items() if len(bets) > 0)
 
-    return {
-        'actions': street_actions,
-        'raises': [action for action in street_actions if action['action'] == 'raises'],
-        'bets': bets_by_player,
-        'new_stacks': calculate_player_stacks(previous_player_stacks, [bets_by_player]),
-        'new_pot': pot_diff + previous_pot
-    }
+    return StreetState(
+        actions=street_actions,
+        raises=[action for action in street_actions if action.action == RAISES],
+        bets=bets_by_player,
+        new_stacks=calculate_player_stacks(previous_player_stacks, [bets_by_player]),
+        new_pot=pot_diff + previous_pot
+    )
 
 def calculate_player_stacks(stacks, bets_by_player_list):
     new_stacks = { **stacks }
@@ -205,23 +280,22 @@ def dollars_without_all_in_suffix(str):
 def parse_blinds(lines):
     bets = []
     for line in lines:
-        parsed = parse('{}: posts {} blind ${}', line)
+        parsed = BLIND_REGEX.fullmatch(line)
         if not parsed: continue
-        player_id, _, blind_str = parsed
+        player_id, blind_str = parsed.groups()
         bets.append((player_id, parse_money_amount(blind_str)))
     return bets
 
 def parse_board(segments):
-    if 'river' in segments:
-        a, b, c, d, e = parse('*** RIVER *** [{} {} {} {}] [{}]', segments['river'][0])
-        return [a, b, c, d, e]
-    if 'turn' in segments:
-        a, b, c, d = parse('*** TURN *** [{} {} {}] [{}]', segments['turn'][0])
-        return [a, b, c, d]
-    if 'flop' in segments:
-        a, b, c = parse('*** FLOP *** [{} {} {}]', segments['flop'][0])
-        return [a, b, c]
-    
+    # Each street line has the whole board so far, e.g. `*** TURN *** [7h 2c Jd] [Qs]`
+    for street, n_cards in [('river', 5), ('turn', 4), ('flop', 3)]:
+        if street not in segments: continue
+        line = segments[street][0]
+        cards = ' '.join(BOARD_CARDS_REGEX.findall(line)).split(' ')
+        if len(cards) != n_cards:
+            raise Exception(f'Unexpected board line: {line}')
+        return cards
+
     return []
 
 def parse_actions(lines, hand):
@@ -232,69 +306,52 @@ def parse_actions(lines, hand):
     return actions
 
 def parse_action(line, hand):
-    uncalled_bet = re.match(r'Uncalled bet \(\$([\d.]+)\) returned to (\w+)', line)
+    uncalled_bet = UNCALLED_BET_REGEX.match(line)
     if uncalled_bet:
         amount_str, player_id = uncalled_bet.group(1, 2)
-        return {
-            'player_id': player_id,
-            'action': 'excess_uncalled_bet_returned',
-            'seat': hand['players'][player_id]['seat'],
+        return Action(
+            player_id=player_id,
+            action=EXCESS_UNCALLED_BET_RETURNED,
+            seat=hand.players[player_id].seat,
             # This is the raise minus the amount required to call any previous
             # bet, that call amount will be put in the total pot figure.
-            'amount': float(amount_str)
-        }
+            amount=float(amount_str)
+        )
 
-    parse_result = parse('{}: {}', line)
-    if not parse_result:
+    player_id, separator, full_action = line.partition(': ')
+    if not separator or not player_id or not full_action:
         raise Exception(f'Unexpected action line: {line}')
-    player_id, full_action = parse_result
 
-    if full_action in ['folds', 'checks']:
-        tail = ''
-        action = full_action
-    else:
-        action, tail = parse('{} {}', full_action)
-
-    if action == 'bets':
-        bet = parse('${}', tail)
-        amounts = { 'amount': dollars_without_all_in_suffix(bet[0]) }
-    elif action == 'calls':
-        call = parse('${}', tail)
-        amounts = { 'amount': dollars_without_all_in_suffix(call[0]) }
-    elif action == 'raises':
-        _, raise_to = parse('${} to ${}', tail)
-        amounts = { 'to_amount': dollars_without_all_in_suffix(raise_to) }
+    action, _, tail = full_action.partition(' ')
+
+    amount_prefix = ACTION_AMOUNT_PREFIXES.get(action)
+    if amount_prefix:
+        _, found, amount_str = tail.partition(amount_prefix)
+        if not found:
+            raise Exception(f'Unexpected action line: {line}')
+        amount = dollars_without_all_in_suffix(amount_str)
     else:
-        amounts = {}
-
-    seat = hand['players'][player_id]['seat']
-    return {
-        'player_id': player_id,
-        'action': action,
-        'seat': seat,
-        **amounts
-    }
+        amount = None
+
+    return Action(
+        player_id=player_id,
+        action=action_type_code(action),
+        seat=hand.players[player_id].seat,
+        amount=amount
+    )
 
 def parse_hero_cards(segments):
-    lines = segments.get('preflop_full', [])
-    line_i = find_index_where(matches_regex('Dealt to Hero.*'), lines)
-    cards = parse('Dealt to Hero [{}]', lines[line_i])
-    return cards[0].split(' ')
+    line = segments['hero_dealt'][0]
+    cards = line[len('Dealt to Hero ['):].rstrip(']')
+    return cards.split(' ')
 
 def parse_shown_cards(segments, hand):
-    shows = [
-        parse('{}: shows [{}', line)
-        for line in segments.get('postflop', [])
-        if line.find('shows') != -1
-    ]
+    shows = [line.split(': shows [', 1) for line in segments['shows']]
 
-    players = {id: {**player} for id, player in hand['players'].items()}
     for player_id, cards_str in shows:
         if player_id == 'Hero': continue
         cards = cards_str.split(']')[0].split(' ')
-        players[player_id]['hole_cards'] = cards
-
-    return players
+        hand.players[player_id].hole_cards = cards
 
 def parse_money_amount(amount):
     # Yeah GGPoker. Wrong % format string somewhere?
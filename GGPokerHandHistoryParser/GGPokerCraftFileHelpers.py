@@ -1,111 +1,373 @@
 from pathlib import Path
+from fnmatch import fnmatch
+from collections import ChainMap
+from contextlib import contextmanager
+from itertools import chain, islice
 import glob
+import io
+import mmap
 import re
 import os
+import time
 import zipfile
-import tempfile
-import shutil
 import multiprocessing
 
 from GGPokerHandHistoryParser.GGPokerCraftExportParser import parse_hand_basic, parse_hand
 from GGPokerHandHistoryParser.Utils import DOWNLOADS_DIR, NonAnalyzableHandException
-from GGPokerHandHistoryParser.Calculations import calculate_positions_for_hand, calculate_preflop_actions_for_chart, calculate_losses, calculate_winlosses
+from GGPokerHandHistoryParser.Calculations import calculate_positions_for_hand, set_positions, calculate_preflop_call_for_chart, calculate_losses, calculate_winlosses
+from GGPokerHandHistoryParser.HandDiskCache import stream_content_hash, hand_cache_key, read_cached_hands, write_cached_hands, evict_cached_hands
+from GGPokerHandHistoryParser.DownloadsManifest import read_manifest, write_manifest, is_unchanged, manifest_hand_cache_key, prune_file_hashes, prune_last_hand_dates, record_last_hand_dates
+from GGPokerHandHistoryParser.HandRecords import encode_hand, calculate_all_in_columns, LazyHand
+from GGPokerHandHistoryParser.StageTimings import timed_stage, record_stage, take_stage_timings, merge_stage_timings
 
 UUID_REGEX = r'^[0-9a-fA-F]{8}\b-[0-9a-fA-F]{4}\b-[0-9a-fA-F]{4}\b-[0-9a-fA-F]{4}\b-[0-9a-fA-F]{12}$'
 
 GG_FILE_GLOB = 'GG*.txt'
 GG_APPROX_ZIP_FILE_GLOB = '*.zip'
+DOWNLOAD_ZIP_REGEX = UUID_REGEX.replace('$', r'.*\.zip$').replace('^', '.*')
+# The start of the header line, so a hand's ID is known without parsing it
+RAW_HAND_ID_REGEX = re.compile(rb'Poker Hand (.+?): ')
 
-def load_all_hands(hand_cache):
-    temp_dir = tempfile.mkdtemp()
-    extract_downloads(temp_dir)
-    copy_downloads_non_zipped(temp_dir)
+# Hands per unit of work sent to the pool
+PARSE_CHUNK_SIZE = 250
 
-    file_glob = str(Path(temp_dir, Path('**'), Path(GG_FILE_GLOB)))
-    files = glob.glob(file_glob, recursive=True)
-    files.sort()
+def load_all_hands(hand_cache, pool=None, quiet=False, known_hands=None):
+    """
+    Returns the hands for every downloaded file, keyed by the file content key.
+    `hand_cache` is the result of the previous call, so unchanged files are not loaded again.
+    `pool` is the multiprocessing pool to parse with, otherwise one is started if needed.
+    `quiet` leaves out the progress, for loading in the background.
+    `known_hands` is every hand loaded so far by ID (see `load_sources`)
+    """
+    hands_per_file, unloaded_sources = find_unloaded_sources(hand_cache)
+    hands_per_file.update(load_sources(unloaded_sources, pool, quiet, known_hands))
+    return hands_per_file
+
+def find_unloaded_sources(hand_cache):
+    """
+    Returns the hands of `hand_cache` for the files that are still downloaded, and the
+    `{ key: source }` sources of the files that aren't loaded yet
+    """
+    with timed_stage('read_manifest'):
+        manifest = read_manifest()
+    with timed_stage('find_download_sources'):
+        sources = find_download_sources(manifest)
+    with timed_stage('write_manifest'):
+        write_manifest(manifest)
+
+    hands_per_file = {}
+    unloaded_sources = {}
+    for key, source in sources.items():
+        if key in hand_cache:
+            hands_per_file[key] = hand_cache[key]
+            continue
+        unloaded_sources[key] = source
+    return hands_per_file, unloaded_sources
 
-    unloaded_files = [file for file in files if os.path.basename(file) not in hand_cache]
-    print(f'Loading {len(unloaded_files)} files matching {GG_FILE_GLOB}')
+def load_sources(sources, pool=None, quiet=False, known_hands=None):
+    """
+    Returns the hands of the `{ key: source }` sources per key, from the disk cache or parsed.
+    Exports overlap, so a hand already in `known_hands` (hand ID -> hand) or an earlier source
+    isn't parsed again, and the file gets the hand that is already loaded instead
+    """
+    # Hands loaded here go in the first map, leaving `known_hands` untouched
+    seen_hands = ChainMap({}, known_hands or {})
+    hands_per_file = {}
+    n_disk_cached = 0
+    n_duplicates = 0
+    unparsed_sources = {}
+    for key, source in sources.items():
+        with timed_stage('read_cached_hands'):
+            cached_hands = read_cached_hands(key)
+        if cached_hands is None:
+            unparsed_sources[key] = source
+            continue
+        hands_per_file[key] = [seen_hands.setdefault(hand['id'], hand) for hand in cached_hands]
+        n_duplicates += sum(hand is not cached_hand for hand, cached_hand in zip(hands_per_file[key], cached_hands))
+        n_disk_cached += 1
 
-    with multiprocessing.Pool() as pool:
-        hands_files = pool.map(load_hands_from_file, unloaded_files)
+    if not quiet: print(f'Loading {len(sources)} files matching {GG_FILE_GLOB} ({n_disk_cached} from cache)')
 
-    hands_per_file = {**hand_cache}
-    for hands, file in hands_files:
-        hands_per_file[os.path.basename(file)] = hands
+    if len(unparsed_sources) > 0:
+        start = time.perf_counter()
+        parsed_hands_per_file, duplicate_ids_per_key = parse_sources(unparsed_sources, pool, quiet, seen_hands)
+        n_parsed = sum(len(hands) for hands in parsed_hands_per_file.values())
+        record_stage('parse_sources', time.perf_counter() - start, n_parsed)
+        with timed_stage('calculate_all_in_columns', n_parsed):
+            calculate_all_in_columns(chain(*parsed_hands_per_file.values()))
+        for hands in parsed_hands_per_file.values():
+            for hand in hands: seen_hands.setdefault(hand['id'], hand)
 
+        for key in unparsed_sources:
+            duplicate_ids = duplicate_ids_per_key.get(key, [])
+            hands_per_file[key] = parsed_hands_per_file.get(key, []) + [seen_hands[hand_id] for hand_id in duplicate_ids]
+            n_duplicates += len(duplicate_ids)
+            with timed_stage('write_cached_hands', len(hands_per_file[key])):
+                write_cached_hands(key, hands_per_file[key])
+        evict_cached_hands()
+
+    if not quiet and n_duplicates > 0: print(f'Skipped {n_duplicates} hands that were already loaded from other files')
+    with timed_stage('record_last_hand_dates'):
+        record_last_hand_dates({key: last_hand_date(hands) for key, hands in hands_per_file.items()})
     return hands_per_file
 
+def last_hand_date(hands):
+    """When the last of the hands was played, which may not be the last in the file. None without hands"""
+    return max((hand['date'] for hand in hands), default=None)
+
+def parse_sources(sources, pool=None, quiet=False, seen_ids=()):
+    """
+    Parses the hands of the `{ key: source }` sources, returning the hands per key, and the IDs
+    of the hands left out per key as they are in `seen_ids` or an earlier source.
+    The hands are sent to the pool in chunks, so one big file is spread over every worker.
+    A load that fits in a single chunk is parsed in this process, as that is quicker than
+    sending it to the pool
+    """
+    duplicate_ids_per_key = {}
+    chunks = iter_hand_chunks(sources, seen_ids, duplicate_ids_per_key)
+    first_chunks = list(islice(chunks, 2))
+    chunks = chain(first_chunks, chunks)
+
+    if len(first_chunks) <= 1:
+        return collect_hand_chunks(map(parse_hand_chunk, chunks), quiet), duplicate_ids_per_key
+    if pool is None:
+        with multiprocessing.Pool() as temp_pool:
+            return collect_hand_chunks(temp_pool.imap_unordered(parse_hand_chunk, chunks), quiet), duplicate_ids_per_key
+    return collect_hand_chunks(pool.imap_unordered(parse_hand_chunk, chunks), quiet), duplicate_ids_per_key
+
+def iter_hand_chunks(sources, seen_ids=(), duplicate_ids_per_key=None):
+    """
+    Yields `(key, chunk_i, raw_hands)` chunks of up to `PARSE_CHUNK_SIZE` hands of each source.
+    Hands with an ID in `seen_ids` or an earlier chunk are left out, with their IDs added to
+    `duplicate_ids_per_key`
+    """
+    chunked_ids = set()
+    for key, source in sources.items():
+        raw_hands = []
+        chunk_i = 0
+        for raw_hand in iter_raw_hands(source):
+            hand_id = raw_hand_id(raw_hand)
+            if hand_id in seen_ids or hand_id in chunked_ids:
+                duplicate_ids_per_key.setdefault(key, []).append(hand_id)
+                continue
+            if hand_id is not None: chunked_ids.add(hand_id)
+
+            raw_hands.append(raw_hand)
+            if len(raw_hands) < PARSE_CHUNK_SIZE: continue
+            yield key, chunk_i, raw_hands
+            raw_hands = []
+            chunk_i += 1
+
+        if raw_hands: yield key, chunk_i, raw_hands
+
+def raw_hand_id(raw_hand):
+    match = RAW_HAND_ID_REGEX.match(raw_hand)
+    return match[1].decode('utf-8') if match else None
+
+def parse_hand_chunk(chunk):
+    """
+    Returns the hands as compact records (see `HandRecords`), which are much quicker to send back
+    than the hands, along with the timings of parsing them (see `StageTimings`)
+    """
+    key, chunk_i, raw_hands = chunk
+    # Set aside, as a chunk parsed in this process must only send back its own timings
+    previous_timings = take_stage_timings()
+    start = time.perf_counter()
+
+    records = []
+    for raw_hand in raw_hands:
+        hand = parse_hand_lines(decode_hand(raw_hand))
+        encode_start = time.perf_counter()
+        records.append(encode_hand(hand))
+        record_stage('encode_hand', time.perf_counter() - encode_start, 1)
+
+    record_stage('parse_hand_chunk', time.perf_counter() - start, len(raw_hands))
+    chunk_timings = take_stage_timings()
+    merge_stage_timings(previous_timings)
+    return key, chunk_i, records, chunk_timings
+
+def collect_hand_chunks(chunk_results, quiet=False):
+    """Puts the parsed chunks (in any order) back together per key, showing the progress"""
+    chunks_per_key = {}
+    n_hands = 0
+    for key, chunk_i, records, chunk_timings in chunk_results:
+        merge_stage_timings(chunk_timings)
+        chunks_per_key.setdefault(key, []).append((chunk_i, records))
+        n_hands += len(records)
+        if not quiet: print(f'\rParsed {n_hands} hands', end='', flush=True)
+    if not quiet: print()
+
+    return {
+        key: [LazyHand(record) for _, records in sorted(chunks, key=lambda chunk: chunk[0]) for record in records]
+        for key, chunks in chunks_per_key.items()
+    }
 
-def extract_downloads(temp_dir):
+def find_download_sources(manifest):
+    """
+    Finds every hand history file in the downloads, whether zipped or not.
+    Returns a dict of the content key to the source, where a source is a `(file, zip_member)`
+    tuple, and `zip_member` is None for files that are not zipped.
+    Files with the same contents (e.g. the same zip downloaded twice) only appear once
+    """
+    sources = {}
+
+    with timed_stage('read_zip_entries'):
+        zip_entries = read_zip_entries(manifest)
+    for zip_file, zip_entry in zip_entries.items():
+        for member in zip_entry['members']:
+            key = hand_cache_key(member['hash'])
+            sources.setdefault(key, (zip_file, member['name']))
+
+    with timed_stage('find_downloads_non_zipped'):
+        files = find_downloads_non_zipped()
+    with timed_stage('hash_downloads_non_zipped'):
+        for file in files:
+            key = manifest_hand_cache_key(manifest, file)
+            sources.setdefault(key, (file, None))
+    prune_file_hashes(manifest, files)
+    prune_last_hand_dates(manifest, sources)
+
+    return sources
+
+def find_download_zips():
     zip_file_glob = str(Path(DOWNLOADS_DIR, Path('**/'), Path(GG_APPROX_ZIP_FILE_GLOB)))
     all_zip_files = glob.glob(zip_file_glob, recursive=True)
 
-    pattern = UUID_REGEX.replace('$', r'.*\.zip$').replace('^', '.*')
     zip_files = [
-        Path(Path(DOWNLOADS_DIR), Path(file))
+        str(Path(Path(DOWNLOADS_DIR), Path(file)))
         for file in all_zip_files
-        if re.match(pattern, file)
+        if re.match(DOWNLOAD_ZIP_REGEX, file)
     ]
     zip_files.sort(key=lambda file: os.path.getmtime(file))
+    return zip_files
+
+def read_zip_entries(manifest):
+    """
+    Returns the hand history members of each downloaded zip, only opening zips that changed since
+    the last run (according to the manifest)
+    """
+    zip_entries = {}
+    for zip_file in find_download_zips():
+        stat = os.stat(zip_file)
+        zip_entry = manifest['zips'].get(zip_file)
+        if not is_unchanged(zip_entry, stat):
+            zip_entry = read_zip_entry(zip_file, stat)
+        zip_entries[zip_file] = zip_entry
+
+    manifest['zips'] = zip_entries
+    return zip_entries
+
+def zip_member_content_hash(zip, info):
+    with zip.open(info) as member:
+        return stream_content_hash(member)
+
+def read_zip_entry(zip_file, stat):
+    with zipfile.ZipFile(zip_file, 'r') as zip:
+        # Hashed in full, rather than trusting the CRC32 the zip stores, as a collision would
+        # serve another file's cached hands. This only happens when the zip is new or changed
+        members = [
+            {
+                'name': info.filename,
+                'hash': zip_member_content_hash(zip, info),
+            }
+            for info in zip.infolist()
+            if fnmatch(os.path.basename(info.filename), GG_FILE_GLOB)
+        ]
 
-    for file in zip_files:
-        with zipfile.ZipFile(file, 'r') as zip:
-            zip.extractall(temp_dir)
-    
-    return temp_dir
+    return {
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+        'members': members,
+    }
 
-def copy_downloads_non_zipped(to_dir):
+def is_download_file(file):
+    """Whether `find_download_zips` or `find_downloads_non_zipped` would find the file"""
+    name = os.path.basename(file)
+    if fnmatch(name, GG_APPROX_ZIP_FILE_GLOB): return re.match(DOWNLOAD_ZIP_REGEX, file) is not None
+    return fnmatch(name, GG_FILE_GLOB)
+
+def find_downloads_non_zipped():
     file_glob = str(Path(DOWNLOADS_DIR, Path('**'), Path(GG_FILE_GLOB)))
     files = glob.glob(file_glob, recursive=True)
-    for file in files:
-        shutil.copy(file, Path(Path(to_dir), Path(os.path.basename(file))))
+    files.sort()
+    return files
 
-def load_hands_from_file(file):
-    with open(file, "r") as f:
-        contents = f.read()
+@contextmanager
+def open_source(source):
+    """
+    Opens the hand history file as bytes. Files are memory mapped, and zipped files are streamed
+    straight out of the zip, so neither is read into memory up front
+    """
+    file, zip_member = source
+    if zip_member is not None:
+        with zipfile.ZipFile(file, 'r') as zip, zip.open(zip_member) as member:
+            yield member
+        return
 
-    hand_strings = contents.split('\n\n')
-    hand_strings_stripped = [str.strip() for str in hand_strings if str.strip() != '']
+    with open(file, 'rb') as f:
+        # Empty files can't be memory mapped
+        if os.fstat(f.fileno()).st_size == 0:
+            yield io.BytesIO()
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield mapped
 
-    hands_lines_stripped = [
-        [
-            line.strip()
-            for line in hand_string.split('\n')
-            if line.strip() != ''
-        ]
-        for hand_string in hand_strings_stripped
-    ]
+def iter_raw_hands(source):
+    """
+    Yields each hand in the file, one at a time, as its stripped, non-empty lines joined by `\\n`
+    and still encoded. Hands are separated by empty lines, which are found on the raw bytes
+    """
+    with open_source(source) as f:
+        raw_lines = []
+        for raw_line in iter(f.readline, b''):
+            if raw_line.rstrip(b'\r\n') == b'':
+                if raw_lines: yield b'\n'.join(raw_lines)
+                raw_lines = []
+                continue
+
+            raw_line = raw_line.strip()
+            if raw_line != b'': raw_lines.append(raw_line)
+
+        if raw_lines: yield b'\n'.join(raw_lines)
+
+def decode_hand(raw_hand):
+    return raw_hand.decode('utf-8').split('\n')
+
+def iter_hands_lines(source):
+    """Yields the stripped, non-empty lines of each hand in the file, one hand at a time"""
+    for raw_hand in iter_raw_hands(source):
+        yield decode_hand(raw_hand)
 
-    hands = []
-    for lines in hands_lines_stripped:
-        basic_hand, segments = parse_hand_basic(lines)
-        hands.append(parse_and_calculate_hand(segments, basic_hand))
+def iter_hands_from_source(source):
+    for lines in iter_hands_lines(source):
+        yield parse_hand_lines(lines)
 
-    return hands, file
+# The stages of each hand are timed without `timed_stage`, which would slow parsing down noticeably
+def parse_hand_lines(lines):
+    start = time.perf_counter()
+    basic_hand, segments = parse_hand_basic(lines)
+    record_stage('parse_hand_basic', time.perf_counter() - start, 1)
+    return parse_and_calculate_hand(segments, basic_hand)
 
 def parse_and_calculate_hand(segments, basic_hand):
-    hand = {**basic_hand}
+    start = time.perf_counter()
     hand = parse_hand(segments, basic_hand)
+    record_stage('parse_hand', time.perf_counter() - start, 1)
 
     calculate_losses(hand)
     calculate_winlosses(hand)
 
     if 'postflop' not in segments:
-        hand['error'] = "Hand ended preflop"
+        hand.error = "Hand ended preflop"
 
+    start = time.perf_counter()
     try:
-        preflop_actions_for_chart = calculate_preflop_actions_for_chart(hand)
-        hand = {
-            **hand,
-            'preflop': { **hand['preflop'], **preflop_actions_for_chart }
-        }
-
-        positions = calculate_positions_for_hand(hand)
-        hand = {**hand, **positions}
+        hand.preflop.call = calculate_preflop_call_for_chart(hand)
+        set_positions(hand, calculate_positions_for_hand(hand))
         return hand
     except NonAnalyzableHandException as e:
-        if hand and 'error' in hand: return hand
-        hand['error'] = e.args[0]
+        if hand.error is not None: return hand
+        hand.error = e.args[0]
         return hand
+    finally:
+        record_stage('calculate_positions_for_hand', time.perf_counter() - start, 1)
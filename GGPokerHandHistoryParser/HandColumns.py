@@ -0,0 +1,206 @@
+"""
+The hands as columns of NumPy arrays, one row per hand, for stats and exports over every hand.
+
+The values of each row are worked out when the hand is parsed (see `HandRecords`), so building
+the columns doesn't need the full hands.
+"""
+
+import numpy as np
+
+from GGPokerHandHistoryParser.HandModel import CARD_IDS, FOLDS, CHECKS, SHOWS
+from GGPokerHandHistoryParser.AllInEquity import find_all_in
+
+# (name, dtype, shape of each value)
+COLUMNS = [
+    ('id', np.str_, ()),
+    ('date', 'datetime64[s]', ()),
+    ('big_blind', np.float64, ()),
+    ('has_error', np.bool_, ()),
+    # The index of the error in `ERROR_REASONS`, -1 when there is none
+    ('error_reason', np.int8, ()),
+    ('hero_seat', np.int8, ()),
+    # Highest card ID first
+    ('hero_hole_cards', np.int8, (2,)),
+    ('hero_win_loss_post_rake_fees', np.float64, ()),
+    ('hero_win_post_rake_fees', np.float64, ()),
+    ('hero_loss', np.float64, ()),
+    # See `AllInEquity.calculate_all_in_ev`, the EV is the actual win/loss without an all in. The
+    # equity and EV are filled in after parsing (see `HandRecords.calculate_all_in_columns`)
+    ('all_in_street', np.int8, ()),
+    ('hero_all_in_equity', np.float64, ()),
+    ('hero_ev_win_loss_post_rake_fees', np.float64, ()),
+    ('rake', np.float64, ()),
+    ('jackpot_fees', np.float64, ()),
+    ('preflop_n_bet', np.int8, ()),
+    ('preflop_is_raiser', np.bool_, ()),
+    ('hero_did_vpip', np.bool_, ()),
+    ('hero_is_postflop', np.bool_, ()),
+    ('hero_is_oop', np.bool_, ()),
+    ('hero_is_ip', np.bool_, ()),
+    ('postflop_n_way', np.int8, ()),
+    # Padded with -1 up to 5 cards
+    ('board', np.int8, (5,)),
+    # The other player of the heads up pot when the hero is OOP or IP, else '' and -1
+    ('opponent_id', np.str_, ()),
+    ('opponent_seat', np.int8, ()),
+    # The first and last preflop actions that are not folds. The seat and action are -1 when there
+    # are none, and the amount is NaN when the action has none (the to amount of raises)
+    ('first_non_fold_is_hero', np.bool_, ()),
+    ('first_non_fold_seat', np.int8, ()),
+    ('first_non_fold_action', np.int8, ()),
+    ('first_non_fold_amount', np.float64, ()),
+    ('last_non_fold_is_hero', np.bool_, ()),
+    ('last_non_fold_seat', np.int8, ()),
+    ('last_non_fold_action', np.int8, ()),
+    ('last_non_fold_amount', np.float64, ()),
+]
+COLUMN_INDEXES = {name: i for i, (name, _, _) in enumerate(COLUMNS)}
+
+# The reasons a hand isn't analysable (see `Calculations`), with any other as the last
+ERROR_REASONS = [
+    'Hand ended preflop',
+    "We don't have charts for the player limping",
+    'There was no preflop caller',
+    'Solvers will not support multiway pots',
+    'Hero performed no actions',
+    'Last hero action is a fold',
+    'Other',
+]
+
+def hand_column_values(hand):
+    """The row of a parsed hand, in the order of `COLUMNS`"""
+    hero = hand.players['Hero']
+
+    hero_did_vpip = any(
+        action.player_id == 'Hero' and action.action != FOLDS and action.action != CHECKS
+        for action in hand.preflop.actions
+    )
+
+    flop_actions = hand.flop.actions if hand.flop is not None else []
+    hero_is_postflop = any(action.player_id == 'Hero' and action.action != SHOWS for action in flop_actions)
+
+    oop_player_id = hand.oop['player_id'] if hand.oop is not None else None
+    ip_player_id = hand.ip['player_id'] if hand.ip is not None else None
+    is_raiser = (
+        (hand.oop is not None and hand.oop['action'] == 'raise' and oop_player_id == 'Hero')
+        or (hand.ip is not None and hand.ip['action'] == 'raise' and ip_player_id == 'Hero')
+    )
+
+    hole_card_ids = sorted((CARD_IDS[card] for card in hero.hole_cards), reverse=True)
+
+    if hand.oop is None or 'Hero' not in (oop_player_id, ip_player_id): opponent = None
+    else: opponent = hand.players[ip_player_id if oop_player_id == 'Hero' else oop_player_id]
+
+    non_fold_actions = [action for action in hand.preflop.actions if action.action != FOLDS]
+    first_non_fold = non_fold_actions[0] if non_fold_actions else None
+    last_non_fold = non_fold_actions[-1] if non_fold_actions else None
+
+    return (
+        hand.id,
+        hand.date,
+        hand.big_blind,
+        hand.error is not None,
+        error_reason_column_value(hand.error),
+        hero.seat,
+        hole_card_ids,
+        hero.win_loss_post_rake_fees,
+        np.nan if hero.win_post_rake_fees is None else hero.win_post_rake_fees,
+        hero.loss,
+        *unscored_all_in_column_values(hand),
+        hand.rake,
+        hand.jackpot_fees,
+        len(hand.preflop.raises) + 1,
+        is_raiser,
+        hero_did_vpip,
+        hero_is_postflop,
+        oop_player_id == 'Hero',
+        ip_player_id == 'Hero',
+        len({action.player_id for action in flop_actions}),
+        board_column_value(hand.board),
+        '' if opponent is None else opponent.id,
+        -1 if opponent is None else opponent.seat,
+        *action_column_values(first_non_fold),
+        *action_column_values(last_non_fold),
+    )
+
+def unscored_all_in_column_values(hand):
+    """The all-in columns before the runouts are scored, as if the hero's cards weren't shown"""
+    all_in = find_all_in(hand)
+    return (-1 if all_in is None else all_in[0], np.nan, hand.players['Hero'].win_loss_post_rake_fees)
+
+def error_reason_column_value(error):
+    if error is None: return -1
+    if error in ERROR_REASONS: return ERROR_REASONS.index(error)
+    return len(ERROR_REASONS) - 1
+
+def board_column_value(board):
+    card_ids = [CARD_IDS.get(card, -1) for card in board]
+    return card_ids + [-1] * (5 - len(card_ids))
+
+def action_column_values(action):
+    if action is None: return (False, -1, -1, np.nan)
+    return (
+        action.player_id == 'Hero',
+        action.seat,
+        -1 if isinstance(action.action, str) else action.action,
+        np.nan if action.amount is None else action.amount,
+    )
+
+def build_hand_columns(rows):
+    values_per_column = zip(*rows) if rows else [()] * len(COLUMNS)
+    return {
+        name: np.array(values, dtype=dtype).reshape((len(rows), *shape))
+        for (name, dtype, shape), values in zip(COLUMNS, values_per_column)
+    }
+
+def concat_hand_columns(columns_list):
+    if len(columns_list) == 0: return build_hand_columns([])
+    return {
+        name: np.concatenate([columns[name] for columns in columns_list])
+        for name, _, _ in COLUMNS
+    }
+
+def take_hand_columns(columns, indexes):
+    return {name: values[indexes] for name, values in columns.items()}
+
+def insert_hand_columns(columns, new_columns, new_indexes):
+    """The columns with the rows of `new_columns` at `new_indexes` (sorted) of the result, and the old rows in between"""
+    n_rows = len(columns['id']) + len(new_indexes)
+    is_new = np.zeros(n_rows, dtype=bool)
+    is_new[new_indexes] = True
+
+    merged_columns = {}
+    for name, values in columns.items():
+        # Strings are as wide as the widest, which the new ones may be
+        merged_values = np.empty((n_rows, *values.shape[1:]), dtype=np.result_type(values, new_columns[name]))
+        merged_values[is_new] = new_columns[name]
+        merged_values[~is_new] = values
+        merged_columns[name] = merged_values
+    return merged_columns
+
+# Comparisons for `filter_hand_columns`, with `isclose` for money amounts
+FILTER_OPERATORS = {
+    '==': np.equal,
+    '!=': np.not_equal,
+    '<': np.less,
+    '<=': np.less_equal,
+    '>': np.greater,
+    '>=': np.greater_equal,
+    'isclose': np.isclose,
+}
+
+def filter_hand_columns(columns, filters):
+    """
+    The mask of the hands matching every `(column, operator, value)` filter,
+    e.g. `[('big_blind', 'isclose', 0.05), ('hero_seat', '==', 5)]`
+    """
+    mask = np.ones(len(columns['id']), dtype=np.bool_)
+    for column, operator, value in filters:
+        if column not in columns or columns[column].ndim != 1:
+            raise Exception(f'Unknown column `{column}`')
+        if operator not in FILTER_OPERATORS:
+            raise Exception(f'Unknown operator `{operator}`')
+        # Dates are given as ISO strings, e.g. `2024-01-31` or `2024-01-31T20:00:00`
+        if columns[column].dtype.kind == 'M': value = np.datetime64(value)
+        mask &= FILTER_OPERATORS[operator](columns[column], value)
+    return mask
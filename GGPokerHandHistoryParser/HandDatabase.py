@@ -0,0 +1,374 @@
+"""
+An optional SQLite database of the hands (the REPL's `--sqlite`), so commands are indexed queries
+rather than scans of every hand in memory, and other scripts can query the hands with SQL.
+
+Every hand ever loaded is kept, even after its download is deleted, and each hand ID only once.
+A hand is stored as its `HandRecords` record, with the fields that commands query on alongside
+it, its `HandColumns` row as indexed columns for `f` filters and exports, and its players and
+actions in their own tables. The database is emptied (apart from the search history) whenever
+`PARSER_VERSION` or the tables change, as the records would be out of date.
+"""
+
+from collections.abc import Mapping
+from datetime import datetime
+from pathlib import Path
+import pickle
+import sqlite3
+
+import numpy as np
+
+from GGPokerHandHistoryParser.Utils import POSTFLOP_SEAT_ORDER, STREETS
+from GGPokerHandHistoryParser.GGPokerCraftFileHelpers import find_unloaded_sources, load_sources
+from GGPokerHandHistoryParser.HandDiskCache import PARSER_VERSION
+from GGPokerHandHistoryParser.HandModel import action_type_name
+from GGPokerHandHistoryParser.HandRecords import LazyHand, decode_cards, ID, DATE, ERROR, SMALL_BLIND, BIG_BLIND, PLAYERS, STREET_ACTIONS, COLUMN_VALUES
+from GGPokerHandHistoryParser.HandColumns import COLUMNS
+from GGPokerHandHistoryParser.HandFilters import FILTER_FIELDS, parse_filter_expression, parse_number
+from GGPokerHandHistoryParser.HandStore import SESSION_GAP
+from GGPokerHandHistoryParser.StageTimings import timed_stage
+
+DATABASE_PATH = Path(Path.home(), Path('.GGPokerHandHistoryParser.sqlite3'))
+
+HAND_TABLES = ['actions', 'players', 'hand_columns', 'hands', 'files']
+# Bumped when the tables change, so older databases are rebuilt as when `PARSER_VERSION` changes
+SCHEMA_VERSION = 2
+DATABASE_VERSION = PARSER_VERSION * 1000 + SCHEMA_VERSION
+
+COLUMN_SQL_TYPES = {'U': 'TEXT', 'M': 'TEXT', 'f': 'REAL', 'b': 'INTEGER', 'i': 'INTEGER'}
+# The SQL columns of the `HandColumns` row as (SQL column, SQL type), with each card of
+# `hero_hole_cards` and `board` in its own SQL column, e.g. `board_0`
+HAND_COLUMN_FIELDS = [
+    (name if shape == () else f'{name}_{i}', COLUMN_SQL_TYPES[np.dtype(dtype).kind])
+    for name, dtype, shape in COLUMNS
+    for i in range(shape[0] if shape else 1)
+]
+HAND_COLUMN_DEFINITIONS = ',\n'.join(
+    f'    {sql_column} {sql_type}' + (' PRIMARY KEY' if sql_column == 'id' else '')
+    for sql_column, sql_type in HAND_COLUMN_FIELDS
+)
+SCHEMA = f'''
+CREATE TABLE IF NOT EXISTS files (
+    key TEXT PRIMARY KEY,
+    file TEXT NOT NULL,
+    zip_member TEXT,
+    n_hands INTEGER NOT NULL,
+    ingested_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS hands (
+    id TEXT PRIMARY KEY,
+    file_key TEXT NOT NULL REFERENCES files (key),
+    -- `YYYY-MM-DD HH:MM:SS`, which sorts by date
+    date TEXT NOT NULL,
+    small_blind REAL NOT NULL,
+    big_blind REAL NOT NULL,
+    hero_seat TEXT,
+    is_analysable INTEGER NOT NULL,
+    error TEXT,
+    record BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS hands_date ON hands (date);
+CREATE INDEX IF NOT EXISTS hands_hero_seat ON hands (hero_seat, date);
+CREATE INDEX IF NOT EXISTS hands_stakes ON hands (big_blind, small_blind, date);
+CREATE INDEX IF NOT EXISTS hands_is_analysable ON hands (is_analysable, date);
+-- Filled in alongside `hands`, in the same order, so it is in date order by `date, rowid` too.
+-- Dates are as in `hands`, and NaNs are NULL
+CREATE TABLE IF NOT EXISTS hand_columns (
+{HAND_COLUMN_DEFINITIONS}
+);
+CREATE INDEX IF NOT EXISTS hand_columns_date ON hand_columns (date);
+CREATE INDEX IF NOT EXISTS hand_columns_stakes ON hand_columns (big_blind, date);
+CREATE INDEX IF NOT EXISTS hand_columns_hero_seat ON hand_columns (hero_seat, opponent_seat);
+CREATE INDEX IF NOT EXISTS hand_columns_vpip ON hand_columns (hero_did_vpip, preflop_is_raiser, preflop_n_bet);
+CREATE INDEX IF NOT EXISTS hand_columns_win_loss ON hand_columns (hero_win_loss_post_rake_fees);
+-- The expression of `win_loss_bb` in `FILTER_FIELD_SQL`
+CREATE INDEX IF NOT EXISTS hand_columns_win_loss_bb ON hand_columns (hero_win_loss_post_rake_fees / big_blind);
+CREATE INDEX IF NOT EXISTS hand_columns_opponent ON hand_columns (opponent_id);
+CREATE INDEX IF NOT EXISTS hand_columns_error_reason ON hand_columns (error_reason);
+CREATE TABLE IF NOT EXISTS players (
+    hand_id TEXT NOT NULL REFERENCES hands (id),
+    player_id TEXT NOT NULL,
+    seat TEXT NOT NULL,
+    initial_stack REAL NOT NULL,
+    hole_cards TEXT,
+    win_post_rake_fees REAL,
+    PRIMARY KEY (hand_id, player_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS actions (
+    hand_id TEXT NOT NULL REFERENCES hands (id),
+    street TEXT NOT NULL,
+    action_i INTEGER NOT NULL,
+    player_id TEXT NOT NULL,
+    seat TEXT NOT NULL,
+    action TEXT NOT NULL,
+    amount REAL,
+    PRIMARY KEY (hand_id, street, action_i)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    line TEXT NOT NULL
+);
+'''
+
+# The fields of `HandFilters.FILTER_FIELDS` worked out from other columns, as SQL on `hand_columns`
+FILTER_FIELD_SQL = {
+    'win_loss_bb': 'hero_win_loss_post_rake_fees / big_blind',
+    'ev_win_loss_bb': 'hero_ev_win_loss_post_rake_fees / big_blind',
+    'all_in': 'all_in_street >= 0',
+    'analysable': 'NOT has_error',
+}
+
+# Most SQLite builds allow up to 999 parameters per query
+MAX_QUERY_PARAMETERS = 500
+
+def open_hand_database(path=DATABASE_PATH):
+    connection = sqlite3.connect(path)
+    (user_version,) = connection.execute('PRAGMA user_version').fetchone()
+    with connection:
+        if user_version != DATABASE_VERSION:
+            for table in HAND_TABLES: connection.execute(f'DROP TABLE IF EXISTS {table}')
+        connection.executescript(SCHEMA)
+        connection.execute(f'PRAGMA user_version = {DATABASE_VERSION}')
+    return connection
+
+class DatabaseHands(Mapping):
+    """
+    The hands in the database by ID, as `known_hands` for `load_sources` so they aren't parsed
+    again. The IDs are read once up front, as ingest checks every raw hand's ID, and only the
+    hands that are looked up are read
+    """
+    __slots__ = ['connection', 'ids']
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.ids = {hand_id for (hand_id,) in connection.execute('SELECT id FROM hands')}
+
+    def __getitem__(self, hand_id):
+        if hand_id not in self.ids: raise KeyError(hand_id)
+        row = self.connection.execute('SELECT record FROM hands WHERE id = ?', (hand_id,)).fetchone()
+        return hand_from_row(row)
+
+    def __contains__(self, hand_id):
+        return hand_id in self.ids
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+def ingest_downloads(connection, pool=None, quiet=False):
+    """Adds the hands of any downloads not in the database yet. Returns the number of hands added"""
+    _, sources = find_unloaded_sources({})
+    ingested_keys = {key for (key,) in connection.execute('SELECT key FROM files')}
+    new_sources = {key: source for key, source in sources.items() if key not in ingested_keys}
+    if len(new_sources) == 0: return 0
+
+    hands_per_file = load_sources(new_sources, pool, quiet, DatabaseHands(connection))
+    n_hands = 0
+    with timed_stage('insert_hands'), connection:
+        for key, hands in hands_per_file.items():
+            n_hands += insert_file(connection, key, new_sources[key], hands)
+
+    if not quiet: print(f'Added {n_hands} hands to the database')
+    return n_hands
+
+def insert_file(connection, key, source, hands):
+    """Inserts the file and those of its hands that aren't in the database yet, returning how many"""
+    existing_ids = query_existing_ids(connection, [hand['id'] for hand in hands])
+    records = {}
+    for hand in hands:
+        if hand['id'] in existing_ids: continue
+        records.setdefault(hand['id'], hand.record)
+
+    file, zip_member = source
+    connection.execute(
+        'INSERT INTO files VALUES (?, ?, ?, ?, ?)',
+        (key, str(file), zip_member, len(hands), datetime.now().isoformat(sep=' ', timespec='seconds'))
+    )
+    connection.executemany(
+        'INSERT INTO hands VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        (hand_row(key, record) for record in records.values())
+    )
+    connection.executemany(
+        f'INSERT INTO hand_columns VALUES ({", ".join("?" * len(HAND_COLUMN_FIELDS))})',
+        (hand_columns_row(record) for record in records.values())
+    )
+    connection.executemany(
+        'INSERT INTO players VALUES (?, ?, ?, ?, ?, ?)',
+        (row for record in records.values() for row in player_rows(record))
+    )
+    connection.executemany(
+        'INSERT INTO actions VALUES (?, ?, ?, ?, ?, ?, ?)',
+        (row for record in records.values() for row in action_rows(record))
+    )
+    return len(records)
+
+def query_existing_ids(connection, hand_ids):
+    existing_ids = set()
+    for i in range(0, len(hand_ids), MAX_QUERY_PARAMETERS):
+        batch = hand_ids[i:i + MAX_QUERY_PARAMETERS]
+        placeholders = ', '.join('?' * len(batch))
+        existing_ids.update(hand_id for (hand_id,) in connection.execute(f'SELECT id FROM hands WHERE id IN ({placeholders})', batch))
+    return existing_ids
+
+def hand_row(file_key, record):
+    hero_seat = next((seat for player_id, seat, *_ in record[PLAYERS] if player_id == 'Hero'), None)
+    return (
+        record[ID],
+        file_key,
+        str(record[DATE]),
+        record[SMALL_BLIND],
+        record[BIG_BLIND],
+        None if hero_seat is None else POSTFLOP_SEAT_ORDER[hero_seat],
+        record[ERROR] is None,
+        record[ERROR],
+        pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL),
+    )
+
+def hand_columns_row(record):
+    values = []
+    for (_, _, shape), value in zip(COLUMNS, record[COLUMN_VALUES]):
+        if shape == (): values.append(sql_value(value))
+        else: values.extend(sql_value(card_id) for card_id in value)
+    return values
+
+def sql_value(value):
+    """A column or filter value as SQLite takes it, with dates as in the `date` of `hands`"""
+    if isinstance(value, np.generic): value = value.item()
+    if isinstance(value, datetime): return str(value)
+    return value
+
+def player_rows(record):
+    for player_id, seat, initial_stack, hole_cards, win_post_rake_fees in record[PLAYERS]:
+        yield (
+            record[ID],
+            player_id,
+            POSTFLOP_SEAT_ORDER[seat],
+            initial_stack,
+            None if hole_cards is None else ' '.join(decode_cards(hole_cards)),
+            win_post_rake_fees,
+        )
+
+def action_rows(record):
+    players = record[PLAYERS]
+    for street, actions in zip(STREETS, record[STREET_ACTIONS]):
+        for action_i, (player_i, action, amount) in enumerate(actions):
+            player_id, seat, *_ = players[player_i]
+            yield (record[ID], street, action_i, player_id, POSTFLOP_SEAT_ORDER[seat], action_type_name(action), amount)
+
+def hand_from_row(row):
+    return LazyHand(pickle.loads(row[0]))
+
+def query_hands(connection, where='', parameters=()):
+    # Hands with the same date are in the order they were added, like in `HandStore`
+    rows = connection.execute(f'SELECT record FROM hands {where} ORDER BY date, rowid', parameters)
+    return [hand_from_row(row) for row in rows]
+
+def query_hands_by_id(connection, hand_id):
+    return query_hands(connection, 'WHERE id = ?', (hand_id,))
+
+def query_ids_by_prefix(connection, prefix):
+    # A range, as `LIKE` can't use the index by default
+    rows = connection.execute('SELECT id FROM hands WHERE id >= ? AND id < ? ORDER BY id', (prefix, prefix + '\uffff'))
+    return [hand_id for (hand_id,) in rows]
+
+def query_all_hands(connection):
+    return query_hands(connection)
+
+def query_recent_analysable_hands(connection, n_hands):
+    """The last `n_hands` analysable hands, oldest first"""
+    rows = connection.execute(
+        'SELECT record FROM hands WHERE is_analysable = 1 ORDER BY date DESC, rowid DESC LIMIT ?',
+        (n_hands,)
+    )
+    hands = [hand_from_row(row) for row in rows]
+    hands.reverse()
+    return hands
+
+def query_hands_by_date(connection, start, end):
+    """The hands played from `start` up to, but not including, `end`, in date order"""
+    return query_hands(connection, 'WHERE date >= ? AND date < ?', (str(start), str(end)))
+
+def query_last_session_hands(connection):
+    """The hands since the last gap of more than `SESSION_GAP` between hands"""
+    session_start = None
+    for (date,) in connection.execute('SELECT date FROM hands ORDER BY date DESC'):
+        date = datetime.fromisoformat(date)
+        if session_start is not None and session_start - date > SESSION_GAP: break
+        session_start = date
+    if session_start is None: return []
+    return query_hands(connection, 'WHERE date >= ?', (str(session_start),))
+
+def query_hand_columns(connection):
+    """Every hand as `HandColumns`, in date order, read from `hand_columns` without the records"""
+    rows = connection.execute('SELECT * FROM hand_columns ORDER BY date, rowid').fetchall()
+    values_per_sql_column = list(zip(*rows)) if rows else [()] * len(HAND_COLUMN_FIELDS)
+    columns = {}
+    sql_column_i = 0
+    for name, dtype, shape in COLUMNS:
+        n_sql_columns = shape[0] if shape else 1
+        # NULLs are NaNs in the float columns
+        values = np.array(values_per_sql_column[sql_column_i:sql_column_i + n_sql_columns], dtype=dtype)
+        columns[name] = values.T.reshape((len(rows), *shape))
+        sql_column_i += n_sql_columns
+    return columns
+
+def query_filtered_hands(connection, expression):
+    """The hands matching the filter expression (see `HandFilters`), in date order"""
+    where, parameters = filter_sql(parse_filter_expression(expression))
+    return query_hands(connection, f'WHERE id IN (SELECT id FROM hand_columns WHERE {where})', parameters)
+
+def filter_sql(node):
+    """
+    The parsed filter expression as an SQL condition on `hand_columns`, with its parameters. NULLs
+    (NaNs) match no comparison, but do match its `not`, as with the indexes of `HandFilters`, so
+    only `not` turns them into no match (conditions outside `COALESCE` can use the indexes)
+    """
+    if node[0] in ['and', 'or']:
+        left, left_parameters = filter_sql(node[1])
+        right, right_parameters = filter_sql(node[2])
+        return f'({left} {node[0].upper()} {right})', left_parameters + right_parameters
+    if node[0] == 'not':
+        condition, parameters = filter_sql(node[1])
+        return f'NOT COALESCE({condition}, 0)', parameters
+
+    _, field, operator, value = node
+    return condition_sql(field, operator, value)
+
+def condition_sql(field, operator, value):
+    column, index_kind, parse_value, _ = FILTER_FIELDS[field]
+    sql = FILTER_FIELD_SQL.get(field, column)
+    if index_kind == 'cards':
+        placeholders = ', '.join('?' * len(value))
+        return '(' + ' OR '.join(f'board_{i} IN ({placeholders})' for i in range(5)) + ')', value * 5
+    if index_kind == 'error':
+        placeholders = ', '.join('?' * len(value))
+        return f'{sql} {"NOT IN" if operator == "!=" else "IN"} ({placeholders})', value
+    # Money amounts may not be exactly the parsed value, so are compared like `np.isclose`
+    if index_kind == 'bitmap' and parse_value is parse_number and operator in ['=', '==', '!=']:
+        tolerance = 1e-08 + 1e-05 * abs(value)
+        return f'{sql} {"NOT " if operator == "!=" else ""}BETWEEN ? AND ?', [value - tolerance, value + tolerance]
+    return f'{sql} {"=" if operator == "==" else operator} ?', [sql_value(value)]
+
+def query_history_lines(connection, n_lines_from_end):
+    rows = connection.execute('SELECT line FROM history ORDER BY id DESC LIMIT ?', (n_lines_from_end,))
+    lines = [line for (line,) in rows]
+    lines.reverse()
+    return lines
+
+def insert_history_lines(connection, lines):
+    with connection:
+        connection.executemany('INSERT INTO history (line) VALUES (?)', ((line,) for line in lines))
+
+def hand_database_lookups(connection):
+    """The lookups the REPL commands use, see `HandStore.hand_store_lookups`"""
+    return {
+        'hands_by_id': lambda hand_id: query_hands_by_id(connection, hand_id),
+        'ids_by_prefix': lambda prefix: query_ids_by_prefix(connection, prefix),
+        'all_hands': lambda: query_all_hands(connection),
+        'recent_analysable_hands': lambda n_hands: query_recent_analysable_hands(connection, n_hands),
+        'hands_by_date': lambda start, end: query_hands_by_date(connection, start, end),
+        'last_session_hands': lambda: query_last_session_hands(connection),
+        'hand_columns': lambda: query_hand_columns(connection),
+        'filtered_hands': lambda expression: query_filtered_hands(connection, expression),
+    }
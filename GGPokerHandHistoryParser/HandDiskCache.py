@@ -0,0 +1,75 @@
+"""
+On-disk cache of parsed hands, so each hand history file only has to be parsed once across runs.
+
+Entries are keyed by a SHA-1 of the file contents plus `PARSER_VERSION`, so re-downloaded files
+with changed contents are re-parsed, and stale entries are ignored after the parser changes.
+"""
+
+import hashlib
+import os
+import pickle
+from pathlib import Path
+
+# Bump this whenever the shape of the parsed hands changes, to invalidate old cache entries
+PARSER_VERSION = 6
+
+CACHE_DIR = Path(Path.home(), Path('.GGPokerHandHistoryParser.cache'))
+CACHE_FILE_SUFFIX = '.pickle'
+CACHE_SIZE_CAP_BYTES = 512 * 1024 * 1024
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+def file_content_hash(file):
+    with open(file, 'rb') as f:
+        return stream_content_hash(f)
+
+def stream_content_hash(stream):
+    """The SHA-1 of everything left to read from the stream, e.g. an open zip member"""
+    content_hash = hashlib.sha1()
+    for block in iter(lambda: stream.read(HASH_BLOCK_SIZE), b''):
+        content_hash.update(block)
+    return content_hash.hexdigest()
+
+def hand_cache_key(content_hash):
+    return f'v{PARSER_VERSION}-{content_hash}'
+
+def cache_entry_path(key):
+    return Path(CACHE_DIR, Path(key + CACHE_FILE_SUFFIX))
+
+def read_cached_hands(key):
+    path = cache_entry_path(key)
+    try:
+        with open(path, 'rb') as f:
+            hands = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+
+    # Touch the entry so the eviction treats it as recently used
+    os.utime(path)
+    return hands
+
+def write_cached_hands(key, hands):
+    CACHE_DIR.mkdir(exist_ok=True)
+    path = cache_entry_path(key)
+    temp_path = Path(f'{path}.{os.getpid()}.tmp')
+    with open(temp_path, 'wb') as f:
+        pickle.dump(hands, f, protocol=pickle.HIGHEST_PROTOCOL)
+    # Atomic, so a crash mid-write never leaves a half written entry behind
+    os.replace(temp_path, path)
+
+def evict_cached_hands(size_cap_bytes=CACHE_SIZE_CAP_BYTES):
+    """Removes the least recently used entries until the cache fits in `size_cap_bytes`"""
+    if not CACHE_DIR.is_dir(): return
+
+    entries = [
+        (entry.stat(), entry)
+        for entry in CACHE_DIR.iterdir()
+        if entry.name.endswith(CACHE_FILE_SUFFIX)
+    ]
+    entries.sort(key=lambda stat_entry: stat_entry[0].st_mtime, reverse=True)
+
+    total_size = 0
+    for stat, entry in entries:
+        total_size += stat.st_size
+        if total_size <= size_cap_bytes: continue
+        entry.unlink(missing_ok=True)
@@ -0,0 +1,278 @@
+"""
+Scores 5 to 7 card poker hands, in batches of NumPy arrays of card IDs (see `PrintHelpers.card_id`).
+
+A score is `category << 20` plus the ranks that break ties within the category, 4 bits each, most
+significant first, so a higher score is a better hand, and equal scores split the pot.
+
+Scores are looked up in tables built once per process (see `load_rank_table`):
+- Flushes, by the 13 bit mask of the ranks in the flush suit, which also finds straight flushes
+- Everything else, by the ranks of the cards alone. Each card adds the key of its rank, and the
+  keys are picked so that the sums are different for any two sets of ranks of the same size. For
+  7 cards, the sum indexes straight into a table of every sum, for 5 and 6 it is binary searched
+
+`evaluate_on_boards` scores the same cards with many boards, e.g. every runout of an all-in, from
+the key sums of the boards, so most of the work is done once per board rather than per hand, and
+`evaluate_combos_on_boards` does the same for many combos at once, e.g. every combo of a range.
+"""
+
+from functools import cache
+from itertools import chain, combinations, combinations_with_replacement, permutations
+from math import comb
+
+import numpy as np
+
+from GGPokerHandHistoryParser.HandModel import CARD_IDS
+
+HIGH_CARD, PAIR, TWO_PAIR, TRIPS, STRAIGHT, FLUSH, FULL_HOUSE, QUADS, STRAIGHT_FLUSH = range(9)
+HAND_CATEGORIES = ['High Card', 'Pair', 'Two Pair', 'Trips', 'Straight', 'Flush', 'Full House', 'Quads', 'Straight Flush']
+
+CATEGORY_SHIFT = 20
+N_RANKS = 13
+DENSE_TABLE_N_CARDS = 7
+
+# From SKPokerEval, the smallest keys known that sum uniquely for 7 cards
+RANK_KEYS = [0, 1, 5, 22, 98, 453, 2031, 8698, 22854, 83661, 262349, 636345, 1479181]
+# Per card ID, so a card's values are one lookup
+CARD_RANK_KEYS = np.array([RANK_KEYS[card_id >> 2] for card_id in range(52)], dtype=np.int32)
+CARD_RANK_BITS = np.array([1 << (card_id >> 2) for card_id in range(52)], dtype=np.int16)
+CARD_SUITS = np.array([card_id & 3 for card_id in range(52)], dtype=np.int8)
+# The card counts of each suit, 3 bits each, fit in one small int
+CARD_SUIT_KEYS = np.array([8 ** (card_id & 3) for card_id in range(52)], dtype=np.int16)
+SUIT_RANK_MASK = (1 << N_RANKS) - 1
+
+# A bit per card, 13 bits per suit with a bit per rank, so a suit's ranks are a shift away
+CARD_BITS = [1 << ((card_id & 3) * N_RANKS + (card_id >> 2)) for card_id in range(52)]
+CARD_MASKS = np.array(CARD_BITS, dtype=np.uint64)
+
+SUIT_PERMUTATIONS = list(permutations(range(4)))
+
+# Ranks from the highest card of each straight, the wheel (A2345) last
+STRAIGHTS = [(high, [high - i for i in range(5)]) for high in range(N_RANKS - 1, 3, -1)] + [(3, [3, 2, 1, 0, 12])]
+
+def hand_score(category, ranks):
+    score = category << CATEGORY_SHIFT
+    for i, rank in enumerate(ranks): score |= rank << (4 * (4 - i))
+    return score
+
+def straight_high_rank(rank_set):
+    for high, ranks in STRAIGHTS:
+        if all(rank in rank_set for rank in ranks): return high
+    return None
+
+def score_flush_mask(rank_mask):
+    """The score of a flush with the ranks in the mask, of 5 or more ranks"""
+    ranks = [rank for rank in range(N_RANKS - 1, -1, -1) if rank_mask >> rank & 1]
+    high = straight_high_rank(set(ranks))
+    if high is not None: return hand_score(STRAIGHT_FLUSH, [high])
+    return hand_score(FLUSH, ranks[:5])
+
+def score_rank_counts(counts):
+    """The score of the best 5 cards out of cards with these counts per rank, ignoring flushes"""
+    ranks = [rank for rank in range(N_RANKS - 1, -1, -1) if counts[rank] > 0]
+    quads = [rank for rank in ranks if counts[rank] == 4]
+    trips = [rank for rank in ranks if counts[rank] == 3]
+    pairs = [rank for rank in ranks if counts[rank] == 2]
+
+    def kickers(used, n):
+        return [rank for rank in ranks if rank not in used][:n]
+
+    if quads: return hand_score(QUADS, [quads[0], *kickers(quads[:1], 1)])
+    if trips and (len(trips) > 1 or pairs):
+        return hand_score(FULL_HOUSE, [trips[0], max(trips[1:] + pairs)])
+    high = straight_high_rank(set(ranks))
+    if high is not None: return hand_score(STRAIGHT, [high])
+    if trips: return hand_score(TRIPS, [trips[0], *kickers(trips[:1], 2)])
+    if len(pairs) > 1: return hand_score(TWO_PAIR, [pairs[0], pairs[1], *kickers(pairs[:2], 1)])
+    if pairs: return hand_score(PAIR, [pairs[0], *kickers(pairs[:1], 3)])
+    return hand_score(HIGH_CARD, ranks[:5])
+
+@cache
+def load_flush_tables():
+    """The flush suit (or -1) by the sum of the `CARD_SUIT_KEYS`, and the flush score by rank mask"""
+    flush_suits = np.full(8 ** 4, -1, dtype=np.int8)
+    for suit_key in range(8 ** 4):
+        suit_counts = [suit_key >> (3 * suit) & 7 for suit in range(4)]
+        if max(suit_counts) >= 5: flush_suits[suit_key] = suit_counts.index(max(suit_counts))
+
+    flush_scores = np.zeros(1 << N_RANKS, dtype=np.int32)
+    for rank_mask in range(1 << N_RANKS):
+        if rank_mask.bit_count() >= 5: flush_scores[rank_mask] = score_flush_mask(rank_mask)
+    return flush_suits, flush_scores
+
+@cache
+def load_rank_table(n_cards):
+    """
+    The non-flush scores by the sum of the `CARD_RANK_KEYS` of `n_cards` cards, as
+    `(sorted_keys, scores)`, or for `DENSE_TABLE_N_CARDS` `(score_index_per_key, scores)`
+    """
+    scores_by_key = {}
+    for ranks in combinations_with_replacement(range(N_RANKS), n_cards):
+        counts = [0] * N_RANKS
+        for rank in ranks: counts[rank] += 1
+        if max(counts) > 4: continue
+        key = sum(RANK_KEYS[rank] for rank in ranks)
+        if key in scores_by_key: raise Exception(f'The rank keys are not unique for {n_cards} cards')
+        scores_by_key[key] = score_rank_counts(counts)
+
+    if n_cards != DENSE_TABLE_N_CARDS:
+        keys = np.array(sorted(scores_by_key), dtype=np.int32)
+        return keys, np.array([scores_by_key[key] for key in keys.tolist()], dtype=np.int32)
+
+    # There are few different scores, so the dense table holds indexes into them, halving its size
+    unique_scores, score_indexes = np.unique(list(scores_by_key.values()), return_inverse=True)
+    dense_score_indexes = np.zeros(max(scores_by_key) + 1, dtype=np.int16)
+    dense_score_indexes[list(scores_by_key)] = score_indexes
+    return dense_score_indexes, unique_scores.astype(np.int32)
+
+def evaluate_hands(card_ids):
+    """The scores of the hands, given as an `(n_hands, n_cards)` array of 5 to 7 card IDs each"""
+    card_ids = np.asarray(card_ids)
+    if card_ids.ndim != 2 or not 5 <= card_ids.shape[1] <= 7:
+        raise Exception(f'Expected hands of 5 to 7 cards, not an array of shape {card_ids.shape}')
+    rank_keys, suit_keys = sum_card_keys(card_ids)
+
+    def flush_rank_masks(hand_indexes, flush_suits):
+        rank_masks = np.zeros(len(hand_indexes), dtype=np.int16)
+        for card_ids_i in card_ids[hand_indexes].T:
+            rank_masks |= np.where(CARD_SUITS[card_ids_i] == flush_suits, CARD_RANK_BITS[card_ids_i], 0)
+        return rank_masks
+    return score_card_keys(rank_keys, suit_keys, card_ids.shape[1], flush_rank_masks)
+
+def evaluate_on_boards(card_ids, boards):
+    """
+    The scores of the same cards (e.g. hole cards) with each of the boards, as `load_boards` gives
+    them, between 5 and 7 cards in all
+    """
+    card_ids = np.asarray(card_ids, dtype=np.int8)
+    rank_keys = boards['rank_keys'] + CARD_RANK_KEYS[card_ids].sum()
+    suit_keys = boards['suit_keys'] + CARD_SUIT_KEYS[card_ids].sum(dtype=np.int16)
+    card_suit_rank_masks = suit_rank_masks(card_ids_mask(card_ids))
+
+    def flush_rank_masks(hand_indexes, flush_suits):
+        if boards['board_indexes'] is not None: hand_indexes = boards['board_indexes'][hand_indexes]
+        board_masks = boards['card_masks'][hand_indexes] >> (flush_suits.astype(np.uint64) * np.uint64(N_RANKS))
+        return (board_masks & np.uint64(SUIT_RANK_MASK)).astype(np.int16) | card_suit_rank_masks[flush_suits]
+    return score_card_keys(rank_keys, suit_keys, len(card_ids) + boards['n_cards'], flush_rank_masks)
+
+def evaluate_combos_on_boards(combo_card_ids, card_ids, boards):
+    """
+    The scores of each combo (e.g. every 2 card combo of a range, as an `(n_combos, n_combo_cards)`
+    array) with the same cards (e.g. the flop) and each of the boards, as `load_boards` gives them,
+    as an `(n_boards, n_combos)` array. Combos sharing a card with a board score -1 with it
+    """
+    combo_card_ids = np.asarray(combo_card_ids, dtype=np.int8)
+    card_ids = np.asarray(card_ids, dtype=np.int8)
+    combo_rank_keys, combo_suit_keys = sum_card_keys(combo_card_ids)
+    rank_keys = (boards['rank_keys'] + CARD_RANK_KEYS[card_ids].sum())[:, None] + combo_rank_keys
+    suit_keys = (boards['suit_keys'] + CARD_SUIT_KEYS[card_ids].sum(dtype=np.int16))[:, None] + combo_suit_keys
+    combo_masks = np.full(len(combo_card_ids), card_ids_mask(card_ids), dtype=np.uint64)
+    for card_ids_i in combo_card_ids.T: combo_masks |= CARD_MASKS[card_ids_i]
+    board_masks = boards['card_masks'] if boards['board_indexes'] is None else boards['card_masks'][boards['board_indexes']]
+    # Their keys may be past the end of the tables, so they are looked up as no cards at all
+    is_shared = (board_masks[:, None] & combo_masks) != 0
+    rank_keys[is_shared] = 0
+    suit_keys[is_shared] = 0
+
+    def flush_rank_masks(hand_indexes, flush_suits):
+        board_indexes, combo_indexes = np.divmod(hand_indexes, len(combo_card_ids))
+        masks = (board_masks[board_indexes] | combo_masks[combo_indexes]) >> (flush_suits.astype(np.uint64) * np.uint64(N_RANKS))
+        return (masks & np.uint64(SUIT_RANK_MASK)).astype(np.int16)
+    n_cards = combo_card_ids.shape[1] + len(card_ids) + boards['n_cards']
+    scores = score_card_keys(rank_keys.ravel(), suit_keys.ravel(), n_cards, flush_rank_masks).reshape(rank_keys.shape)
+    scores[is_shared] = -1
+    return scores
+
+def canonical_suits(hole_cards, board):
+    """
+    The cards with the suits relabelled, the same way for any cards that only differ by suits
+    (e.g. `AhKh` vs `QsQd` and `AsKs` vs `QhQd`), so results for them can be cached once
+    """
+    return min(
+        (tuple(relabel_suits(cards, suits) for cards in hole_cards), relabel_suits(board, suits))
+        for suits in SUIT_PERMUTATIONS
+    )
+
+def relabel_suits(card_ids, suits):
+    """The cards with each suit replaced by `suits[suit]`, in order"""
+    return tuple(sorted((card_id & ~3) | suits[card_id & 3] for card_id in card_ids))
+
+def card_ids_mask(card_ids):
+    """The `CARD_BITS` of the cards"""
+    return sum(CARD_BITS[card_id] for card_id in card_ids)
+
+def suit_rank_masks(cards_mask):
+    return np.array([cards_mask >> (suit * N_RANKS) & SUIT_RANK_MASK for suit in range(4)], dtype=np.int16)
+
+@cache
+def load_boards(n_cards):
+    """
+    Every board of `n_cards` cards, with the sums of their keys for `evaluate_on_boards`, and the
+    bits of their cards (see `CARD_BITS`), to find their flushes and the boards without some cards
+    """
+    n_boards = comb(52, n_cards)
+    card_ids = np.fromiter(chain.from_iterable(combinations(range(52), n_cards)), dtype=np.int8, count=n_boards * n_cards)
+    card_ids = card_ids.reshape((n_boards, n_cards))
+    rank_keys, suit_keys = sum_card_keys(card_ids)
+    card_masks = np.zeros(n_boards, dtype=np.uint64)
+    for card_ids_i in card_ids.T: card_masks |= CARD_MASKS[card_ids_i]
+    return {'n_cards': n_cards, 'board_indexes': None, 'rank_keys': rank_keys, 'suit_keys': suit_keys, 'card_masks': card_masks}
+
+def load_boards_without(n_cards, dead_card_ids):
+    """
+    The boards of `load_boards` that have none of the dead cards. Their card bits are left in the
+    boards of `load_boards`, at `board_indexes`, as only flushes need them
+    """
+    boards = load_boards(n_cards)
+    board_indexes = np.flatnonzero((boards['card_masks'] & np.uint64(card_ids_mask(dead_card_ids))) == 0)
+    return {
+        **boards,
+        'board_indexes': board_indexes,
+        'rank_keys': boards['rank_keys'][board_indexes],
+        'suit_keys': boards['suit_keys'][board_indexes],
+    }
+
+def sum_card_keys(card_ids):
+    """The sums of the rank and suit keys of each row of cards"""
+    # Summed a card at a time, which is faster than summing along the rows
+    cards = card_ids.T
+    rank_keys = CARD_RANK_KEYS[cards[0]]
+    suit_keys = CARD_SUIT_KEYS[cards[0]]
+    for card_ids_i in cards[1:]:
+        rank_keys += CARD_RANK_KEYS[card_ids_i]
+        suit_keys += CARD_SUIT_KEYS[card_ids_i]
+    return rank_keys, suit_keys
+
+def score_card_keys(rank_keys, suit_keys, n_cards, flush_rank_masks):
+    """
+    The scores of hands of `n_cards` cards from the sums of their keys. Flushes need the ranks in
+    the flush suit as well, which `flush_rank_masks(hand_indexes, flush_suits)` gives
+    """
+    flush_suits, flush_scores = load_flush_tables()
+    rank_table = load_rank_table(n_cards)
+    if n_cards == DENSE_TABLE_N_CARDS:
+        dense_score_indexes, unique_scores = rank_table
+        scores = unique_scores[dense_score_indexes[rank_keys]]
+    else:
+        keys, key_scores = rank_table
+        scores = key_scores[np.searchsorted(keys, rank_keys)]
+
+    # A hand has at most one flush suit, as it has at most 7 cards
+    hand_flush_suits = flush_suits[suit_keys]
+    flush_hands = np.flatnonzero(hand_flush_suits >= 0)
+    if len(flush_hands) == 0: return scores
+
+    rank_masks = flush_rank_masks(flush_hands, hand_flush_suits[flush_hands])
+    # Quads and full houses can't be made alongside a flush from 7 cards, anything else it beats
+    scores[flush_hands] = np.maximum(scores[flush_hands], flush_scores[rank_masks])
+    return scores
+
+def evaluate_hand(cards):
+    """The score of one hand, given as card strings, e.g. `['Ah', 'Kh', '2c', '7d', '9s']`"""
+    return int(evaluate_hands([[CARD_IDS[card] for card in cards]])[0])
+
+def hand_categories(scores):
+    """The category of each score, as indexes into `HAND_CATEGORIES`"""
+    return np.asarray(scores) >> CATEGORY_SHIFT
+
+def format_hand_category(score):
+    return HAND_CATEGORIES[int(score) >> CATEGORY_SHIFT]
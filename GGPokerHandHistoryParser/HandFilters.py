@@ -0,0 +1,277 @@
+"""
+Filter expressions over `HandColumns`, for the REPL's `f` command, e.g.
+`seat = BTN and opponent_seat = BB and n_bet = 2 and bb = 0.05 and win_loss_bb < -20`
+
+An expression is conditions (`field operator value`, see `FILTER_FIELDS`, or just the field for
+yes/no fields) joined with `and`, `or` and `not`, with brackets. Conditions are answered from indexes of the columns rather than by
+comparing every hand: a bitmap per value of the fields with few values, and the hands sorted by
+value for the others. Bitmaps are kept packed 8 hands to a byte, and combined before unpacking.
+The indexes are built the first time a field is filtered on, and kept in the `index_cache` given,
+which must be thrown away with the columns.
+"""
+
+import re
+
+import numpy as np
+
+from GGPokerHandHistoryParser.Utils import InvalidSearchException, POSTFLOP_SEAT_ORDER, RANKS
+from GGPokerHandHistoryParser.HandModel import CARDS, CARD_IDS
+from GGPokerHandHistoryParser.HandColumns import ERROR_REASONS
+from GGPokerHandHistoryParser.StageTimings import timed_stage
+
+SEAT_INDEXES = {seat.lower(): i for i, seat in enumerate(POSTFLOP_SEAT_ORDER)}
+BOOLEANS = {'true': True, 'yes': True, '1': True, 'false': False, 'no': False, '0': False}
+
+TOKEN_REGEX = re.compile(r'\s*(?:([()])|(==|!=|<=|>=|=|<|>)|"([^"]*)"|([^\s()=!<>"]+))')
+COMPARISONS = {
+    '=': np.equal,
+    '==': np.equal,
+    '!=': np.not_equal,
+    '<': np.less,
+    '<=': np.less_equal,
+    '>': np.greater,
+    '>=': np.greater_equal,
+}
+
+def parse_seat(text):
+    if text.lower() not in SEAT_INDEXES:
+        raise InvalidSearchException(f'Unknown seat `{text}`, expected one of {", ".join(POSTFLOP_SEAT_ORDER)}')
+    return SEAT_INDEXES[text.lower()]
+
+def parse_boolean(text):
+    if text.lower() not in BOOLEANS: raise InvalidSearchException(f'Expected `true` or `false`, not `{text}`')
+    return BOOLEANS[text.lower()]
+
+def parse_integer(text):
+    try:
+        return int(text)
+    except ValueError:
+        raise InvalidSearchException(f'Expected a whole number, not `{text}`')
+
+def parse_number(text):
+    try:
+        return float(text.removeprefix('$').removesuffix('bb'))
+    except ValueError:
+        raise InvalidSearchException(f'Expected a number, not `{text}`')
+
+def parse_date(text):
+    try:
+        return np.datetime64(text, 's')
+    except ValueError:
+        raise InvalidSearchException(f'Expected a date like `2026-10-01` or `2026-10-01T20:00:00`, not `{text}`')
+
+def parse_error_reason(text):
+    """The indexes of the error reasons containing the text, or -1 (no error) for `none`"""
+    if text.lower() == 'none': return [-1]
+    reasons = [i for i, reason in enumerate(ERROR_REASONS) if text.lower() in reason.lower()]
+    if len(reasons) == 0:
+        raise InvalidSearchException(f'No error reason contains `{text}`, they are: {"; ".join(ERROR_REASONS)}')
+    return reasons
+
+def parse_board_cards(text):
+    """The IDs of the card, or of every suit of a rank, e.g. `Ah` or `A`"""
+    if text in CARD_IDS: return [CARD_IDS[text]]
+    if text.upper() in RANKS: return [card_id for card_id, card in enumerate(CARDS) if card[0] == text.upper()]
+    raise InvalidSearchException(f'Unknown card `{text}`, expected e.g. `Ah` or `A`')
+
+def win_loss_bb_column(columns):
+    return columns['hero_win_loss_post_rake_fees'] / columns['big_blind']
+
+def is_analysable_column(columns):
+    return ~columns['has_error']
+
+def ev_win_loss_bb_column(columns):
+    return columns['hero_ev_win_loss_post_rake_fees'] / columns['big_blind']
+
+def is_all_in_column(columns):
+    return columns['all_in_street'] >= 0
+
+# name: (column or function of the columns, kind of index, value parser, description)
+FILTER_FIELDS = {
+    'seat': ('hero_seat', 'bitmap', parse_seat, 'the hero\'s seat, e.g. BTN'),
+    'opponent_seat': ('opponent_seat', 'bitmap', parse_seat, 'the seat of the other player in a heads up pot'),
+    'opponent': ('opponent_id', 'sorted', str, 'the ID of the other player in a heads up pot'),
+    'n_bet': ('preflop_n_bet', 'bitmap', parse_integer, '2 for single raised pots, 3 for 3Bet pots...'),
+    'raiser': ('preflop_is_raiser', 'bitmap', parse_boolean, 'whether the hero made the last preflop raise'),
+    'vpip': ('hero_did_vpip', 'bitmap', parse_boolean, 'whether the hero put money in preflop'),
+    'postflop': ('hero_is_postflop', 'bitmap', parse_boolean, 'whether the hero acted on the flop'),
+    'oop': ('hero_is_oop', 'bitmap', parse_boolean, 'whether the hero is OOP heads up'),
+    'ip': ('hero_is_ip', 'bitmap', parse_boolean, 'whether the hero is IP heads up'),
+    'n_way': ('postflop_n_way', 'bitmap', parse_integer, 'the number of players on the flop'),
+    'bb': ('big_blind', 'bitmap', parse_number, 'the big blind, e.g. 0.05'),
+    'win_loss': ('hero_win_loss_post_rake_fees', 'sorted', parse_number, 'the hero\'s win/loss in $'),
+    'win_loss_bb': (win_loss_bb_column, 'sorted', parse_number, 'the hero\'s win/loss in big blinds'),
+    'ev_win_loss_bb': (ev_win_loss_bb_column, 'sorted', parse_number, 'the hero\'s all-in adjusted win/loss in big blinds'),
+    'all_in': (is_all_in_column, 'bitmap', parse_boolean, 'whether the hero was all in (or called one) with cards to come'),
+    'date': ('date', 'sorted', parse_date, 'e.g. 2026-10-01 or 2026-10-01T20:00:00'),
+    'analysable': (is_analysable_column, 'bitmap', parse_boolean, 'whether the hand is analysable'),
+    'error': ('error_reason', 'error', parse_error_reason, 'the hands whose error contains the text, or none'),
+    'board': ('board', 'cards', parse_board_cards, '`board has Ah`, or `board has A` for any ace'),
+}
+
+def is_boolean_field(field):
+    return field in FILTER_FIELDS and FILTER_FIELDS[field][2] is parse_boolean
+
+def format_filter_fields():
+    return [f'{name} - {description}' for name, (_, _, _, description) in FILTER_FIELDS.items()]
+
+def tokenize_filter_expression(expression):
+    tokens = []
+    position = 0
+    expression = expression.rstrip()
+    while position < len(expression):
+        match = TOKEN_REGEX.match(expression, position)
+        if match is None: raise InvalidSearchException(f'Can\'t read the filter from `{expression[position:].strip()}`')
+        bracket, operator, quoted, word = match.groups()
+        if bracket is not None: tokens.append(('bracket', bracket))
+        elif operator is not None: tokens.append(('operator', operator))
+        elif quoted is not None: tokens.append(('value', quoted))
+        elif word.lower() in ['and', 'or', 'not', 'has']: tokens.append(('keyword', word.lower()))
+        else: tokens.append(('value', word))
+        position = match.end()
+    return tokens
+
+def parse_filter_expression(expression):
+    """
+    The expression as nested tuples: `('and', a, b)`, `('or', a, b)`, `('not', a)` and
+    `('condition', field, operator, value)`, with the value parsed for the field
+    """
+    tokens = tokenize_filter_expression(expression)
+    if len(tokens) == 0: raise InvalidSearchException('The filter is empty')
+    node, i = parse_or(tokens, 0)
+    if i != len(tokens): raise InvalidSearchException(f'Unexpected `{tokens[i][1]}` in the filter')
+    return node
+
+def parse_or(tokens, i):
+    node, i = parse_and(tokens, i)
+    while i < len(tokens) and tokens[i] == ('keyword', 'or'):
+        right, i = parse_and(tokens, i + 1)
+        node = ('or', node, right)
+    return node, i
+
+def parse_and(tokens, i):
+    node, i = parse_not(tokens, i)
+    while i < len(tokens) and tokens[i] == ('keyword', 'and'):
+        right, i = parse_not(tokens, i + 1)
+        node = ('and', node, right)
+    return node, i
+
+def parse_not(tokens, i):
+    if i >= len(tokens): raise InvalidSearchException('The filter ends too early')
+    if tokens[i] == ('keyword', 'not'):
+        node, i = parse_not(tokens, i + 1)
+        return ('not', node), i
+    if tokens[i] == ('bracket', '('):
+        node, i = parse_or(tokens, i + 1)
+        if i >= len(tokens) or tokens[i] != ('bracket', ')'): raise InvalidSearchException('A `(` in the filter is never closed')
+        return node, i + 1
+    return parse_condition(tokens, i)
+
+def parse_condition(tokens, i):
+    # A yes/no field on its own, e.g. `oop` or `not analysable`
+    if tokens[i][0] == 'value' and is_boolean_field(tokens[i][1]) and (i + 1 == len(tokens) or tokens[i + 1][0] != 'operator'):
+        return ('condition', tokens[i][1], '=', True), i + 1
+    if i + 3 > len(tokens): raise InvalidSearchException('The filter ends too early, expected e.g. `seat = BTN`')
+    (field_kind, field), (operator_kind, operator), (value_kind, value) = tokens[i:i + 3]
+    if field_kind != 'value' or field not in FILTER_FIELDS:
+        raise InvalidSearchException(f'Unknown field `{field}`, expected one of {", ".join(FILTER_FIELDS)}')
+
+    _, index_kind, parse_value, _ = FILTER_FIELDS[field]
+    if index_kind == 'cards':
+        if (operator_kind, operator) != ('keyword', 'has'): raise InvalidSearchException(f'Expected `{field} has`, e.g. `{field} has Ah`')
+    elif operator_kind != 'operator':
+        raise InvalidSearchException(f'Expected a comparison after `{field}`, e.g. `=` or `<`')
+    elif index_kind == 'error' and operator not in ['=', '==', '!=']:
+        raise InvalidSearchException(f'`{field}` can only be compared with `=` or `!=`')
+    if value_kind != 'value': raise InvalidSearchException(f'Expected a value after `{field} {operator}`')
+
+    return ('condition', field, operator, parse_value(value)), i + 3
+
+def filter_hands_mask(columns, expression, index_cache):
+    """The mask of the hands in the columns matching the filter expression"""
+    node = parse_filter_expression(expression)
+    n_hands = len(columns['id'])
+    bitmap = evaluate_filter(node, columns, index_cache, n_hands)
+    return np.unpackbits(bitmap, count=n_hands).astype(bool)
+
+def evaluate_filter(node, columns, index_cache, n_hands):
+    """The packed bitmap of the hands matching the parsed expression"""
+    if node[0] == 'and': return evaluate_filter(node[1], columns, index_cache, n_hands) & evaluate_filter(node[2], columns, index_cache, n_hands)
+    if node[0] == 'or': return evaluate_filter(node[1], columns, index_cache, n_hands) | evaluate_filter(node[2], columns, index_cache, n_hands)
+    # The bits past the last hand are left set, `unpackbits` ignores them
+    if node[0] == 'not': return ~evaluate_filter(node[1], columns, index_cache, n_hands)
+
+    _, field, operator, value = node
+    column, index_kind, _, _ = FILTER_FIELDS[field]
+    index = index_cache.get(field)
+    if index is None:
+        with timed_stage(f'build_filter_index {field}', n_hands):
+            index = index_cache[field] = build_filter_index(index_kind, filter_column_values(columns, column))
+
+    if index_kind == 'bitmap': return match_bitmap_index(index, operator, value, n_hands)
+    if index_kind == 'sorted': return match_sorted_index(index, operator, value, n_hands)
+    if index_kind == 'error':
+        bitmap = match_any_bitmap(index, np.isin(index['values'], value), n_hands)
+        return ~bitmap if operator == '!=' else bitmap
+    return match_any_bitmap(index, np.isin(index['values'], value), n_hands)
+
+def filter_column_values(columns, column):
+    if callable(column): return column(columns)
+    return columns[column]
+
+def build_filter_index(index_kind, values):
+    if index_kind == 'sorted':
+        order = np.argsort(values, kind='stable')
+        sorted_values = values[order]
+        # NaNs sort last, and match no comparison
+        n_comparable = len(values) - np.count_nonzero(np.isnan(values)) if values.dtype.kind == 'f' else len(values)
+        return {'order': order, 'values': sorted_values, 'n_comparable': n_comparable}
+
+    if index_kind == 'cards':
+        # A row per card of which hands have it, set in one go from every card of every hand
+        hand_indexes = np.repeat(np.arange(len(values)), values.shape[1])
+        card_ids = values.ravel()
+        has_card = np.zeros((len(CARDS), len(values)), dtype=bool)
+        has_card[card_ids[card_ids >= 0], hand_indexes[card_ids >= 0]] = True
+        return {
+            'values': np.arange(len(CARDS)),
+            'bitmaps': list(np.packbits(has_card, axis=1)),
+        }
+
+    unique_values, inverse = np.unique(values, return_inverse=True)
+    return {
+        'values': unique_values,
+        'bitmaps': [np.packbits(inverse == i) for i in range(len(unique_values))],
+    }
+
+def empty_bitmap(n_hands):
+    return np.zeros((n_hands + 7) // 8, dtype=np.uint8)
+
+def match_any_bitmap(index, is_match, n_hands):
+    """The union of the bitmaps of the values that match"""
+    bitmap = empty_bitmap(n_hands)
+    for value_i in np.flatnonzero(is_match): bitmap |= index['bitmaps'][value_i]
+    return bitmap
+
+def match_bitmap_index(index, operator, value, n_hands):
+    values = index['values']
+    # Money amounts may not be exactly the parsed value
+    if values.dtype.kind == 'f' and operator in ['=', '==']: is_match = np.isclose(values, value)
+    elif values.dtype.kind == 'f' and operator == '!=': is_match = ~np.isclose(values, value)
+    else: is_match = COMPARISONS[operator](values, value)
+    return match_any_bitmap(index, is_match, n_hands)
+
+def match_sorted_index(index, operator, value, n_hands):
+    sorted_values = index['values'][:index['n_comparable']]
+    start = np.searchsorted(sorted_values, value, side='left')
+    end = np.searchsorted(sorted_values, value, side='right')
+    if operator in ['=', '==']: ranges = [(start, end)]
+    elif operator == '!=': ranges = [(0, start), (end, len(sorted_values))]
+    elif operator == '<': ranges = [(0, start)]
+    elif operator == '<=': ranges = [(0, end)]
+    elif operator == '>': ranges = [(end, len(sorted_values))]
+    else: ranges = [(start, len(sorted_values))]
+
+    mask = np.zeros(n_hands, dtype=bool)
+    for range_start, range_end in ranges: mask[index['order'][range_start:range_end]] = True
+    return np.packbits(mask)
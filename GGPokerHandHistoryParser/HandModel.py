@@ -0,0 +1,133 @@
+"""
+The parsed hand, as slotted classes that the parser fills in place.
+
+Seats are stored as indexes into `POSTFLOP_SEAT_ORDER` and action types as small int codes. Each
+class can also be read like the dicts the hands used to be (`hand['players']['Hero']['seat']`),
+with seats and action types as their strings, which is what the printing and exporting use.
+"""
+
+from collections.abc import Mapping
+
+from GGPokerHandHistoryParser.Utils import POSTFLOP_SEAT_ORDER, RANKS, SUIT_LETTERS
+
+# In card ID order (see `PrintHelpers.card_id`)
+CARDS = [rank + suit for rank in RANKS for suit in SUIT_LETTERS]
+CARD_IDS = {card: i for i, card in enumerate(CARDS)}
+
+SEAT_INDEXES = {seat: i for i, seat in enumerate(POSTFLOP_SEAT_ORDER)}
+
+FOLDS, CHECKS, BETS, CALLS, RAISES, EXCESS_UNCALLED_BET_RETURNED, SHOWS = range(7)
+ACTION_TYPES = ['folds', 'checks', 'bets', 'calls', 'raises', 'excess_uncalled_bet_returned', 'shows']
+ACTION_TYPE_CODES = {action_type: i for i, action_type in enumerate(ACTION_TYPES)}
+
+def action_type_code(action_type):
+    # Any action type not seen so far is kept as its string rather than failing the hand
+    return ACTION_TYPE_CODES.get(action_type, action_type)
+
+def action_type_name(code):
+    return code if isinstance(code, str) else ACTION_TYPES[code]
+
+class DictView(Mapping):
+    """
+    Read access by key, where an attribute that is None is a missing key.
+    `KEYS` lists the keys in the order the dicts had them
+    """
+    __slots__ = ()
+    KEYS = ()
+
+    def value(self, key):
+        return getattr(self, key)
+
+    def __getitem__(self, key):
+        if key not in self.KEYS: raise KeyError(key)
+        value = self.value(key)
+        if value is None: raise KeyError(key)
+        return value
+
+    def __iter__(self):
+        return (key for key in self.KEYS if self.value(key) is not None)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f'{type(self).__name__}({dict(self)})'
+
+class Player(DictView):
+    __slots__ = ['id', 'seat', 'initial_stack', 'hole_cards', 'win_post_rake_fees', 'loss', 'win_loss_post_rake_fees']
+    KEYS = ('id', 'seat', 'initial_stack', 'hole_cards', 'win_post_rake_fees', 'loss', 'win_loss_post_rake_fees')
+
+    def __init__(self, id, seat, initial_stack):
+        self.id = id
+        self.seat = seat
+        self.initial_stack = initial_stack
+        self.hole_cards = None
+        self.win_post_rake_fees = None
+        self.loss = None
+        self.win_loss_post_rake_fees = None
+
+    def value(self, key):
+        if key == 'seat': return POSTFLOP_SEAT_ORDER[self.seat]
+        return getattr(self, key)
+
+class Action(DictView):
+    """`amount` is the raise to amount for raises, which reads as `to_amount`"""
+    __slots__ = ['player_id', 'action', 'seat', 'amount']
+    KEYS = ('player_id', 'action', 'seat', 'amount', 'to_amount')
+
+    def __init__(self, player_id, action, seat, amount=None):
+        self.player_id = player_id
+        self.action = action
+        self.seat = seat
+        self.amount = amount
+
+    def value(self, key):
+        if key == 'action': return action_type_name(self.action)
+        if key == 'seat': return POSTFLOP_SEAT_ORDER[self.seat]
+        if key == 'amount': return None if self.action == RAISES else self.amount
+        if key == 'to_amount': return self.amount if self.action == RAISES else None
+        return getattr(self, key)
+
+class StreetState(DictView):
+    __slots__ = ['actions', 'raises', 'bets', 'new_stacks', 'new_pot', 'call']
+    KEYS = ('actions', 'raises', 'bets', 'new_stacks', 'new_pot', 'call')
+
+    def __init__(self, actions, raises, bets, new_stacks, new_pot):
+        self.actions = actions
+        self.raises = raises
+        self.bets = bets
+        self.new_stacks = new_stacks
+        self.new_pot = new_pot
+        # The single call of the last preflop raise, for hands with charts
+        self.call = None
+
+class Hand(DictView):
+    __slots__ = [
+        'id', 'small_blind', 'big_blind', 'date', 'players', 'pot', 'rake', 'jackpot_fees',
+        'blinds', 'preflop', 'board', 'flop', 'turn', 'river', 'error', 'oop', 'ip',
+    ]
+    KEYS = (
+        'id', 'small_blind', 'big_blind', 'date', 'players', 'pot', 'rake', 'jackpot_fees',
+        'blinds', 'preflop', 'board', 'flop', 'turn', 'river', 'error', 'oop', 'ip',
+    )
+
+    def __init__(self, id, small_blind, big_blind, date):
+        self.id = id
+        self.small_blind = small_blind
+        self.big_blind = big_blind
+        self.date = date
+        self.players = None
+        self.pot = None
+        self.rake = None
+        self.jackpot_fees = None
+        # (player id, amount) of each posted blind
+        self.blinds = None
+        self.preflop = None
+        self.board = None
+        self.flop = None
+        self.turn = None
+        self.river = None
+        self.error = None
+        # The positions (see `Calculations.calculate_positions`) of analysable hands
+        self.oop = None
+        self.ip = None
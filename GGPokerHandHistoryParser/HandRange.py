@@ -0,0 +1,93 @@
+"""
+A weighted preflop range, stored as the weight of each of the 169 hand classes (e.g. `AKs`),
+in the same 13x13 grid order as the charts (row major, `AA` first, suited above the diagonal).
+"""
+
+from itertools import combinations
+
+import numpy as np
+
+from GGPokerHandHistoryParser.Utils import RANKS
+
+N_HAND_CLASSES = 169
+N_COMBOS = 1326
+
+GRID_RANKS = list(reversed(RANKS))
+
+def format_hand_class(row, col):
+    if row == col: return GRID_RANKS[row] * 2
+    if row < col: return f'{GRID_RANKS[row]}{GRID_RANKS[col]}s'
+    return f'{GRID_RANKS[col]}{GRID_RANKS[row]}o'
+
+HAND_CLASSES = [format_hand_class(row, col) for row in range(13) for col in range(13)]
+HAND_CLASS_INDEXES = {hand_class: i for i, hand_class in enumerate(HAND_CLASSES)}
+
+# Every 2 card combo, as pairs of card IDs (see `PrintHelpers.card_id`), lowest ID first
+COMBOS = np.array(list(combinations(range(52), 2)), dtype=np.int8)
+
+def combo_hand_class_index(card_a, card_b):
+    row_a = 12 - card_a // 4
+    row_b = 12 - card_b // 4
+    high, low = min(row_a, row_b), max(row_a, row_b)
+    if card_a % 4 == card_b % 4: return high * 13 + low
+    return low * 13 + high
+
+COMBO_HAND_CLASSES = np.array([combo_hand_class_index(a, b) for a, b in combinations(range(52), 2)], dtype=np.int16)
+
+class HandRange:
+    __slots__ = ['weights']
+
+    def __init__(self, weights=None):
+        if weights is None: weights = np.zeros(N_HAND_CLASSES, dtype=np.float32)
+        self.weights = weights
+
+    @staticmethod
+    def parse(hands):
+        """From strings like `['AA', 'AKs:0.5']`"""
+        weights = np.zeros(N_HAND_CLASSES, dtype=np.float32)
+        for hand in hands:
+            hand_class, _, weight = hand.partition(':')
+            if hand_class not in HAND_CLASS_INDEXES:
+                raise Exception(f'Invalid hand `{hand}` in range')
+            weights[HAND_CLASS_INDEXES[hand_class]] = float(weight) if weight else 1.0
+        return HandRange(weights)
+
+    def __or__(self, other):
+        return HandRange(np.maximum(self.weights, other.weights))
+
+    def __and__(self, other):
+        return HandRange(np.minimum(self.weights, other.weights))
+
+    def __mul__(self, weight):
+        """Scales every hand by `weight`, which is a number, or another range"""
+        if isinstance(weight, HandRange): weight = weight.weights
+        return HandRange((self.weights * weight).astype(np.float32))
+
+    def __eq__(self, other):
+        return isinstance(other, HandRange) and np.array_equal(self.weights, other.weights)
+
+    def __hash__(self):
+        return hash(self.weights.tobytes())
+
+    def __len__(self):
+        return int(np.count_nonzero(self.weights))
+
+    def __iter__(self):
+        """Formats the range like `AKs:0.5`, as solvers take, with the highest weighted hands first"""
+        weights = np.round(self.weights, 4)
+        for i in np.lexsort((np.arange(N_HAND_CLASSES), -weights)):
+            if weights[i] == 0: break
+            if weights[i] == 1:
+                yield HAND_CLASSES[i]
+            else:
+                yield f'{HAND_CLASSES[i]}:{float(weights[i]):g}'
+
+    def __repr__(self):
+        return f'HandRange({",".join(self)})'
+
+    def combo_weights(self):
+        """The weight of each of the `COMBOS`"""
+        return self.weights[COMBO_HAND_CLASSES]
+
+    def n_combos(self):
+        return float(self.combo_weights().sum())
@@ -0,0 +1,170 @@
+"""
+A compact record format for parsed hands, used to send hands back from the parse workers, and to
+store them in the disk cache.
+
+A record only keeps what was parsed from the hand history, with the seats and action types of
+`HandModel` and the cards as small ints. The derived state (bets, stacks, pots, losses, positions
+and ranges) is left out, `LazyHand` recalculates it from the record on first use.
+Each record also has the hand's row of `HandColumns`, worked out in the worker, apart from the
+all-in columns of hands with an all in. Scoring their runouts needs the evaluator's tables, which
+take seconds to build, so `calculate_all_in_columns` does it once the hands are back, in one pass.
+"""
+
+from collections.abc import Mapping
+
+from GGPokerHandHistoryParser.Utils import STREETS
+from GGPokerHandHistoryParser.GGPokerCraftExportParser import parse_bets_and_new_stacks, players_to_stacks
+from GGPokerHandHistoryParser.Calculations import calculate_losses, calculate_winlosses, calculate_positions_for_hand, set_positions
+from GGPokerHandHistoryParser.HandModel import Hand, Player, Action, CARDS, CARD_IDS
+from GGPokerHandHistoryParser.HandColumns import COLUMN_INDEXES, hand_column_values
+from GGPokerHandHistoryParser.AllInEquity import calculate_all_in_ev
+
+# Positions of the fields in a record
+ID, DATE, ERROR, SMALL_BLIND, BIG_BLIND, POT, RAKE, JACKPOT_FEES, PLAYERS, BLINDS, BOARD, STREET_ACTIONS, PREFLOP_CALL_I, HAS_POSITIONS, COLUMN_VALUES = range(15)
+
+def encode_hand(hand):
+    players = list(hand.players.values())
+    player_indexes = {player.id: i for i, player in enumerate(players)}
+
+    street_actions = []
+    for street in STREETS:
+        street_state = getattr(hand, street)
+        if street_state is None: break
+        street_actions.append(tuple(
+            (player_indexes[action.player_id], action.action, action.amount)
+            for action in street_state.actions
+        ))
+
+    preflop_call = hand.preflop.call
+    preflop_call_i = None if preflop_call is None else hand.preflop.actions.index(preflop_call)
+
+    return (
+        hand.id,
+        hand.date,
+        hand.error,
+        hand.small_blind,
+        hand.big_blind,
+        hand.pot,
+        hand.rake,
+        hand.jackpot_fees,
+        tuple(
+            (
+                player.id,
+                player.seat,
+                player.initial_stack,
+                None if player.hole_cards is None else encode_cards(player.hole_cards),
+                player.win_post_rake_fees,
+            )
+            for player in players
+        ),
+        tuple((player_indexes[player_id], blind) for player_id, blind in hand.blinds),
+        encode_cards(hand.board),
+        tuple(street_actions),
+        preflop_call_i,
+        hand.oop is not None,
+        hand_column_values(hand),
+    )
+
+def encode_cards(cards):
+    if not all(card in CARD_IDS for card in cards): return tuple(cards)
+    return bytes(CARD_IDS[card] for card in cards)
+
+def decode_cards(encoded):
+    if isinstance(encoded, tuple): return list(encoded)
+    return [CARDS[card_id] for card_id in encoded]
+
+def decode_hand_record(record):
+    """Rebuilds the full hand, as `parse_and_calculate_hand` returns it"""
+    players = {}
+    for player_id, seat, initial_stack, hole_cards, win_post_rake_fees in record[PLAYERS]:
+        player = Player(id=player_id, seat=seat, initial_stack=initial_stack)
+        if hole_cards is not None: player.hole_cards = decode_cards(hole_cards)
+        player.win_post_rake_fees = win_post_rake_fees
+        players[player_id] = player
+    player_ids = list(players.keys())
+
+    hand = Hand(id=record[ID], small_blind=record[SMALL_BLIND], big_blind=record[BIG_BLIND], date=record[DATE])
+    hand.players = players
+    hand.pot = record[POT]
+    hand.rake = record[RAKE]
+    hand.jackpot_fees = record[JACKPOT_FEES]
+    hand.blinds = [(player_ids[player_i], blind) for player_i, blind in record[BLINDS]]
+    hand.board = decode_cards(record[BOARD])
+
+    prev_street_state = None
+    for street, encoded_actions in zip(STREETS, record[STREET_ACTIONS]):
+        actions = [
+            Action(player_id=player_ids[player_i], action=action, seat=players[player_ids[player_i]].seat, amount=amount)
+            for player_i, action, amount in encoded_actions
+        ]
+        if prev_street_state is None:
+            street_state = parse_bets_and_new_stacks(hand, actions, players_to_stacks(players), 0, blinds=hand.blinds)
+        else:
+            street_state = parse_bets_and_new_stacks(hand, actions, prev_street_state.new_stacks, prev_street_state.new_pot)
+        setattr(hand, street, street_state)
+        prev_street_state = street_state
+
+    calculate_losses(hand)
+    calculate_winlosses(hand)
+
+    hand.error = record[ERROR]
+    if record[PREFLOP_CALL_I] is not None:
+        hand.preflop.call = hand.preflop.actions[record[PREFLOP_CALL_I]]
+    if record[HAS_POSITIONS]:
+        set_positions(hand, calculate_positions_for_hand(hand))
+
+    return hand
+
+def calculate_all_in_columns(hands):
+    """
+    Fills in the all-in equity and EV columns of the parsed `LazyHand`s with an all in. Matchups
+    that only differ by suits are scored once (see `AllInEquity.runout_pot_shares`)
+    """
+    all_in_street_i = COLUMN_INDEXES['all_in_street']
+    for hand in hands:
+        row = hand.record[COLUMN_VALUES]
+        if row[all_in_street_i] < 0: continue
+        # Not kept decoded, as most hands are never looked at again
+        row = (*row[:all_in_street_i], *calculate_all_in_ev(decode_hand_record(hand.record)), *row[all_in_street_i + 3:])
+        hand.record = (*hand.record[:COLUMN_VALUES], row)
+
+class LazyHand(Mapping):
+    """
+    A read only hand, which is only decoded from its record when something other than its id,
+    date or error is looked up. Most commands only look at those for most hands
+    """
+    __slots__ = ['record', 'decoded']
+
+    def __init__(self, record):
+        self.record = record
+        self.decoded = None
+
+    def hand(self):
+        if self.decoded is None: self.decoded = decode_hand_record(self.record)
+        return self.decoded
+
+    def column_values(self):
+        """The row of the hand in `HandColumns`"""
+        return self.record[COLUMN_VALUES]
+
+    def __getitem__(self, key):
+        if key == 'id': return self.record[ID]
+        if key == 'date': return self.record[DATE]
+        if key == 'error':
+            if self.record[ERROR] is None: raise KeyError(key)
+            return self.record[ERROR]
+        return self.hand()[key]
+
+    def __contains__(self, key):
+        if key == 'error': return self.record[ERROR] is not None
+        return key in self.hand()
+
+    def __iter__(self):
+        return iter(self.hand())
+
+    def __len__(self):
+        return len(self.hand())
+
+    def __reduce__(self):
+        # Only the record is pickled (for the disk cache), never the decoded hand
+        return (LazyHand, (self.record,))
@@ -0,0 +1,231 @@
+"""The loaded hands, plus the indexes that the REPL commands use to look them up"""
+
+from bisect import bisect_left
+from collections import ChainMap
+from datetime import timedelta
+from heapq import merge
+from itertools import chain
+
+import numpy as np
+
+from GGPokerHandHistoryParser.GGPokerCraftFileHelpers import load_all_hands, find_unloaded_sources, load_sources
+from GGPokerHandHistoryParser.DownloadsManifest import read_last_hand_dates
+from GGPokerHandHistoryParser.HandColumns import build_hand_columns, concat_hand_columns, take_hand_columns, insert_hand_columns
+from GGPokerHandHistoryParser.HandFilters import filter_hands_mask
+from GGPokerHandHistoryParser.StageTimings import timed_stage
+
+# Hands further apart than this are in different sessions
+SESSION_GAP = timedelta(minutes=30)
+
+def load_hand_store(hand_store=None, pool=None, quiet=False):
+    """
+    Loads any new hands, reusing the hands and indexes of the previous `hand_store`.
+    The previous hand store is left untouched, so it can still be used while this loads
+    """
+    previous_hands_per_file = hand_store['hands_per_file'] if hand_store else {}
+    known_hands = hand_store['id_index']['by_id'] if hand_store else None
+    return update_hand_store(hand_store, load_all_hands(previous_hands_per_file, pool, quiet, known_hands))
+
+def load_recent_hand_store(hand_store, n_hands, pool=None, quiet=False):
+    """
+    Like `load_hand_store`, but only loads the files that could have one of the last `n_hands`
+    analysable hands, so `find_recent_analysable_hands` answers in about the same time however many
+    files there are. Older files are left for the next `load_hand_store`.
+    A file is only known to have older hands by the date of its last hand, which is recorded the
+    first time it is loaded, so files that haven't been loaded before are always loaded
+    """
+    previous_hands_per_file = hand_store['hands_per_file'] if hand_store else {}
+    hands_per_file, unloaded_sources = find_unloaded_sources(previous_hands_per_file)
+    if len(unloaded_sources) == 0:
+        return update_hand_store(hand_store, hands_per_file)
+
+    if hand_store is not None and hands_per_file.keys() == previous_hands_per_file.keys():
+        recent_hands = find_recent_analysable_hands(hand_store, n_hands)
+    else:
+        recent_hands = find_last_analysable_hands(sort_hands_by_date(chain(*hands_per_file.values())), n_hands)
+
+    # The files without a last hand date all at once, then the others a file at a time, newest
+    # first. Files without hands are left out
+    last_hand_dates = read_last_hand_dates()
+    undated_sources = {key: source for key, source in unloaded_sources.items() if key not in last_hand_dates}
+    dated_keys = [key for key in unloaded_sources if last_hand_dates.get(key) is not None]
+    dated_keys.sort(key=lambda key: last_hand_dates[key], reverse=True)
+    batches = [(None, undated_sources)] + [(last_hand_dates[key], {key: unloaded_sources[key]}) for key in dated_keys]
+
+    # Hands loaded here go in the first map, so later files don't parse them again
+    seen_hands = ChainMap({}, hand_store['id_index']['by_id'] if hand_store else {})
+    n_loaded = 0
+    for last_date, sources in batches:
+        if len(sources) == 0: continue
+        # Every file after this one only has older hands too
+        if last_date is not None and len(recent_hands) == n_hands and last_date < recent_hands[0]['date']: break
+
+        loaded_hands_per_file = load_sources(sources, pool, quiet=True, known_hands=seen_hands)
+        hands_per_file.update(loaded_hands_per_file)
+        for hand in chain(*loaded_hands_per_file.values()): seen_hands.setdefault(hand['id'], hand)
+        recent_hands = find_last_analysable_hands(
+            sort_hands_by_date(chain(recent_hands, *loaded_hands_per_file.values())),
+            n_hands
+        )
+        n_loaded += len(sources)
+
+    if not quiet: print(f'Loaded the newest {n_loaded} of {len(unloaded_sources)} new files')
+    return update_hand_store(hand_store, hands_per_file)
+
+def update_hand_store(hand_store, hands_per_file):
+    """The hand store for `hands_per_file`, only adding the new files if none were removed"""
+    previous_hands_per_file = hand_store['hands_per_file'] if hand_store else {}
+    if hand_store is None or not previous_hands_per_file.keys() <= hands_per_file.keys():
+        return build_hand_store(hands_per_file)
+
+    # In the order of `hands_per_file`, so the hand store is the same as one built from scratch
+    new_keys = [key for key in hands_per_file if key not in previous_hands_per_file]
+    if len(new_keys) == 0:
+        return hand_store
+
+    columns_per_file = {
+        **hand_store['columns_per_file'],
+        **{key: build_file_columns(hands_per_file[key]) for key in new_keys},
+    }
+    return add_files_to_hand_store(hand_store, hands_per_file, columns_per_file, new_keys)
+
+def build_hand_store(hands_per_file):
+    empty_hand_store = {
+        'id_index': empty_id_index(),
+        'hands': [],
+        'columns': build_hand_columns([]),
+        'filter_indexes': {},
+    }
+    columns_per_file = {key: build_file_columns(hands) for key, hands in hands_per_file.items()}
+    return add_files_to_hand_store(empty_hand_store, hands_per_file, columns_per_file, list(hands_per_file))
+
+def build_file_columns(hands):
+    with timed_stage('build_file_columns', len(hands)):
+        return build_hand_columns([hand.column_values() for hand in hands])
+
+def add_files_to_hand_store(hand_store, hands_per_file, columns_per_file, new_keys):
+    """
+    Returns a new hand store with the hands of the `new_keys` files added. The files of overlapping
+    exports share hands, so a hand ID that is already in the hand store is left out
+    """
+    with timed_stage('add_to_id_index'):
+        by_id = {**hand_store['id_index']['by_id']}
+        new_hands = []
+        new_columns = []
+        for key in new_keys:
+            is_new = np.zeros(len(hands_per_file[key]), dtype=bool)
+            for i, hand in enumerate(hands_per_file[key]):
+                if hand['id'] in by_id: continue
+                by_id[hand['id']] = hand
+                new_hands.append(hand)
+                is_new[i] = True
+            new_columns.append(take_hand_columns(columns_per_file[key], is_new))
+
+        id_index = {
+            'by_id': by_id,
+            'sorted_ids': list(merge(hand_store['id_index']['sorted_ids'], sorted(hand['id'] for hand in new_hands))),
+        }
+
+    with timed_stage('merge_into_date_order', len(new_hands)):
+        date_order = merge_into_date_order(hand_store, new_hands, concat_hand_columns(new_columns))
+    return {
+        'hands_per_file': hands_per_file,
+        'id_index': id_index,
+        'columns_per_file': columns_per_file,
+        **date_order,
+        # Built as `f` commands need them, see `HandFilters`
+        'filter_indexes': {},
+    }
+
+def merge_into_date_order(hand_store, new_hands, new_columns):
+    """
+    The `hands` and `columns` of the hand store with the new hands added in date order. Only the
+    new hands are sorted, then each is placed by binary search, after any hands with the same date
+    as a stable sort would
+    """
+    order = np.argsort(new_columns['date'], kind='stable')
+    new_columns = take_hand_columns(new_columns, order)
+    new_indexes = np.searchsorted(hand_store['columns']['date'], new_columns['date'], side='right') + np.arange(len(order))
+
+    is_new = np.zeros(len(hand_store['hands']) + len(new_hands), dtype=bool)
+    is_new[new_indexes] = True
+    hands = iter(hand_store['hands'])
+    sorted_new_hands = iter([new_hands[i] for i in order])
+
+    return {
+        'hands': [next(sorted_new_hands) if is_new_i else next(hands) for is_new_i in is_new.tolist()],
+        'columns': insert_hand_columns(hand_store['columns'], new_columns, new_indexes),
+    }
+
+def empty_id_index():
+    return {
+        # hand id -> hand
+        'by_id': {},
+        # for prefix lookups
+        'sorted_ids': [],
+    }
+
+def find_recent_analysable_hands(hand_store, n_hands):
+    """The last `n_hands` analysable hands, oldest first, with each hand ID once"""
+    return find_last_analysable_hands(hand_store['hands'], n_hands)
+
+def find_last_analysable_hands(hands, n_hands):
+    """The last `n_hands` analysable hands of the date sorted `hands`, oldest first, with each hand ID once"""
+    hands_by_id = {}
+    for hand in reversed(hands):
+        if len(hands_by_id) == n_hands: break
+        if hand['id'] in hands_by_id: continue
+        if 'error' in hand: continue
+        hands_by_id[hand['id']] = hand
+    result_hands = list(hands_by_id.values())
+    result_hands.sort(key=lambda hand: hand['date'])
+    return result_hands
+
+def find_hands_by_date(hand_store, start, end):
+    """The hands played from `start` up to, but not including, `end`, in date order"""
+    dates = hand_store['columns']['date']
+    start_i = np.searchsorted(dates, np.datetime64(start, 's'), side='left')
+    end_i = np.searchsorted(dates, np.datetime64(end, 's'), side='left')
+    return hand_store['hands'][start_i:end_i]
+
+def find_last_session_hands(hand_store):
+    """The hands since the last gap of more than `SESSION_GAP` between hands"""
+    dates = hand_store['columns']['date']
+    if len(dates) == 0: return []
+    gap_indexes = np.flatnonzero(np.diff(dates) > np.timedelta64(SESSION_GAP))
+    start_i = gap_indexes[-1] + 1 if len(gap_indexes) else 0
+    return hand_store['hands'][start_i:]
+
+def find_filtered_hands(hand_store, expression):
+    """The hands matching the filter expression (see `HandFilters`), in date order"""
+    mask = filter_hands_mask(hand_store['columns'], expression, hand_store['filter_indexes'])
+    hands = hand_store['hands']
+    return [hands[i] for i in np.flatnonzero(mask).tolist()]
+
+def sort_hands_by_date(hands):
+    return sorted(hands, key=lambda hand: hand['date'])
+
+def find_hands_by_id(id_index, hand_id):
+    hand = id_index['by_id'].get(hand_id)
+    return [] if hand is None else [hand]
+
+def find_ids_by_prefix(id_index, prefix):
+    sorted_ids = id_index['sorted_ids']
+    ids = []
+    for i in range(bisect_left(sorted_ids, prefix), len(sorted_ids)):
+        if not sorted_ids[i].startswith(prefix): break
+        ids.append(sorted_ids[i])
+    return ids
+
+def hand_store_lookups(hand_store):
+    """The lookups the REPL commands use, so they can run on `HandDatabase` instead"""
+    return {
+        'hands_by_id': lambda hand_id: find_hands_by_id(hand_store['id_index'], hand_id),
+        'ids_by_prefix': lambda prefix: find_ids_by_prefix(hand_store['id_index'], prefix),
+        'all_hands': lambda: hand_store['hands'],
+        'recent_analysable_hands': lambda n_hands: find_recent_analysable_hands(hand_store, n_hands),
+        'hands_by_date': lambda start, end: find_hands_by_date(hand_store, start, end),
+        'last_session_hands': lambda: find_last_session_hands(hand_store),
+        'hand_columns': lambda: hand_store['columns'],
+        'filtered_hands': lambda expression: find_filtered_hands(hand_store, expression),
+    }
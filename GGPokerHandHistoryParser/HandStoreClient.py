@@ -0,0 +1,57 @@
+"""
+Client for the hand store server (see `GGPokerHandHistoryServer.py`), which keeps the parsed hands
+loaded so scripts don't each have to load them again.
+
+Requests and responses are one line of JSON each, over a Unix socket. This only imports the
+standard library, so that clients start quickly.
+"""
+
+import json
+import socket
+from pathlib import Path
+
+SOCKET_PATH = Path(Path.home(), Path('.GGPokerHandHistoryParser.sock'))
+CONNECT_TIMEOUT_SECONDS = 0.5
+
+class HandStoreServerException(Exception):
+    "Raised when the server could not answer a query"
+    pass
+
+def is_hand_store_server_supported():
+    # Unix sockets are missing from some Windows builds of Python
+    return hasattr(socket, 'AF_UNIX')
+
+def connect_to_hand_store_server():
+    """Returns a connected socket, or None if the server isn't running"""
+    if not is_hand_store_server_supported(): return None
+
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(CONNECT_TIMEOUT_SECONDS)
+    try:
+        client.connect(str(SOCKET_PATH))
+    except OSError:
+        client.close()
+        return None
+    # Queries like exports can take a while to answer
+    client.settimeout(None)
+    return client
+
+def query_hand_store_server(query, **args):
+    """
+    Returns the result of the query (see `HandStoreServer.QUERIES`), or None if the server isn't
+    running
+    """
+    client = connect_to_hand_store_server()
+    if client is None: return None
+
+    with client, client.makefile('rwb') as stream:
+        stream.write(json.dumps({'query': query, **args}).encode('utf-8') + b'\n')
+        stream.flush()
+        line = stream.readline()
+
+    if not line:
+        raise HandStoreServerException(f'No response to `{query}` from the hand store server')
+    response = json.loads(line)
+    if 'error' in response:
+        raise HandStoreServerException(response['error'])
+    return response['result']
@@ -0,0 +1,120 @@
+"""
+Serves the loaded hand store to other scripts over a Unix socket, see `HandStoreClient` for the
+protocol and `GGPokerHandHistoryServer.py` to run it.
+"""
+
+import io
+import json
+import os
+import socketserver
+import traceback
+from pathlib import Path
+
+import numpy as np
+
+from GGPokerHandHistoryParser.HandStoreClient import SOCKET_PATH, is_hand_store_server_supported, connect_to_hand_store_server
+from GGPokerHandHistoryParser.HandStore import find_hands_by_id, find_recent_analysable_hands
+from GGPokerHandHistoryParser.HandColumns import filter_hand_columns
+from GGPokerHandHistoryParser.PrintHelpers import print_hand, print_hand_error, print_hand_short
+from GGPokerHandHistoryParser.CsvExportHelpers import export_hands_to_csv
+from GGPokerHandHistoryParser.Utils import DOWNLOADS_DIR
+
+N_RECENT_HANDS = 10
+
+def query_ping(hand_store):
+    return {'n_hands': len(hand_store['hands'])}
+
+def query_hand(hand_store, id):
+    """The hands with the ID, printed in full"""
+    return [
+        format_hand_result(hand, print_hand_error if 'error' in hand else print_hand)
+        for hand in find_hands_by_id(hand_store['id_index'], id)
+    ]
+
+def query_recent(hand_store, n=N_RECENT_HANDS):
+    return [format_hand_result(hand, print_hand_short) for hand in find_recent_analysable_hands(hand_store, n)]
+
+def query_count(hand_store, filters=()):
+    """The number of hands matching the filters (see `HandColumns.filter_hand_columns`)"""
+    return int(np.count_nonzero(filter_hand_columns(hand_store['columns'], filters)))
+
+def query_columns(hand_store, names, filters=()):
+    """The values of the columns, for the hands matching the filters"""
+    mask = filter_hand_columns(hand_store['columns'], filters)
+    return {name: format_json_column(hand_store['columns'][name][mask]) for name in names}
+
+def query_export(hand_store, append=True):
+    """Exports the hands to the CSV the REPL exports to, which clients can't choose"""
+    path = Path(Path(DOWNLOADS_DIR), Path('hands.csv'))
+    n_hands = export_hands_to_csv(path, hand_store['columns'], append)
+    return {'path': str(path), 'n_hands': n_hands}
+
+# The query functions by name, with the arguments clients may pass them
+QUERIES = {
+    'ping': (query_ping, ()),
+    'hand': (query_hand, ('id',)),
+    'recent': (query_recent, ('n',)),
+    'count': (query_count, ('filters',)),
+    'columns': (query_columns, ('names', 'filters')),
+    'export': (query_export, ('append',)),
+}
+
+def format_hand_result(hand, print_func):
+    # Printed to the result rather than `sys.stdout`, which the whole process shares
+    output = io.StringIO()
+    print_func(hand, file=output)
+
+    return {
+        'id': hand['id'],
+        'date': str(hand['date']),
+        'error': hand.get('error'),
+        'text': output.getvalue(),
+    }
+
+def format_json_column(values):
+    if values.dtype.kind == 'M': return values.astype(str).tolist()
+    return values.tolist()
+
+def handle_request(shared_hand_store, line):
+    try:
+        request = json.loads(line)
+        query = request.pop('query', None)
+        if query not in QUERIES:
+            raise Exception(f'Unknown query `{query}`')
+        query_func, arg_names = QUERIES[query]
+        unknown_args = [name for name in request if name not in arg_names]
+        if unknown_args:
+            raise Exception(f'Unknown arguments for `{query}`: {", ".join(unknown_args)}')
+        # The watcher may swap in a new hand store at any time, the query sticks to the current one
+        return {'result': query_func(shared_hand_store['hand_store'], **request)}
+    except Exception as e:
+        traceback.print_exc()
+        return {'error': f'{type(e).__name__}: {e}'}
+
+class HandStoreRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            response = handle_request(self.server.shared_hand_store, line)
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+def serve_hand_store(shared_hand_store):
+    """Answers queries on the shared hand store (see `DownloadsWatcher`) until interrupted"""
+    if not is_hand_store_server_supported():
+        raise Exception('Unix sockets are not supported on this platform')
+
+    existing_server = connect_to_hand_store_server()
+    if existing_server is not None:
+        existing_server.close()
+        raise Exception(f'A hand store server is already running on {SOCKET_PATH}')
+    # Left behind by a server that didn't shut down cleanly
+    if SOCKET_PATH.exists(): os.unlink(SOCKET_PATH)
+
+    with socketserver.UnixStreamServer(str(SOCKET_PATH), HandStoreRequestHandler) as server:
+        # Only for this user's processes, as queries read the hands and write the export
+        os.chmod(SOCKET_PATH, 0o600)
+        server.shared_hand_store = shared_hand_store
+        try:
+            server.serve_forever()
+        finally:
+            os.unlink(SOCKET_PATH)
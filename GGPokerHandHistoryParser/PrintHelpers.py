@@ -1,63 +1,102 @@
+import math
 import re
 import pyperclip
 from parse import *
 
 from GGPokerHandHistoryParser.Calculations import calculate_effective_stack_size_on_flop, calculate_positions, get_round_aggressor
-from GGPokerHandHistoryParser.Utils import InvalidSearchException, POSTFLOP_SEAT_ORDER, SUIT_LETTERS, RANKS
+from GGPokerHandHistoryParser.Utils import InvalidSearchException, POSTFLOP_SEAT_ORDER, SUIT_LETTERS, RANKS, STREETS
+from GGPokerHandHistoryParser.HandColumns import COLUMN_INDEXES
+from GGPokerHandHistoryParser.HandRecords import LazyHand
+from GGPokerHandHistoryParser.AllInEquity import calculate_all_in_ev
+from GGPokerHandHistoryParser.RangeEquity import cached_flop_range_equity
 
 def print_main_loop_instructions():
     print(f'Enter command, e.g.: ')
     print(f'- r - show recent analysable hands (where the hero reaches the flop, without limp or check)')
-    print(f'- #RC1800277957 - show hand with the given hand ID (requires extraction)')
+    print(f'- #RC1800277957 - show hand with the given hand ID (TAB completes partial IDs)')
     print(f'- l - repeat the last search')
     print(f'- h - show search history')
     print(f'- c - `c btn co lj` to print heads up ranges for BTN call, vs CO 3Bet vs LJ RFI')
     print(f'- a - show all hands')
+    print(f'- d - `d 2026-10-01 2026-10-07` to show the hands from the first day to the last, or `d 2026-10-01` for one day')
+    print(f'- t - show today\'s hands')
+    print(f'- s - show the hands of the last session')
+    print(f'- f - `f seat = BTN and opponent_seat = BB and bb = 0.05` to show the hands matching a filter, `f` for the fields')
+    print(f'- q - work out the range vs range flop equities of every hand (slow), which are then shown with the hands, or `q #RC1800277957` for one hand')
     print(f'- e - export hand history as a CSV')
-
-def print_hand_title(hand):
-    print(f'{hand["id"]} - {hand["date"]}')
-
-def print_hand_error(hand):
-    print_hand_title(hand)
-    print(f'  {hand["error"]}')
-
-def print_hand(hand, wait_and_copy_json=None):
-    print()
-    print_hand_title(hand)
-    print_position('oop', hand)
-    print_position('ip', hand)
-    print(f'  Board')
-    print(f'    {format_cards(hand.get("board", []), sort=False)}')
-    print(f'  Starting Pot')
-    print(f'    ${hand["preflop"]["new_pot"]:.2f}')
-    print(f'  Effective Stack')
-    print(f'    ${calculate_effective_stack_size_on_flop(hand):.2f}')
-    print_actions('preflop', hand, include_folds=False, include_aggressor=True)
-
-    print(f'  -------------------------')
-
-    print_actions('flop', hand, board_cards = (0, 3))
-    print_actions('turn', hand, board_cards = (3, 4))
-    print_actions('river', hand, board_cards = (4, 5))
+    print(f'- p - show how long each stage of the last command took')
+
+def print_hand_title(hand, file=None):
+    print(f'{hand["id"]} - {hand["date"]}', file=file)
+
+def print_hand_error(hand, file=None):
+    print_hand_title(hand, file=file)
+    print(f'  {hand["error"]}', file=file)
+
+def print_hand(hand, wait_and_copy_json=None, file=None):
+    print(file=file)
+    print_hand_title(hand, file=file)
+    print_position('oop', hand, file=file)
+    print_position('ip', hand, file=file)
+    print(f'  Board', file=file)
+    print(f'    {format_cards(hand.get("board", []), sort=False)}', file=file)
+    print(f'  Starting Pot', file=file)
+    print(f'    ${hand["preflop"]["new_pot"]:.2f}', file=file)
+    print(f'  Effective Stack', file=file)
+    print(f'    ${calculate_effective_stack_size_on_flop(hand):.2f}', file=file)
+    print_flop_range_equity(hand, file=file)
+    print_actions('preflop', hand, include_folds=False, include_aggressor=True, file=file)
+
+    print(f'  -------------------------', file=file)
+
+    print_actions('flop', hand, board_cards = (0, 3), file=file)
+    print_actions('turn', hand, board_cards = (3, 4), file=file)
+    print_actions('river', hand, board_cards = (4, 5), file=file)
+    print_all_in_ev(hand, file=file)
 
     if wait_and_copy_json:
-        print(f'')
+        print(f'', file=file)
         pyperclip.copy(wait_and_copy_json)
-        print(f'Copied Desktop Postflop JSON to clipboard.')
+        print(f'Copied Desktop Postflop JSON to clipboard.', file=file)
         input(f'Press ENTER to continue ')
-        print(f'-------------------------')
+        print(f'-------------------------', file=file)
+    else:
+        print(file=file)
+
+def print_flop_range_equity(hand, file=None):
+    """
+    The equities of the ranges on the flop, and of the hero's hand against the other range (see
+    `RangeEquity`), when they have been worked out already, as that takes a while
+    """
+    equity = cached_flop_range_equity(hand)
+    if equity is None: return
+    other_position = 'IP' if hand['oop']['player_id'] == 'Hero' else 'OOP'
+    print(f'  Flop Equity', file=file)
+    print(f'    OOP {equity["oop"]:.1%}, IP {equity["ip"]:.1%}, Hero\'s hand {equity["hero"]:.1%} vs the {other_position} range', file=file)
+
+def print_all_in_ev(hand, file=None):
+    """
+    The hero's all-in adjusted result against the actual one (see `AllInEquity`), from the hand's
+    columns when it was loaded, or worked out for a hand that was just parsed
+    """
+    if isinstance(hand, LazyHand):
+        row = hand.column_values()
+        street_i, equity, ev = (row[COLUMN_INDEXES[name]] for name in ('all_in_street', 'hero_all_in_equity', 'hero_ev_win_loss_post_rake_fees'))
     else:
-        print()
+        street_i, equity, ev = calculate_all_in_ev(hand)
+    if street_i < 0: return
+    equity_text = 'cards not shown' if math.isnan(equity) else f'equity {equity:.1%}'
+    print(f'  All In ({STREETS[street_i]})', file=file)
+    print(f'    {equity_text}, EV ${ev:.2f}, actual ${hand["players"]["Hero"]["win_loss_post_rake_fees"]:.2f}', file=file)
 
-def print_hand_short(hand):
+def print_hand_short(hand, file=None):
     if 'error' in hand: error_suffix = f'not analysable ({hand["error"]})'
     else: error_suffix = 'Analysable'
 
     cards = format_cards(hand["players"]["Hero"]["hole_cards"])
-    print(f'{hand["id"]} - {cards} - {hand["date"]} - {error_suffix}')
+    print(f'{hand["id"]} - {cards} - {hand["date"]} - {error_suffix}', file=file)
 
-def print_position(position_key, hand):
+def print_position(position_key, hand, file=None):
     position = hand[position_key]
     player_id = position['player_id']
     player = hand['players'][player_id]
@@ -66,17 +105,17 @@ def print_position(position_key, hand):
     hero_suffix = ' Hero' if player_id == 'Hero' else ''
     hole_cards_suffix = f' {format_cards(hole_cards)}' if hole_cards else ''
 
-    print(f'  {position_key.upper()}{hero_suffix}{hole_cards_suffix}')
-    print_position_chart(position)
+    print(f'  {position_key.upper()}{hero_suffix}{hole_cards_suffix}', file=file)
+    print_position_chart(position, file=file)
 
-def print_position_chart(position):
+def print_position_chart(position, file=None):
     if position["chart"]:
-        print(f'    {position["action_description"]} ({position["chart"]["label"]})')
+        print(f'    {position["action_description"]} ({position["chart"]["label"]})', file=file)
     else:
-        print(f'    {position["action_description"]}')
+        print(f'    {position["action_description"]}', file=file)
 
     for line in format_range_wrapped(position['range'], indent='      ', width=79):
-        print(line)
+        print(line, file=file)
 
 def print_call_and_raise_range(search_term):
     chart_inputs = parse_range_search_term(search_term)
@@ -115,12 +154,12 @@ def parse_range_search_term(search_term):
         }
     }
 
-def print_actions(round_key, hand, include_folds=True, include_aggressor=False, board_cards=(0,0)):
+def print_actions(round_key, hand, include_folds=True, include_aggressor=False, board_cards=(0,0), file=None):
     if round_key not in hand: return
 
     folds_suffix = '' if include_folds else ' (excluding folds)'
     board_suffix = '' if board_cards == (0, 0) else f' {format_cards(hand["board"][board_cards[0]:board_cards[1]], sort=False)}'
-    print(f'  {round_key.capitalize()}{folds_suffix}{board_suffix}')
+    print(f'  {round_key.capitalize()}{folds_suffix}{board_suffix}', file=file)
 
     actions = hand[round_key]['actions']
     for action in actions:
@@ -132,16 +171,16 @@ def print_actions(round_key, hand, include_folds=True, include_aggressor=False,
         else:
             tail = action.get('amount', '')
 
-        print(f'    {player_display} {action["action"]} {tail}')
+        print(f'    {player_display} {action["action"]} {tail}', file=file)
     
     if not include_aggressor: return
-    print_round_aggressor(round_key, hand)
+    print_round_aggressor(round_key, hand, file=file)
 
-def print_round_aggressor(round_key, hand):
+def print_round_aggressor(round_key, hand, file=None):
     postflop_seat = get_round_aggressor(round_key, hand)
     if not postflop_seat: return
-    print(f'  {round_key.capitalize()} aggressor')
-    print(f'    {postflop_seat.upper()}')
+    print(f'  {round_key.capitalize()} aggressor', file=file)
+    print(f'    {postflop_seat.upper()}', file=file)
 
 def format_result_count(search_term, matches):
     match_hands = [hand for hand in matches if 'error' not in hand]
@@ -184,13 +223,15 @@ def format_position_stacks(position_key, hand):
 
 def format_range_wrapped(range, indent, width):
     if range is None: return [indent + 'Missing chart']
-    if len(range) == 0: return [indent + 'No hands in range']
+    # Only format the range into strings once
+    hands = list(range)
+    if len(hands) == 0: return [indent + 'No hands in range']
 
     lines = [indent]
-    for i, card in enumerate(range):
+    for i, card in enumerate(hands):
         if len(lines[-1]) + len(card) >= width:
             lines.append(indent)
-        comma = ',' if i < len(range) - 1 else ''
+        comma = ',' if i < len(hands) - 1 else ''
         lines[-1] = lines[-1] + card + comma
     return lines
 
@@ -0,0 +1,265 @@
+"""
+Range against range equity on the flop: how much of the pot each player's range (see `HandRange`)
+wins on average over every turn and river, with each combo counted by its weight (e.g. `AKs:0.5`),
+and how much each combo wins against the other range, such as the hero's hand.
+
+Combos with a card on the flop are left out of both ranges, and each combo only plays against the
+combos of the other range it doesn't share a card with. Every combo is scored on every runout at
+once (see `HandEvaluator.evaluate_combos_on_boards`). Then, on each runout, what a combo wins
+against the other range is summed from the combos sorted by score, less the combos it shares a
+card with, so no two combos are ever compared one by one.
+
+Equities are cached per pair of ranges and flop, with the suits of the flop relabelled (see
+`HandEvaluator.canonical_suits`), as the ranges are the same for every suit. Hands with the same
+ranges on the same flop share an entry, each looking up the row of its hero's combo. Only the most
+recently used entries are kept, up to `MAX_RANGE_EQUITIES`.
+"""
+
+from collections import OrderedDict, defaultdict
+
+import numpy as np
+
+from GGPokerHandHistoryParser.HandModel import CARD_IDS
+from GGPokerHandHistoryParser.HandRange import COMBOS, N_COMBOS
+from GGPokerHandHistoryParser.HandEvaluator import SUIT_PERMUTATIONS, evaluate_combos_on_boards, load_boards_without, relabel_suits
+from GGPokerHandHistoryParser.HandDiskCache import CACHE_SIZE_CAP_BYTES
+from GGPokerHandHistoryParser.StageTimings import timed_stage, take_stage_timings, merge_stage_timings
+
+# Equities by `(flop, oop_range, ip_range)` (see `hand_range_equity_key`), least recently used first
+RANGE_EQUITIES = OrderedDict()
+# An entry takes about 12KB, mostly its two float32 combo arrays, so the cache stays within the
+# disk cache's cap
+MAX_RANGE_EQUITIES = CACHE_SIZE_CAP_BYTES // (12 * 1024)
+
+def flop_range_equity(hand):
+    """
+    `{ 'oop', 'ip', 'hero' }` of an analysable hand: the equities of the OOP and IP ranges on the
+    flop, and of the hero's hand against the other player's range. None without both ranges, or
+    when either is empty
+    """
+    hand_key = hand_range_equity_key(hand)
+    if hand_key is None: return None
+    key, hero_cards, hero_is_oop = hand_key
+    range_equities = get_cached_range_equities(key)
+    if range_equities is None: range_equities = cache_range_equities(key, calculate_range_equities([key])[0])
+    return hero_range_equity(range_equities, hero_cards, hero_is_oop)
+
+def cached_flop_range_equity(hand):
+    """The `flop_range_equity` of the hand if it has been worked out already, otherwise None"""
+    hand_key = hand_range_equity_key(hand)
+    if hand_key is None: return None
+    key, hero_cards, hero_is_oop = hand_key
+    range_equities = get_cached_range_equities(key)
+    if range_equities is None: return None
+    return hero_range_equity(range_equities, hero_cards, hero_is_oop)
+
+def get_cached_range_equities(key):
+    range_equities = RANGE_EQUITIES.get(key)
+    if range_equities is not None: RANGE_EQUITIES.move_to_end(key)
+    return range_equities
+
+def cache_range_equities(key, range_equities):
+    RANGE_EQUITIES[key] = range_equities
+    RANGE_EQUITIES.move_to_end(key)
+    while len(RANGE_EQUITIES) > MAX_RANGE_EQUITIES: RANGE_EQUITIES.popitem(last=False)
+    return range_equities
+
+def calculate_flop_range_equities(hands, pool=None):
+    """
+    The `flop_range_equity` of each analysable hand, by ID. The hands are worked out a flop at a
+    time, as most of the work is scoring every combo on the flop, in the pool when given
+    """
+    hand_keys = {hand['id']: hand_range_equity_key(hand) for hand in hands if 'error' not in hand}
+    # Kept here as well as in the cache, which may not hold every key of the hands
+    equities_per_key = {}
+    keys_per_flop = defaultdict(set)
+    for hand_key in hand_keys.values():
+        if hand_key is None or hand_key[0] in equities_per_key: continue
+        range_equities = get_cached_range_equities(hand_key[0])
+        if range_equities is None: keys_per_flop[hand_key[0][0]].add(hand_key[0])
+        else: equities_per_key[hand_key[0]] = range_equities
+
+    tasks = [list(flop_keys) for flop_keys in keys_per_flop.values()]
+    results = pool.imap_unordered(calculate_range_equities_task, tasks) if pool else map(calculate_range_equities_task, tasks)
+    for flop_keys, equities, timings in results:
+        for key, range_equities in zip(flop_keys, equities):
+            equities_per_key[key] = cache_range_equities(key, range_equities)
+        merge_stage_timings(timings)
+    return {
+        hand_id: None if hand_key is None else hero_range_equity(equities_per_key[hand_key[0]], *hand_key[1:])
+        for hand_id, hand_key in hand_keys.items()
+    }
+
+def hand_range_equity_key(hand):
+    """
+    `((flop, oop_range, ip_range), hero_cards, hero_is_oop)`, with the suits of the flop relabelled
+    and the hero's cards relabelled the same way
+    """
+    oop_range = hand['oop']['range']
+    ip_range = hand['ip']['range']
+    hero_cards = hand['players']['Hero'].get('hole_cards')
+    flop = hand.get('board', [])[:3]
+    if oop_range is None or ip_range is None or hero_cards is None or len(flop) != 3: return None
+    if len(oop_range) == 0 or len(ip_range) == 0: return None
+
+    flop_ids = [CARD_IDS[card] for card in flop]
+    # Any of the relabellings that give the same flop do, as the ranges are the same for every suit
+    suits = min(SUIT_PERMUTATIONS, key=lambda suits: relabel_suits(flop_ids, suits))
+    hero_card_ids = relabel_suits([CARD_IDS[card] for card in hero_cards], suits)
+    return (relabel_suits(flop_ids, suits), oop_range, ip_range), hero_card_ids, hand['oop']['player_id'] == 'Hero'
+
+def hero_range_equity(range_equities, hero_cards, hero_is_oop):
+    combo_i = np.flatnonzero(np.all(COMBOS == hero_cards, axis=1))[0]
+    hero_combo_equities = range_equities['oop_combos'] if hero_is_oop else range_equities['ip_combos']
+    return {
+        'oop': range_equities['oop'],
+        'ip': range_equities['ip'],
+        'hero': float(hero_combo_equities[combo_i]),
+    }
+
+def calculate_range_equities_task(keys):
+    """The equities of keys with the same flop, with the timings of working them out (see `StageTimings`)"""
+    # Set aside, as a task run in this process must only send back its own timings
+    previous_timings = take_stage_timings()
+    equities = calculate_range_equities(keys)
+    task_timings = take_stage_timings()
+    merge_stage_timings(previous_timings)
+    return keys, equities, task_timings
+
+def calculate_range_equities(keys):
+    """
+    `{ 'oop', 'ip', 'oop_combos', 'ip_combos' }` of keys with the same flop: the equities of the
+    ranges, and of each combo of `COMBOS` against the other range, NaN for combos with a flop card
+    """
+    with timed_stage('score_flop_combos'):
+        flop_combos = score_flop_combos(keys[0][0])
+
+    equities = []
+    for _, oop_range, ip_range in keys:
+        with timed_stage('calculate_range_equity'):
+            oop_weights = oop_range.combo_weights()[flop_combos['combo_indexes']].astype(np.float64)
+            ip_weights = ip_range.combo_weights()[flop_combos['combo_indexes']].astype(np.float64)
+            oop_wins, oop_totals = combo_wins(flop_combos, ip_weights)
+            ip_wins, ip_totals = combo_wins(flop_combos, oop_weights)
+
+            oop_equity = divide(oop_weights @ oop_wins, oop_weights @ oop_totals)
+            equities.append({
+                'oop': oop_equity,
+                'ip': 1 - oop_equity,
+                'oop_combos': combo_equities(flop_combos, oop_wins, oop_totals),
+                'ip_combos': combo_equities(flop_combos, ip_wins, ip_totals),
+            })
+    return equities
+
+def combo_equities(flop_combos, wins, totals):
+    """Per combo of `COMBOS`, NaN for those with a flop card or nothing to play against"""
+    equities = np.full(N_COMBOS, np.nan, dtype=np.float32)
+    equities[flop_combos['combo_indexes']] = np.divide(wins, totals, out=np.full(len(wins), np.nan), where=totals > 0)
+    return equities
+
+def divide(wins, totals):
+    """NaN when there is nothing to play against, e.g. every combo of the other range is blocked"""
+    return float(wins / totals) if totals > 0 else np.nan
+
+def score_flop_combos(flop):
+    """
+    Every combo without a flop card scored on every turn and river, sorted by score on each runout,
+    among all the combos and among the combos with each card. For each combo on each runout it
+    doesn't share a card with, where its score sorts, for `combo_wins` to sum the weights up to
+    """
+    combo_indexes = np.flatnonzero(~np.any(np.isin(COMBOS, flop), axis=1))
+    combo_card_ids = COMBOS[combo_indexes]
+    runouts = load_boards_without(2, list(flop))
+    scores = evaluate_combos_on_boards(combo_card_ids, list(flop), runouts)
+    is_live = scores >= 0
+    # Indexes fit in 32 bits, which halves the memory the lookups below go through
+    live_is = np.flatnonzero(is_live).astype(np.int32)
+    runout_is, combo_is = np.divmod(live_is, len(combo_card_ids))
+
+    # The combos with each card not on the flop, as rows of the same length. Each combo is in the
+    # rows of both its cards, the lower card first, as the combos' cards are in order
+    card_ids = np.setdiff1d(np.arange(52), flop)
+    card_rows = np.searchsorted(card_ids, combo_card_ids).astype(np.int32)
+    card_combos = (np.argsort(card_rows, axis=None, kind='stable').reshape((len(card_ids), -1)) // 2).astype(np.int32)
+    n_card_combos = card_combos.shape[1]
+    combo_card_positions = np.argsort(card_combos, axis=None, kind='stable').reshape((len(combo_card_ids), 2)).astype(np.int32)
+
+    sorted_combos, sorted_positions, first_equal, after_equal = sort_scores(scores)
+    card_sorted_combos, card_sorted_positions, card_first_equal, card_after_equal = sort_scores(scores[:, card_combos])
+
+    # Positions in the sums of `combo_wins`, flattened, of each combo on each runout it is live on
+    n_sums = len(combo_card_ids) + 1
+    sorted_live_is = runout_is * len(combo_card_ids) + sorted_positions.ravel()[live_is]
+    card_rows_per_runout = len(card_ids) * n_card_combos
+    card_sums = []
+    for i in range(2):
+        card_rows_starts = runout_is * card_rows_per_runout + card_rows[combo_is, i] * n_card_combos
+        card_sorted_live_is = card_rows_starts + card_sorted_positions.ravel()[runout_is * card_rows_per_runout + combo_card_positions[combo_is, i]]
+        card_sums_starts = (runout_is * len(card_ids) + card_rows[combo_is, i]) * (n_card_combos + 1)
+        card_sums.append((
+            card_sums_starts + card_first_equal.ravel()[card_sorted_live_is],
+            card_sums_starts + card_after_equal.ravel()[card_sorted_live_is],
+            card_sums_starts + n_card_combos,
+        ))
+    return {
+        'combo_indexes': combo_indexes,
+        'combo_card_ids': combo_card_ids,
+        'sorted_combos': sorted_combos,
+        'sorted_is_live': np.take_along_axis(is_live, sorted_combos, axis=-1),
+        'card_sorted_combos': card_combos[np.arange(len(card_ids))[:, None], card_sorted_combos],
+        'card_sorted_is_live': np.take_along_axis(is_live[:, card_combos], card_sorted_combos, axis=-1),
+        'live_combos': combo_is,
+        'sums': (
+            runout_is * n_sums + first_equal.ravel()[sorted_live_is],
+            runout_is * n_sums + after_equal.ravel()[sorted_live_is],
+            runout_is * n_sums + n_sums - 1,
+        ),
+        'card_sums': card_sums,
+    }
+
+def sort_scores(scores):
+    """
+    The order of the scores along the last axis, the position of each score in that order, and
+    per position in that order the positions of the first equal score, and of the one after the
+    last equal score
+    """
+    order = np.argsort(scores, axis=-1)
+    sorted_scores = np.take_along_axis(scores, order, axis=-1)
+    positions = np.broadcast_to(np.arange(scores.shape[-1], dtype=np.int32), scores.shape)
+    sorted_positions = np.empty(scores.shape, dtype=np.int32)
+    np.put_along_axis(sorted_positions, order, positions, axis=-1)
+
+    is_first = np.ones(scores.shape, dtype=np.bool_)
+    is_first[..., 1:] = sorted_scores[..., 1:] != sorted_scores[..., :-1]
+    first_equal = np.maximum.accumulate(np.where(is_first, positions, 0), axis=-1)
+    is_last = np.ones(scores.shape, dtype=np.bool_)
+    is_last[..., :-1] = is_first[..., 1:]
+    after_equal = np.flip(np.minimum.accumulate(np.flip(np.where(is_last, positions + 1, np.int32(scores.shape[-1])), axis=-1), axis=-1), axis=-1)
+    return order, sorted_positions, first_equal, after_equal
+
+def combo_wins(flop_combos, other_weights):
+    """
+    Per combo, the weight of the other range's combos it beats (ties counting half) summed over the
+    runouts, and the weight of those it plays against, leaving out those sharing a card with it
+    """
+    # The sums of the weights of the combos before each position in score order, flattened
+    sums = cumulative_sums(np.where(flop_combos['sorted_is_live'], other_weights[flop_combos['sorted_combos']], 0.0)).ravel()
+    card_sums = cumulative_sums(np.where(flop_combos['card_sorted_is_live'], other_weights[flop_combos['card_sorted_combos']], 0.0)).ravel()
+
+    # Less the combos sharing a card with the combo, which is itself twice, so it is added back
+    weights = other_weights[flop_combos['live_combos']]
+    lower_sums, lower_or_equal_sums, total_sums = flop_combos['sums']
+    twice_wins = sums[lower_sums] + sums[lower_or_equal_sums] + weights
+    totals = sums[total_sums] + weights
+    for lower_sums, lower_or_equal_sums, total_sums in flop_combos['card_sums']:
+        twice_wins -= card_sums[lower_sums] + card_sums[lower_or_equal_sums]
+        totals -= card_sums[total_sums]
+
+    n_combos = len(other_weights)
+    return np.bincount(flop_combos['live_combos'], twice_wins, n_combos) / 2, np.bincount(flop_combos['live_combos'], totals, n_combos)
+
+def cumulative_sums(values):
+    """The sums of the values before each position along the last axis, and of them all last"""
+    sums = np.zeros((*values.shape[:-1], values.shape[-1] + 1))
+    np.cumsum(values, axis=-1, out=sums[..., 1:])
+    return sums
@@ -1,12 +1,20 @@
 import json
 import os.path
+from functools import cache, reduce
+from itertools import product
 from pathlib import Path
+import operator
+
+from GGPokerHandHistoryParser.Utils import POSTFLOP_SEAT_ORDER
+from GGPokerHandHistoryParser.HandRange import HandRange
 
 CHART_FILE_PATHS = [
     '_internal/data/PreflopCharts.json',
     'PreflopChartExtractions/PreflopCharts.json',
 ]
 
+ANY_RAISER = '<ANY>'
+
 def load_range_chart():
     for chart_path in CHART_FILE_PATHS:
         chart_path = Path(chart_path)
@@ -17,20 +25,40 @@ def load_range_chart():
 
     raise Exception('Could not find chart file')
 
-def find_chart(seat, vs_raisers):
-    range_chart = load_range_chart()
+@cache
+def load_chart_registry():
+    """
+    Indexes the charts by `(seat, vs_raisers)`, once per process.
+    `<ANY>` raisers are expanded into every seat they can match up front, so that finding a chart
+    is a dict lookup. They are kept in a separate index, as exact matches take priority over them
+    """
+    charts_by_label = load_range_chart()
+    exact_matches = {}
+    any_matches = {}
 
-    exact_matches = [
-        chart for chart in range_chart.values()
-        if chart['seat'] == seat
-        and vs_raisers_match(chart['vs_raisers'], vs_raisers, match_any=False)
-    ]
+    for chart in charts_by_label.values():
+        exact_key = (chart['seat'], tuple(chart['vs_raisers']))
+        exact_matches.setdefault(exact_key, []).append(chart)
 
-    any_matches = [
-        chart for chart in range_chart.values()
-        if chart['seat'] == seat
-        and vs_raisers_match(chart['vs_raisers'], vs_raisers, match_any=True)
-    ]
+        raiser_options = [
+            [raiser, *POSTFLOP_SEAT_ORDER] if raiser == ANY_RAISER else [raiser]
+            for raiser in chart['vs_raisers']
+        ]
+        for vs_raisers in product(*raiser_options):
+            any_matches.setdefault((chart['seat'], vs_raisers), []).append(chart)
+
+    return {
+        'exact': exact_matches,
+        'any': any_matches,
+        'charts_by_label': charts_by_label,
+    }
+
+def find_chart(seat, vs_raisers):
+    registry = load_chart_registry()
+    key = (seat, tuple(vs_raisers))
+
+    exact_matches = registry['exact'].get(key, [])
+    any_matches = registry['any'].get(key, [])
 
     if len(exact_matches) == 1: return exact_matches[0]
     if len(exact_matches) > 1: raise Exception(f"Somehow got {len(exact_matches)} exact chart matches for {seat}-{vs_raisers}")
@@ -41,7 +69,13 @@ def find_chart(seat, vs_raisers):
     return None
 
 def get_range_from_chart(chart, action_key):
+    """The range is shared between every hand using the chart, so must not be modified"""
     if not chart: return None
+    return get_range_from_chart_label(chart['label'], action_key)
+
+@cache
+def get_range_from_chart_label(label, action_key):
+    chart = load_chart_registry()['charts_by_label'][label]
 
     if action_key == 'raise':
         action_to_suffix = {
@@ -61,20 +95,11 @@ def get_range_from_chart(chart, action_key):
         raise Exception(f'Action lookup not implemented for `{action_key}`')
 
     ranges = [
-        add_suffixes(chart['actions'][action], suffix)
+        HandRange.parse(add_suffixes(chart['actions'][action], suffix))
         for action, suffix in action_to_suffix.items()
     ]
-    return sum(ranges, [])
+    return reduce(operator.or_, ranges)
 
 def add_suffixes(cards_str, suffix):
     cards = cards_str.split(',')
     return [card.strip() + suffix for card in cards if card.strip() != '']
-
-def vs_raisers_match(vs_raisers_from_chart, vs_raisers, match_any):
-    if len(vs_raisers_from_chart) != len(vs_raisers): return False
-
-    for from_chart, not_from_chart in zip(vs_raisers_from_chart, vs_raisers):
-        if from_chart == '<ANY>' and match_any: continue
-        if from_chart == not_from_chart: continue
-        return False
-    return True
@@ -0,0 +1,93 @@
+"""
+Times the stages of loading hands and of each command, for the REPL's `p` command to print.
+
+Timings are kept per stage as `{ 'n_calls', 'total', 'n_hands', 'latencies', 'n_latencies' }`,
+since the last `take_stage_timings`. Workers send theirs back with each parsed chunk (see
+`parse_hand_chunk`). The server never takes them, so only the latest `MAX_LATENCY_SAMPLES`
+latencies of each stage are kept, and the watcher thread records them too, so they are locked.
+"""
+
+from array import array
+from contextlib import contextmanager
+import threading
+import time
+
+MAX_LATENCY_SAMPLES = 10000
+
+STAGE_TIMINGS = {}
+STAGE_TIMINGS_LOCK = threading.Lock()
+
+def new_stage_timing():
+    return {
+        'n_calls': 0,
+        'total': 0.0,
+        'n_hands': 0,
+        # Seconds per call, kept compact as the per hand stages are called for every hand. Once
+        # full, each latency replaces the oldest one
+        'latencies': array('d'),
+        'n_latencies': 0,
+    }
+
+def add_latencies(timing, latencies):
+    n_free = MAX_LATENCY_SAMPLES - len(timing['latencies'])
+    timing['latencies'].extend(latencies[:n_free])
+    # Counted before the ring is written, so it starts from the oldest latency
+    timing['n_latencies'] += min(n_free, len(latencies))
+    for seconds in latencies[n_free:]:
+        timing['latencies'][timing['n_latencies'] % MAX_LATENCY_SAMPLES] = seconds
+        timing['n_latencies'] += 1
+
+def record_stage(stage, seconds, n_hands=0):
+    with STAGE_TIMINGS_LOCK:
+        timing = STAGE_TIMINGS.get(stage)
+        if timing is None: timing = STAGE_TIMINGS[stage] = new_stage_timing()
+        timing['n_calls'] += 1
+        timing['total'] += seconds
+        timing['n_hands'] += n_hands
+        add_latencies(timing, (seconds,))
+
+@contextmanager
+def timed_stage(stage, n_hands=0):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start, n_hands)
+
+def take_stage_timings():
+    """Returns the timings so far, starting again from none"""
+    with STAGE_TIMINGS_LOCK:
+        timings = dict(STAGE_TIMINGS)
+        STAGE_TIMINGS.clear()
+    return timings
+
+def copy_stage_timings():
+    """The timings so far, which can be read while stages are still being recorded"""
+    with STAGE_TIMINGS_LOCK:
+        return {stage: {**timing, 'latencies': array('d', timing['latencies'])} for stage, timing in STAGE_TIMINGS.items()}
+
+def merge_stage_timings(timings):
+    with STAGE_TIMINGS_LOCK:
+        for stage, timing in timings.items():
+            merged_timing = STAGE_TIMINGS.get(stage)
+            if merged_timing is None: merged_timing = STAGE_TIMINGS[stage] = new_stage_timing()
+            merged_timing['n_calls'] += timing['n_calls']
+            merged_timing['total'] += timing['total']
+            merged_timing['n_hands'] += timing['n_hands']
+            add_latencies(merged_timing, timing['latencies'])
+
+def format_stage_timings(timings):
+    """A table of the timings, slowest stage first. Hands/s is only for stages that count hands"""
+    lines = [f'{"stage":<32} {"calls":>8} {"total ms":>10} {"avg ms":>9} {"p95 ms":>9} {"hands/s":>10}']
+    for stage, timing in sorted(timings.items(), key=lambda item: -item[1]['total']):
+        avg = timing['total'] / timing['n_calls']
+        hands_per_second = f'{timing["n_hands"] / timing["total"]:.0f}' if timing['n_hands'] and timing['total'] else ''
+        lines.append(
+            f'{stage:<32} {timing["n_calls"]:>8} {timing["total"] * 1e3:>10.1f} {avg * 1e3:>9.3f} '
+            f'{percentile(timing["latencies"], 0.95) * 1e3:>9.3f} {hands_per_second:>10}'
+        )
+    return lines
+
+def percentile(values, fraction):
+    sorted_values = sorted(values)
+    return sorted_values[round(fraction * (len(sorted_values) - 1))]
@@ -35,8 +35,13 @@ def get_postflop_seat(player_id, hand):
     return None
     
 def find_index_where(func, iterable, from_end=False):
-    with_index = reversed(list(enumerate(iterable))) if from_end else enumerate(iterable)
-    for i, line in with_index:
+    if from_end:
+        # Index from the back rather than copying, `iterable` must be a sequence
+        for i in range(len(iterable) - 1, -1, -1):
+            if func(iterable[i]): return i
+        return None
+
+    for i, line in enumerate(iterable):
         if func(line): return i
     return None
 
@@ -0,0 +1,63 @@
+"""
+Times each stage of parsing the hand histories of `FIXTURE_FILE`, or of your downloads with
+`--downloads`, single process, so parser changes can be checked against real hands.
+
+# Deps
+See `GGPokerHandHistoryParser.py`
+
+# Run
+python3 GGPokerHandHistoryParserBenchmark.py [--downloads]
+"""
+
+from pathlib import Path
+import sys
+import time
+
+from GGPokerHandHistoryParser.GGPokerCraftFileHelpers import find_download_sources, iter_hands_lines, parse_hand_lines
+from GGPokerHandHistoryParser.GGPokerCraftExportParser import split_lines_into_segments, parse_hand_basic
+from GGPokerHandHistoryParser.DownloadsManifest import read_manifest
+
+# Generated in the PokerCraft export format, so there are no real players in it
+FIXTURE_FILE = Path(Path(__file__).parent, Path('fixtures'), Path('GG20261003-1527 - RushAndCash12345 - 0.02 - 0.05 - 6max.txt'))
+DOWNLOADS_FLAG = '--downloads'
+
+N_REPEATS = 3
+# Single core throughput the full parse should reach, so a 200k hand history parses in under a minute
+TARGET_HANDS_PER_SECOND = 4000
+
+def main():
+    hands_lines = load_hands_lines()
+    print(f'Benchmarking {len(hands_lines)} hands, best of {N_REPEATS}')
+    if len(hands_lines) == 0: return
+
+    bench('split_lines_into_segments', hands_lines, split_lines_into_segments)
+    bench('parse_hand_basic', hands_lines, parse_hand_basic)
+    hands_per_second = bench('parse_hand_lines', hands_lines, parse_hand_lines)
+
+    target_result = 'met' if hands_per_second >= TARGET_HANDS_PER_SECOND else 'NOT met'
+    print(f'Target of {TARGET_HANDS_PER_SECOND} hands/s {target_result}')
+
+def load_hands_lines():
+    """The lines of each hand of the fixture, or of the downloads with `--downloads`"""
+    if DOWNLOADS_FLAG not in sys.argv[1:]: return list(iter_hands_lines((FIXTURE_FILE, None)))
+    hands_lines = []
+    for source in find_download_sources(read_manifest()).values():
+        hands_lines.extend(iter_hands_lines(source))
+    return hands_lines
+
+def bench(label, hands_lines, func):
+    best = None
+    for _ in range(N_REPEATS):
+        start = time.perf_counter()
+        for lines in hands_lines:
+            func(lines)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    per_hand_us = best / len(hands_lines) * 1e6
+    hands_per_second = len(hands_lines) / best
+    print(f'{label:<28} {per_hand_us:10.1f} us/hand {hands_per_second:10.0f} hands/s')
+    return hands_per_second
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+"""
+Checks the precompiled line parsers against the `parse` format strings they replaced, on every
+hand of the benchmark's fixture (or of your downloads with `--downloads`) and on edge case lines,
+so parser changes can't silently change hands. The format string parsers are kept here as they
+were, as the reference.
+
+# Deps
+See `GGPokerHandHistoryParser.py`
+
+# Run
+python3 GGPokerHandHistoryParserDifferential.py [--downloads]
+"""
+
+from datetime import datetime
+import re
+import sys
+
+from parse import parse
+
+from GGPokerHandHistoryParser.Utils import STREETS, POSTFLOP_SEAT_ORDER
+from GGPokerHandHistoryParser.GGPokerCraftExportParser import SEAT_NUM_TO_SEAT, parse_hand_basic, parse_hand, parse_action, parse_blinds, dollars_without_all_in_suffix, parse_money_amount
+from GGPokerHandHistoryParser.HandModel import SEAT_INDEXES, Hand, Player
+from GGPokerHandHistoryParserBenchmark import load_hands_lines
+
+# Lines the downloads may not have, parsed for the players of `EDGE_CASE_PLAYERS`
+EDGE_CASE_PLAYERS = {'Hero': 'BTN', 'a1b2c3d4': 'SB', 'e5f6a7b8': 'BB'}
+EDGE_CASE_ACTION_LINES = [
+    'Hero: folds',
+    'Hero: checks',
+    'a1b2c3d4: bets $0.10',
+    'a1b2c3d4: bets $2.43 and is all-in',
+    'e5f6a7b8: calls $0.05',
+    'e5f6a7b8: calls $1.00 and is all-in',
+    'Hero: raises $0.10 to $0.15',
+    'Hero: raises $4.85 to $5.00 and is all-in',
+    'Uncalled bet ($0.35) returned to Hero',
+    'a1b2c3d4: shows [Ah Kd] (a pair of Kings)',
+    'e5f6a7b8: mucks hand',
+]
+EDGE_CASE_BLIND_LINES = [
+    'a1b2c3d4: posts small blind $0.02',
+    'e5f6a7b8: posts big blind $0.05',
+    'Hero: posts straddle blind $0.10',
+    'Hero: posts missed blind $1.00',
+]
+
+def main():
+    hands_lines = load_hands_lines()
+    mismatches = []
+    for lines in hands_lines:
+        mismatches.extend(compare_hand(lines))
+    mismatches.extend(compare_edge_cases())
+
+    for mismatch in mismatches[:20]: print(mismatch)
+    print(f'{len(hands_lines)} hands and {len(EDGE_CASE_ACTION_LINES) + len(EDGE_CASE_BLIND_LINES)} edge case lines, {len(mismatches)} mismatches')
+    if mismatches: sys.exit(1)
+
+def compare_hand(lines):
+    hand, segments = parse_hand_basic(lines)
+    parse_hand(segments, hand)
+    expected = reference_parse_hand(segments, hand)
+    actual = {
+        'meta': (hand.id, hand.small_blind, hand.big_blind, hand.date),
+        'players': {player_id: (player['seat'], player.initial_stack) for player_id, player in hand.players.items()},
+        'hero_cards': hand.players['Hero'].hole_cards,
+        'blinds': list(hand.blinds),
+        'board': hand.board,
+        'actions': {
+            street: [dict(action) for action in getattr(hand, street).actions]
+            for street in STREETS if getattr(hand, street) is not None
+        },
+        'shown_cards': {
+            player_id: player.hole_cards
+            for player_id, player in hand.players.items()
+            if player_id != 'Hero' and player.hole_cards is not None
+        },
+    }
+    return [
+        f'{hand.id} {field}: expected {expected[field]!r}, got {actual[field]!r}'
+        for field in expected
+        if expected[field] != actual[field]
+    ]
+
+def compare_edge_cases():
+    hand = Hand(id='#RC0', small_blind=0.02, big_blind=0.05, date=None)
+    hand.players = {
+        player_id: Player(id=player_id, seat=SEAT_INDEXES[seat], initial_stack=5.0)
+        for player_id, seat in EDGE_CASE_PLAYERS.items()
+    }
+    mismatches = []
+    for line in EDGE_CASE_ACTION_LINES:
+        expected = reference_parse_action(line, hand)
+        actual = dict(parse_action(line, hand))
+        if expected != actual: mismatches.append(f'{line!r}: expected {expected!r}, got {actual!r}')
+    expected = reference_parse_blinds(EDGE_CASE_BLIND_LINES)
+    actual = parse_blinds(EDGE_CASE_BLIND_LINES)
+    if expected != actual: mismatches.append(f'blinds: expected {expected!r}, got {actual!r}')
+    return mismatches
+
+def reference_parse_hand(segments, hand):
+    hand_id, small_blind, big_blind, date_str = parse("Poker Hand {}: Hold'em No Limit (${}/${}) - {}", segments['header'][0])
+    players = {}
+    for line in segments['seats']:
+        seat_n, player_id, stack_size_str = parse('Seat {:d}: {} (${} in chips)', line)
+        players[player_id] = (POSTFLOP_SEAT_ORDER[SEAT_NUM_TO_SEAT[seat_n]], parse_money_amount(stack_size_str))
+
+    return {
+        'meta': (hand_id, parse_money_amount(small_blind), parse_money_amount(big_blind), datetime.strptime(date_str, '%Y/%m/%d %H:%M:%S')),
+        'players': players,
+        'hero_cards': parse('Dealt to Hero [{}]', segments['hero_dealt'][0])[0].split(' '),
+        'blinds': reference_parse_blinds(segments['blinds']),
+        'board': reference_parse_board(segments),
+        'actions': {
+            street: [reference_parse_action(line, hand) for line in segments[street] if not line.startswith('***')]
+            for street in STREETS if street in segments
+        },
+        'shown_cards': reference_parse_shown_cards(segments),
+    }
+
+def reference_parse_blinds(lines):
+    bets = []
+    for line in lines:
+        parsed = parse('{}: posts {} blind ${}', line)
+        if not parsed: continue
+        player_id, _, blind_str = parsed
+        bets.append((player_id, parse_money_amount(blind_str)))
+    return bets
+
+def reference_parse_board(segments):
+    if 'river' in segments:
+        return list(parse('*** RIVER *** [{} {} {} {}] [{}]', segments['river'][0]))
+    if 'turn' in segments:
+        return list(parse('*** TURN *** [{} {} {}] [{}]', segments['turn'][0]))
+    if 'flop' in segments:
+        return list(parse('*** FLOP *** [{} {} {}]', segments['flop'][0]))
+    return []
+
+def reference_parse_action(line, hand):
+    uncalled_bet = re.match(r'Uncalled bet \(\$([\d.]+)\) returned to (\w+)', line)
+    if uncalled_bet:
+        amount_str, player_id = uncalled_bet.group(1, 2)
+        return {
+            'player_id': player_id,
+            'action': 'excess_uncalled_bet_returned',
+            'seat': hand['players'][player_id]['seat'],
+            'amount': float(amount_str)
+        }
+
+    player_id, full_action = parse('{}: {}', line)
+    if full_action in ['folds', 'checks']:
+        tail = ''
+        action = full_action
+    else:
+        action, tail = parse('{} {}', full_action)
+
+    if action == 'bets':
+        amounts = { 'amount': dollars_without_all_in_suffix(parse('${}', tail)[0]) }
+    elif action == 'calls':
+        amounts = { 'amount': dollars_without_all_in_suffix(parse('${}', tail)[0]) }
+    elif action == 'raises':
+        _, raise_to = parse('${} to ${}', tail)
+        amounts = { 'to_amount': dollars_without_all_in_suffix(raise_to) }
+    else:
+        amounts = {}
+
+    return {
+        'player_id': player_id,
+        'action': action,
+        'seat': hand['players'][player_id]['seat'],
+        **amounts
+    }
+
+def reference_parse_shown_cards(segments):
+    shown_cards = {}
+    for player_id, cards_str in (parse('{}: shows [{}', line) for line in segments['shows']):
+        if player_id == 'Hero': continue
+        shown_cards[player_id] = cards_str.split(']')[0].split(' ')
+    return shown_cards
+
+if __name__ == '__main__':
+    main()
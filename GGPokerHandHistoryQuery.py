@@ -0,0 +1,47 @@
+"""
+Answers a command from the hand store server (see `GGPokerHandHistoryServer.py`), without loading
+any hands itself.
+
+# Run
+python3 GGPokerHandHistoryQuery.py r              # recent analysable hands
+python3 GGPokerHandHistoryQuery.py RC1800277957   # show the hand with the given ID
+python3 GGPokerHandHistoryQuery.py e              # export hand history as a CSV
+"""
+
+import sys
+
+from GGPokerHandHistoryParser.HandStoreClient import query_hand_store_server, SOCKET_PATH
+
+def main():
+    if len(sys.argv) != 2:
+        print(__doc__.strip())
+        return 1
+    command = sys.argv[1].strip()
+
+    if command == 'r':
+        result = query_hand_store_server('recent')
+        if result is None: return print_no_server()
+        for hand in result: print(hand['text'], end='')
+        print()
+        print(f'r - {len(result)} analysable')
+        return 0
+
+    if command == 'e':
+        result = query_hand_store_server('export')
+        if result is None: return print_no_server()
+        print(f'Data exported to {result["path"]} ({result["n_hands"]} new hands)')
+        return 0
+
+    hand_id = command if command.startswith('#') else f'#{command}'
+    result = query_hand_store_server('hand', id=hand_id)
+    if result is None: return print_no_server()
+    if len(result) == 0: print(f'No hand with ID `{hand_id}`')
+    for hand in result: print(hand['text'], end='')
+    return 0
+
+def print_no_server():
+    print(f'The hand store server is not running on {SOCKET_PATH}, start it with `python3 GGPokerHandHistoryServer.py`')
+    return 1
+
+if __name__ == '__main__':
+    sys.exit(main())
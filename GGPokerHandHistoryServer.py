@@ -0,0 +1,34 @@
+"""
+Keeps the parsed hands loaded, loading new downloads in the background, for the stat scripts and
+`GGPokerHandHistoryQuery.py` to query over a Unix socket. Not available on Windows.
+
+# Deps
+See `GGPokerHandHistoryParser.py`
+
+# Run
+python3 GGPokerHandHistoryServer.py
+"""
+
+import multiprocessing
+
+from GGPokerHandHistoryParser.HandStore import load_hand_store
+from GGPokerHandHistoryParser.DownloadsWatcher import new_shared_hand_store, start_downloads_watcher
+from GGPokerHandHistoryParser.HandStoreServer import serve_hand_store
+from GGPokerHandHistoryParser.HandStoreClient import SOCKET_PATH
+from GGPokerHandHistoryParser.Utils import DOWNLOADS_DIR
+
+def main():
+    print(f'Download your GG PokerCraft hand history zips into your `{DOWNLOADS_DIR}` directory')
+
+    with multiprocessing.Pool() as pool:
+        shared_hand_store = new_shared_hand_store(load_hand_store(pool=pool))
+        start_downloads_watcher(shared_hand_store, pool)
+
+        print(f'Serving {len(shared_hand_store["hand_store"]["hands"])} hands on {SOCKET_PATH}, CTRL+C to stop')
+        try:
+            serve_hand_store(shared_hand_store)
+        except KeyboardInterrupt:
+            print()
+
+if __name__ == '__main__':
+    main()